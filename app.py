@@ -1,4 +1,8 @@
 import streamlit as st
+import time
+
+# Timed from here; the first run in a process is the app's cold start
+script_started = time.perf_counter()
 
 # ✅ MUST be the first Streamlit command
 st.set_page_config(
@@ -8,9 +12,13 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-from agno.agent import Agent
-from agno.models.google import Gemini
-from agno.media import Image as AgnoImage
+from senior_dev import (
+    AUTO_ROUTE, COMPLEXITY_LEVELS, PROJECT_SCALES, QUESTION_TYPES, AgentInitializationError, AnalysisRequest,
+    resolve_route
+)
+from senior_dev.budget import count_tokens
+from senior_dev.startup import ScriptTimer
+from senior_dev.ui import AssistantUI, routing_caption, show_analysis
 from typing import List
 import logging
 import tempfile
@@ -20,119 +28,11 @@ import os
 logging.basicConfig(level=logging.ERROR)
 logger = logging.getLogger(__name__)
 
-# Get API key securely
-api_key = st.secrets.get("GEMINI_API_KEY")
-
-# Agent initializer with expertly crafted prompts
-def initialize_agents(api_key: str) -> tuple:
-    try:
-        model = Gemini(id="gemini-2.0-flash-exp", api_key=api_key)
-
-        senior_developer = Agent(
-            model=model,
-            name="Senior Software Developer",
-            instructions=[
-                "You are a seasoned Senior Software Developer with 10+ years of experience across multiple technologies and domains.",
-                "Your expertise includes:",
-                "1. **Code Architecture & Design**: Design scalable, maintainable, and robust software solutions",
-                "2. **Best Practices**: Apply SOLID principles, design patterns, clean code practices",
-                "3. **Technology Stack**: Deep knowledge of modern frameworks, databases, cloud services",
-                "4. **Code Review**: Identify potential issues, security vulnerabilities, performance bottlenecks",
-                "5. **Technical Leadership**: Guide junior developers, make architectural decisions",
-                "",
-                "When answering:",
-                "- Provide production-ready code examples with comprehensive error handling",
-                "- Explain the reasoning behind architectural choices",
-                "- Consider scalability, maintainability, and performance implications",
-                "- Suggest testing strategies and deployment considerations",
-                "- Include security best practices and potential pitfalls",
-                "- Reference industry standards and proven patterns",
-                "",
-                "Always structure responses with: Problem Analysis → Solution Design → Implementation → Best Practices → Next Steps"
-            ],
-            markdown=True
-        )
-
-        ai_agent_architect = Agent(
-            model=model,
-            name="AI Agent Architect",
-            instructions=[
-                "You are an expert AI Agent Architect specializing in designing intelligent agent systems and multi-agent architectures.",
-                "Your core competencies:",
-                "1. **Agent Design Patterns**: Single agents, multi-agent systems, hierarchical architectures",
-                "2. **LLM Integration**: Prompt engineering, model selection, context management, token optimization",
-                "3. **Agent Orchestration**: Workflow design, agent communication, task delegation, state management",
-                "4. **AI Frameworks**: LangChain, AutoGen, CrewAI, Semantic Kernel, custom agent frameworks",
-                "5. **Production Deployment**: Scalable agent systems, monitoring, error handling, fallback strategies",
-                "",
-                "Approach each problem by:",
-                "- Analyzing the use case and identifying agent requirements",
-                "- Designing appropriate agent roles and responsibilities",
-                "- Creating detailed prompt templates and persona definitions",
-                "- Planning inter-agent communication and data flow",
-                "- Recommending suitable frameworks and implementation patterns",
-                "- Addressing scalability, reliability, and cost optimization",
-                "",
-                "Structure responses as: Use Case Analysis → Agent Architecture → Implementation Strategy → Framework Recommendations → Deployment Considerations"
-            ],
-            markdown=True
-        )
-
-        system_designer = Agent(
-            model=model,
-            name="System Design Expert",
-            instructions=[
-                "You are a Principal System Design Engineer with expertise in building large-scale distributed systems.",
-                "Your specializations include:",
-                "1. **Scalability Design**: Horizontal/vertical scaling, load balancing, caching strategies",
-                "2. **Distributed Systems**: Microservices, service mesh, event-driven architecture, message queues",
-                "3. **Database Design**: SQL/NoSQL selection, sharding, replication, consistency models",
-                "4. **Cloud Architecture**: AWS/GCP/Azure services, serverless, containerization, orchestration",
-                "5. **Performance & Reliability**: Monitoring, observability, fault tolerance, disaster recovery",
-                "",
-                "For each system design question:",
-                "- Start with requirements gathering and constraint analysis",
-                "- Break down the system into core components and services",
-                "- Design data models and storage solutions",
-                "- Plan API design and communication patterns",
-                "- Address scalability bottlenecks and failure scenarios",
-                "- Estimate capacity, costs, and performance metrics",
-                "- Create detailed architectural diagrams and documentation",
-                "",
-                "Response format: Requirements Analysis → High-Level Design → Detailed Components → Data Flow → Scalability & Reliability → Implementation Roadmap"
-            ],
-            markdown=True
-        )
+script_timer = ScriptTimer(script_started)
+script_timer.mark("imports")
 
-        opensource_contributor = Agent(
-            model=model,
-            name="Open Source AI Contributor",
-            instructions=[
-                "You are an experienced Open Source AI Contributor and maintainer with deep knowledge of the AI/ML ecosystem.",
-                "Your expertise covers:",
-                "1. **Project Contribution**: Finding suitable projects, understanding codebases, making meaningful contributions",
-                "2. **AI/ML Libraries**: TensorFlow, PyTorch, Hugging Face, scikit-learn, OpenAI APIs, LangChain",
-                "3. **Community Engagement**: Writing documentation, creating tutorials, mentoring newcomers",
-                "4. **Project Maintenance**: Code review, issue triage, release management, community building",
-                "5. **AI Ethics & Best Practices**: Responsible AI development, bias detection, model evaluation",
-                "",
-                "When providing guidance:",
-                "- Recommend specific projects aligned with user's interests and skill level",
-                "- Explain contribution workflows and community etiquette",
-                "- Suggest ways to add value through code, documentation, or community support",
-                "- Share insights on building reputation and network in the AI community",
-                "- Provide practical steps for getting started with contributions",
-                "- Discuss trends and opportunities in the AI open source ecosystem",
-                "",
-                "Structure advice as: Goal Assessment → Project Recommendations → Contribution Strategy → Skill Development → Community Engagement → Long-term Growth"
-            ],
-            markdown=True
-        )
-
-        return senior_developer, ai_agent_architect, system_designer, opensource_contributor
-    except Exception as e:
-        st.error(f"Error initializing agents: {str(e)}")
-        return None, None, None, None
+# Engine, worker pool, job queue and conversation memory, configured from the secrets
+ui = AssistantUI()
 
 # Main UI
 st.markdown("# 🚀 Senior Software Developer AI Assistant")
@@ -202,25 +102,8 @@ Implement the recommendations in your projects
 - Skill development paths
 """)
 
-# Question Type Selection
-st.subheader("🎯 Select Your Question Type")
-question_type = st.selectbox(
-    "Choose the type of guidance you need:",
-    [
-        "Software Development & Architecture",
-        "AI Agent System Design",
-        "System Design & Scalability",
-        "Open Source AI Contribution",
-        "Comprehensive Analysis (All Experts)"
-    ]
-)
-
-# Input field
-st.subheader("📝 Describe Your Challenge")
-user_input = st.text_area(
-    "Provide detailed information about your software development question:", 
-    height=200, 
-    placeholder="""Examples:
+# Example questions shown in the empty input
+QUESTION_PLACEHOLDER = """Examples:
 
 🏗️ Software Development:
 "I need to design a microservices architecture for an e-commerce platform that handles 1M+ users. What are the key components and how should they communicate?"
@@ -234,97 +117,120 @@ user_input = st.text_area(
 🌟 Open Source:
 "I'm a machine learning engineer looking to contribute to AI open source projects. Which projects should I focus on and how can I make meaningful contributions?"
 """
-)
 
-# Additional context options
-col1, col2, col3 = st.columns(3)
-with col1:
-    tech_stack = st.multiselect(
-        "Technology Stack:", 
-        ["Python", "JavaScript/Node.js", "Java", "Go", "Rust", "C++", "React", "Angular", "Vue.js", "Django", "FastAPI", "Spring Boot", "Docker", "Kubernetes", "AWS", "GCP", "Azure"]
+# Widget changes in the form rerun only this fragment: the form, its results and the
+# performance stats, not the static sidebar, tips and resources around them
+fragment = st.fragment if hasattr(st, "fragment") else (lambda func: func)
+
+
+@fragment
+def analysis_form():
+    timer = ScriptTimer(scope="analysis")
+    # Question Type Selection
+    st.subheader("🎯 Select Your Question Type")
+    question_type = st.selectbox(
+        "Choose the type of guidance you need:",
+        [AUTO_ROUTE] + QUESTION_TYPES
+    )
+
+    # Input field
+    st.subheader("📝 Describe Your Challenge")
+    user_input = st.text_area(
+        "Provide detailed information about your software development question:", 
+        height=200, 
+        placeholder=QUESTION_PLACEHOLDER
+    )
+    if user_input.strip():
+        input_tokens = count_tokens(user_input)
+        token_budget = ui.config.token_budget
+        if token_budget and input_tokens > token_budget.default:
+            st.caption(f"📏 About {input_tokens:,} tokens: more than the {token_budget.default:,}-token prompt budget, "
+                       "so repeated lines will be collapsed and the rest trimmed to fit")
+        else:
+            st.caption(f"📏 About {input_tokens:,} tokens")
+
+    # Additional context options
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        tech_stack = st.multiselect(
+            "Technology Stack:", 
+            ["Python", "JavaScript/Node.js", "Java", "Go", "Rust", "C++", "React", "Angular", "Vue.js", "Django", "FastAPI", "Spring Boot", "Docker", "Kubernetes", "AWS", "GCP", "Azure"]
+        )
+    with col2:
+        complexity_level = st.selectbox("Complexity Level:", COMPLEXITY_LEVELS)
+    with col3:
+        project_scale = st.selectbox("Project Scale:", PROJECT_SCALES)
+
+    stream_responses = st.checkbox(
+        "⚡ Stream responses as they are generated",
+        value=bool(st.secrets.get("STREAM_RESPONSES", True))
     )
-with col2:
-    complexity_level = st.selectbox("Complexity Level:", ["Beginner", "Intermediate", "Advanced", "Expert"])
-with col3:
-    project_scale = st.selectbox("Project Scale:", ["Personal/Small", "Startup/Medium", "Enterprise/Large", "Global Scale"])
-
-# Process button
-if st.button("🚀 Get Expert Analysis", type="primary"):
-    if not api_key:
-        st.error("❌ API Key missing! Add it to `.streamlit/secrets.toml` as GEMINI_API_KEY.")
-    elif not user_input.strip():
-        st.warning("Please provide a detailed description of your challenge.")
-    else:
-        senior_developer, ai_agent_architect, system_designer, opensource_contributor = initialize_agents(api_key)
-        if all([senior_developer, ai_agent_architect, system_designer, opensource_contributor]):
-            try:
-                # Prepare context
-                context = f"""
-                Question: {user_input}
-                Question Type: {question_type}
-                Tech Stack: {', '.join(tech_stack) if tech_stack else 'Not specified'}
-                Complexity Level: {complexity_level}
-                Project Scale: {project_scale}
-                """
-
-                # Route to appropriate agent(s)
-                if question_type == "Software Development & Architecture":
-                    with st.spinner("🏗️ Senior Developer analyzing your challenge..."):
-                        response = senior_developer.run(message=context)
-                        st.subheader("🏗️ Senior Software Developer Analysis")
-                        st.markdown(response.content)
-
-                elif question_type == "AI Agent System Design":
-                    with st.spinner("🤖 AI Agent Architect designing your system..."):
-                        response = ai_agent_architect.run(message=context)
-                        st.subheader("🤖 AI Agent Architecture Recommendations")
-                        st.markdown(response.content)
-
-                elif question_type == "System Design & Scalability":
-                    with st.spinner("🏢 System Designer creating architecture..."):
-                        response = system_designer.run(message=context)
-                        st.subheader("🏢 System Design & Architecture")
-                        st.markdown(response.content)
-
-                elif question_type == "Open Source AI Contribution":
-                    with st.spinner("🌟 Open Source Expert providing guidance..."):
-                        response = opensource_contributor.run(message=context)
-                        st.subheader("🌟 Open Source Contribution Strategy")
-                        st.markdown(response.content)
-
-                else:  # Comprehensive Analysis
-                    # Senior Developer Analysis
-                    with st.spinner("🏗️ Senior Developer analyzing..."):
-                        response = senior_developer.run(message=context)
-                        st.subheader("🏗️ Senior Developer Perspective")
-                        st.markdown(response.content)
-                        st.markdown("---")
-
-                    # AI Agent Architect Analysis
-                    with st.spinner("🤖 AI Agent Architect designing..."):
-                        response = ai_agent_architect.run(message=context)
-                        st.subheader("🤖 AI Agent Architecture Insights")
-                        st.markdown(response.content)
-                        st.markdown("---")
-
-                    # System Designer Analysis
-                    with st.spinner("🏢 System Designer architecting..."):
-                        response = system_designer.run(message=context)
-                        st.subheader("🏢 System Design Recommendations")
-                        st.markdown(response.content)
-                        st.markdown("---")
-
-                    # Open Source Contributor Guidance
-                    with st.spinner("🌟 Open Source Expert advising..."):
-                        response = opensource_contributor.run(message=context)
-                        st.subheader("🌟 Open Source Strategy")
-                        st.markdown(response.content)
 
+    # Follow-ups reuse what the experts already said
+    follow_up = False
+    if ui.conversation_enabled and ui.current_conversation().turns:
+        conversation = ui.current_conversation()
+        conversation_col1, conversation_col2 = st.columns([3, 1])
+        with conversation_col1:
+            follow_up = st.checkbox("💬 Follow-up: the experts remember this conversation", value=True)
+            st.caption(f"💬 {conversation.turns} earlier turn{'s' if conversation.turns != 1 else ''}, about {conversation.tokens():,} tokens of history")
+        with conversation_col2:
+            if st.button("🧹 New Conversation"):
+                ui.new_conversation()
+                st.rerun()
+
+    # Speculate on the form as it stands; the button press picks up whatever is done
+    if ui.prefetch_enabled and ui.api_key and user_input.strip():
+        ui.session_prefetcher().update(AnalysisRequest(
+            user_input, question_type, tech_stack, complexity_level, project_scale,
+            ui.current_conversation().history() if follow_up else {},
+        ))
+    elif ui.prefetch_enabled and "prefetcher" in st.session_state:
+        st.session_state.prefetcher.cancel()
+
+    # Process button
+    analyze_button = st.button("🚀 Get Expert Analysis", type="primary")
+    if analyze_button:
+        if not ui.api_key:
+            st.error("❌ API Key missing! Add it to `.streamlit/secrets.toml` as GEMINI_API_KEY.")
+        elif not user_input.strip():
+            st.warning("Please provide a detailed description of your challenge.")
+        else:
+            st.session_state.pop("last_analysis", None)
+            try:
+                history = ui.current_conversation().history() if follow_up else {}
+                request = AnalysisRequest(user_input, question_type, tech_stack, complexity_level, project_scale, history)
+                if ui.prefetch_enabled:
+                    st.session_state.last_prefetch = ui.session_prefetcher().claim(request)
+                if question_type == AUTO_ROUTE:
+                    request = resolve_route(request, ui.expert_router())
+                    st.caption(routing_caption(request))
+                queued = ui.quota_caption(len(request.sections))
+                if queued:
+                    st.caption(queued)
+                if ui.job_runner:
+                    ui.start_job(request, stream_responses)
+                else:
+                    responses = ui.render_analysis(request, stream_responses)
+                    if ui.conversation_enabled:
+                        ui.remember_turn(request, responses)
+
+            except AgentInitializationError as e:
+                st.error(f"Error initializing agents: {str(e)}")
+                st.error("⚠️ Agents failed to initialize. Please check your API key.")
             except Exception as e:
                 logger.error(f"Processing error: {str(e)}")
                 st.error("⚠️ An error occurred during analysis. Please try again.")
-        else:
-            st.error("⚠️ Agents failed to initialize. Please check your API key.")
+    elif st.session_state.get("last_analysis"):
+        show_analysis(st.session_state.last_analysis)
+    if ui.job_runner and ui.watched_job():
+        ui.watch_job(ui.watched_job())
+
+    ui.render_performance()
+    timer.finish()
+
+
+analysis_form()
 
 # Expert Tips Section
 st.markdown("---")
@@ -427,3 +333,5 @@ st.markdown("""
     <p>💡 <i>Elevating software development through intelligent collaboration</i></p>
 </div>
 """, unsafe_allow_html=True)
+
+script_timer.finish()
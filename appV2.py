@@ -1,4 +1,8 @@
 import streamlit as st
+import time
+
+# Timed from here; the first run in a process is the app's cold start
+script_started = time.perf_counter()
 
 # ✅ MUST be the first Streamlit command
 st.set_page_config(
@@ -8,9 +12,15 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-from agno.agent import Agent
-from agno.models.google import Gemini
-from agno.media import Image as AgnoImage
+from senior_dev import (
+    AUTO_ROUTE, COMPLEXITY_LEVELS, PROJECT_SCALES, QUESTION_TYPES, AgentInitializationError, AnalysisRequest,
+    resolve_route
+)
+from senior_dev.budget import count_tokens
+from senior_dev.startup import ScriptTimer, module_available
+from senior_dev.ui import AssistantUI, routing_caption, show_analysis
+from senior_dev.google_clients import GOOGLE_CLIENTS_AVAILABLE, GoogleClients, credentials_to_dict
+from senior_dev.docs_export import Block, ExportJob, export_document, parse_markdown
 from typing import List
 import logging
 import tempfile
@@ -19,24 +29,22 @@ import json
 from datetime import datetime
 import base64
 
-# Google API imports
-try:
-    from google.oauth2.credentials import Credentials
-    from google_auth_oauthlib.flow import Flow
-    from googleapiclient.discovery import build
-    from google.auth.transport.requests import Request
-    import google.auth.exceptions
-    GOOGLE_DOCS_AVAILABLE = True
-except ImportError:
-    GOOGLE_DOCS_AVAILABLE = False
+# Google API stack: checked here, imported once a user connects Google
+GOOGLE_DOCS_AVAILABLE = GOOGLE_CLIENTS_AVAILABLE and module_available("google_auth_oauthlib")
+if not GOOGLE_DOCS_AVAILABLE:
     st.warning("⚠️ Google API libraries not installed. Install with: pip install google-auth google-auth-oauthlib google-api-python-client")
 
 # Setup logging
 logging.basicConfig(level=logging.ERROR)
 logger = logging.getLogger(__name__)
 
-# Get API keys securely
-api_key = st.secrets.get("GEMINI_API_KEY")
+script_timer = ScriptTimer(script_started)
+script_timer.mark("imports")
+
+# Engine, worker pool, job queue and conversation memory, configured from the secrets
+ui = AssistantUI()
+
+# Get Google API keys securely
 google_client_id = st.secrets.get("GOOGLE_CLIENT_ID")
 google_client_secret = st.secrets.get("GOOGLE_CLIENT_SECRET")
 
@@ -45,17 +53,21 @@ SCOPES = [
     'https://www.googleapis.com/auth/documents',
     'https://www.googleapis.com/auth/drive.file'
 ]
+# Write each expert's section to the document as soon as it finishes
+docs_incremental_export = bool(st.secrets.get("DOCS_INCREMENTAL_EXPORT", True))
 
 class GoogleDocsIntegration:
     def __init__(self):
         self.service = None
         self.drive_service = None
+        self.credentials = None
         
     def get_auth_url(self):
         """Generate Google OAuth URL"""
         if not GOOGLE_DOCS_AVAILABLE or not google_client_id or not google_client_secret:
             return None
             
+        from google_auth_oauthlib.flow import Flow
         flow = Flow.from_client_config(
             {
                 "web": {
@@ -78,240 +90,143 @@ class GoogleDocsIntegration:
             flow.fetch_token(code=auth_code)
             credentials = flow.credentials
             
-            # Store credentials in session state
-            st.session_state.google_credentials = {
-                'token': credentials.token,
-                'refresh_token': credentials.refresh_token,
-                'token_uri': credentials.token_uri,
-                'client_id': credentials.client_id,
-                'client_secret': credentials.client_secret,
-                'scopes': credentials.scopes
-            }
+            # Store credentials and this session's API clients in session state
+            st.session_state.google_credentials = credentials_to_dict(credentials)
+            clients = GoogleClients(credentials)
+            st.session_state.google_clients = clients
             
-            self.service = build('docs', 'v1', credentials=credentials)
-            self.drive_service = build('drive', 'v3', credentials=credentials)
+            self.service = clients.docs
+            self.drive_service = clients.drive
+            self.credentials = clients.credentials
             return True
         except Exception as e:
             st.error(f"Authentication failed: {str(e)}")
             return False
     
     def load_credentials(self):
-        """Load credentials from session state"""
+        """Load credentials from session state, reusing the session's clients"""
         if 'google_credentials' not in st.session_state:
             return False
             
         try:
-            cred_dict = st.session_state.google_credentials
-            credentials = Credentials(
-                token=cred_dict['token'],
-                refresh_token=cred_dict['refresh_token'],
-                token_uri=cred_dict['token_uri'],
-                client_id=cred_dict['client_id'],
-                client_secret=cred_dict['client_secret'],
-                scopes=cred_dict['scopes']
-            )
+            clients = st.session_state.get('google_clients')
+            if clients is None:
+                clients = GoogleClients.from_dict(st.session_state.google_credentials)
+                st.session_state.google_clients = clients
             
-            # Refresh if needed
-            if credentials.expired and credentials.refresh_token:
-                credentials.refresh(Request())
+            # Refresh only when the token is close to expiry
+            if clients.ensure_fresh():
                 # Update session state with new token
-                st.session_state.google_credentials['token'] = credentials.token
+                st.session_state.google_credentials = credentials_to_dict(clients.credentials)
             
-            self.service = build('docs', 'v1', credentials=credentials)
-            self.drive_service = build('drive', 'v3', credentials=credentials)
+            self.service = clients.docs
+            self.drive_service = clients.drive
+            self.credentials = clients.credentials
             return True
         except Exception as e:
             st.error(f"Failed to load credentials: {str(e)}")
             return False
     
-    def create_document(self, title, content):
-        """Create a new Google Doc with the given content"""
-        if not self.service:
+    def export_document(self, title, blocks):
+        """Start uploading a report in the background; returns a job to poll"""
+        if not self.credentials:
             return None
-            
-        try:
-            # Create document
-            doc = {'title': title}
-            document = self.service.documents().create(body=doc).execute()
-            document_id = document.get('documentId')
-            
-            # Add content to document
-            requests = [
-                {
-                    'insertText': {
-                        'location': {'index': 1},
-                        'text': content
-                    }
-                }
-            ]
-            
-            self.service.documents().batchUpdate(
-                documentId=document_id, 
-                body={'requests': requests}
-            ).execute()
-            
-            return document_id
-        except Exception as e:
-            st.error(f"Failed to create document: {str(e)}")
+        return export_document(self.credentials, title, blocks)
+    
+    def start_export(self, title, header):
+        """Create the document now; sections are added as experts finish"""
+        if not self.credentials:
             return None
+        job = ExportJob(self.credentials, title)
+        job.add(header, slot=-1)
+        return job
     
-    def format_response_for_docs(self, question, question_type, responses):
-        """Format AI responses for Google Docs"""
+    def format_header_for_docs(self, question, question_type):
+        """Report title, timestamp and the question"""
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         
-        content = f"""Senior Software Developer AI Assistant - Analysis Report
+        blocks = parse_markdown(f"""# Senior Software Developer AI Assistant - Analysis Report
 Generated on: {timestamp}
 
-Question Type: {question_type}
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-
-QUESTION:
-{question}
-
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-
-"""
-        
-        for agent_name, response_content in responses.items():
-            content += f"""
-{agent_name.upper()}:
-{'═' * 80}
+**Question Type:** {question_type}
 
-{response_content}
-
-{'═' * 80}
-
-"""
-        
-        content += f"""
-GENERATED BY: Senior Software Developer AI Assistant
-PROJECT: https://github.com/AnnNaserNabil/senior-dev-ai-assistant
-DEVELOPER: Ann Naser Nabil (ann.n.nabil@gmail.com)
+## Question
+""")
+        return blocks + [Block(line) for line in question.splitlines() if line.strip()]
+    
+    def format_section_for_docs(self, agent_name, response_content):
+        """One expert's answer under its own heading"""
+        # Agent headings sit one level below the section heading
+        return parse_markdown(f"# {agent_name}") + parse_markdown(response_content, heading_offset=1)
+    
+    def format_footer_for_docs(self):
+        return parse_markdown("""## About
+**GENERATED BY:** Senior Software Developer AI Assistant
+**PROJECT:** https://github.com/AnnNaserNabil/senior-dev-ai-assistant
+**DEVELOPER:** Ann Naser Nabil (ann.n.nabil@gmail.com)
 
 This analysis was generated using advanced AI agents specialized in:
 - Software Development & Architecture
-- AI Agent System Design  
+- AI Agent System Design
 - System Design & Scalability
 - Open Source AI Contribution
 
 For more insights and updates, visit our project repository.
-"""
-        
-        return content
+""")
+    
+    def format_response_for_docs(self, question, question_type, responses):
+        """Format AI responses as Google Docs paragraphs"""
+        blocks = self.format_header_for_docs(question, question_type)
+        for agent_name, response_content in responses.items():
+            blocks += self.format_section_for_docs(agent_name, response_content)
+        return blocks + self.format_footer_for_docs()
 
 # Initialize Google Docs integration
 google_docs = GoogleDocsIntegration()
 
-# Agent initializer with expertly crafted prompts
-def initialize_agents(api_key: str) -> tuple:
-    try:
-        model = Gemini(id="gemini-2.0-flash-exp", api_key=api_key)
-
-        senior_developer = Agent(
-            model=model,
-            name="Senior Software Developer",
-            instructions=[
-                "You are a seasoned Senior Software Developer with 10+ years of experience across multiple technologies and domains.",
-                "Your expertise includes:",
-                "1. **Code Architecture & Design**: Design scalable, maintainable, and robust software solutions",
-                "2. **Best Practices**: Apply SOLID principles, design patterns, clean code practices",
-                "3. **Technology Stack**: Deep knowledge of modern frameworks, databases, cloud services",
-                "4. **Code Review**: Identify potential issues, security vulnerabilities, performance bottlenecks",
-                "5. **Technical Leadership**: Guide junior developers, make architectural decisions",
-                "",
-                "When answering:",
-                "- Provide production-ready code examples with comprehensive error handling",
-                "- Explain the reasoning behind architectural choices",
-                "- Consider scalability, maintainability, and performance implications",
-                "- Suggest testing strategies and deployment considerations",
-                "- Include security best practices and potential pitfalls",
-                "- Reference industry standards and proven patterns",
-                "",
-                "Always structure responses with: Problem Analysis → Solution Design → Implementation → Best Practices → Next Steps"
-            ],
-            markdown=True
-        )
-
-        ai_agent_architect = Agent(
-            model=model,
-            name="AI Agent Architect",
-            instructions=[
-                "You are an expert AI Agent Architect specializing in designing intelligent agent systems and multi-agent architectures.",
-                "Your core competencies:",
-                "1. **Agent Design Patterns**: Single agents, multi-agent systems, hierarchical architectures",
-                "2. **LLM Integration**: Prompt engineering, model selection, context management, token optimization",
-                "3. **Agent Orchestration**: Workflow design, agent communication, task delegation, state management",
-                "4. **AI Frameworks**: LangChain, AutoGen, CrewAI, Semantic Kernel, custom agent frameworks",
-                "5. **Production Deployment**: Scalable agent systems, monitoring, error handling, fallback strategies",
-                "",
-                "Approach each problem by:",
-                "- Analyzing the use case and identifying agent requirements",
-                "- Designing appropriate agent roles and responsibilities",
-                "- Creating detailed prompt templates and persona definitions",
-                "- Planning inter-agent communication and data flow",
-                "- Recommending suitable frameworks and implementation patterns",
-                "- Addressing scalability, reliability, and cost optimization",
-                "",
-                "Structure responses as: Use Case Analysis → Agent Architecture → Implementation Strategy → Framework Recommendations → Deployment Considerations"
-            ],
-            markdown=True
-        )
+def docs_export_status(polling=False):
+    """Show the background Google Docs export started from this session"""
+    job = st.session_state.docs_export
+    if polling and job.done:
+        # Finished since the last poll: rerun the page so polling stops
+        st.rerun()
+    if job.status == "done":
+        st.success("✅ Successfully saved to Google Docs!")
+        st.markdown(f"📄 [**Open your document in Google Docs**]({job.url})")
+        
+        # Show save confirmation
+        st.info(f"📋 Document saved as: **{job.title}**")
+    elif job.status == "failed":
+        st.error("❌ Failed to save to Google Docs. Please try again.")
+    else:
+        progress = f" ({job.batches_done}/{job.batches_total})" if job.batches_total else ""
+        st.info(f"📄 Saving to Google Docs...{progress}")
+        if not polling and st.button("🔄 Refresh export status"):
+            st.rerun()
+
+
+def render_docs_export():
+    """Render the export status, polling it while the upload runs"""
+    if hasattr(st, "fragment") and not st.session_state.docs_export.done:
+        @st.fragment(run_every=1.0)
+        def poll_docs_export():
+            docs_export_status(polling=True)
+        poll_docs_export()
+    else:
+        docs_export_status()
 
-        system_designer = Agent(
-            model=model,
-            name="System Design Expert",
-            instructions=[
-                "You are a Principal System Design Engineer with expertise in building large-scale distributed systems.",
-                "Your specializations include:",
-                "1. **Scalability Design**: Horizontal/vertical scaling, load balancing, caching strategies",
-                "2. **Distributed Systems**: Microservices, service mesh, event-driven architecture, message queues",
-                "3. **Database Design**: SQL/NoSQL selection, sharding, replication, consistency models",
-                "4. **Cloud Architecture**: AWS/GCP/Azure services, serverless, containerization, orchestration",
-                "5. **Performance & Reliability**: Monitoring, observability, fault tolerance, disaster recovery",
-                "",
-                "For each system design question:",
-                "- Start with requirements gathering and constraint analysis",
-                "- Break down the system into core components and services",
-                "- Design data models and storage solutions",
-                "- Plan API design and communication patterns",
-                "- Address scalability bottlenecks and failure scenarios",
-                "- Estimate capacity, costs, and performance metrics",
-                "- Create detailed architectural diagrams and documentation",
-                "",
-                "Response format: Requirements Analysis → High-Level Design → Detailed Components → Data Flow → Scalability & Reliability → Implementation Roadmap"
-            ],
-            markdown=True
-        )
 
-        opensource_contributor = Agent(
-            model=model,
-            name="Open Source AI Contributor",
-            instructions=[
-                "You are an experienced Open Source AI Contributor and maintainer with deep knowledge of the AI/ML ecosystem.",
-                "Your expertise covers:",
-                "1. **Project Contribution**: Finding suitable projects, understanding codebases, making meaningful contributions",
-                "2. **AI/ML Libraries**: TensorFlow, PyTorch, Hugging Face, scikit-learn, OpenAI APIs, LangChain",
-                "3. **Community Engagement**: Writing documentation, creating tutorials, mentoring newcomers",
-                "4. **Project Maintenance**: Code review, issue triage, release management, community building",
-                "5. **AI Ethics & Best Practices**: Responsible AI development, bias detection, model evaluation",
-                "",
-                "When providing guidance:",
-                "- Recommend specific projects aligned with user's interests and skill level",
-                "- Explain contribution workflows and community etiquette",
-                "- Suggest ways to add value through code, documentation, or community support",
-                "- Share insights on building reputation and network in the AI community",
-                "- Provide practical steps for getting started with contributions",
-                "- Discuss trends and opportunities in the AI open source ecosystem",
-                "",
-                "Structure advice as: Goal Assessment → Project Recommendations → Contribution Strategy → Skill Development → Community Engagement → Long-term Growth"
-            ],
-            markdown=True
-        )
+def export_finished_job(job, responses):
+    """Start the Google Docs export this session asked for when it queued the job"""
+    pending = st.session_state.get("job_docs_export")
+    if not pending or pending[0] != job.id:
+        return
+    del st.session_state.job_docs_export
+    _, doc_title, question, question_type = pending
+    if responses and google_docs.load_credentials():
+        formatted_content = google_docs.format_response_for_docs(question, question_type, responses)
+        st.session_state.docs_export = google_docs.export_document(doc_title, formatted_content)
 
-        return senior_developer, ai_agent_architect, system_designer, opensource_contributor
-    except Exception as e:
-        st.error(f"Error initializing agents: {str(e)}")
-        return None, None, None, None
 
 # Main UI
 st.markdown("# 🚀 Senior Software Developer AI Assistant")
@@ -356,6 +271,7 @@ if GOOGLE_DOCS_AVAILABLE and google_client_id and google_client_secret:
             if st.button("🔓 Disconnect", type="secondary"):
                 if 'google_credentials' in st.session_state:
                     del st.session_state.google_credentials
+                st.session_state.pop('google_clients', None)
                 st.rerun()
     
     st.markdown("---")
@@ -442,25 +358,8 @@ Optionally save your analysis to Google Docs for future reference
 - Skill development paths
 """)
 
-# Question Type Selection
-st.subheader("🎯 Select Your Question Type")
-question_type = st.selectbox(
-    "Choose the type of guidance you need:",
-    [
-        "Software Development & Architecture",
-        "AI Agent System Design",
-        "System Design & Scalability",
-        "Open Source AI Contribution",
-        "Comprehensive Analysis (All Experts)"
-    ]
-)
-
-# Input field
-st.subheader("📝 Describe Your Challenge")
-user_input = st.text_area(
-    "Provide detailed information about your software development question:", 
-    height=200, 
-    placeholder="""Examples:
+# Example questions shown in the empty input
+QUESTION_PLACEHOLDER = """Examples:
 
 🏗️ Software Development:
 "I need to design a microservices architecture for an e-commerce platform that handles 1M+ users. What are the key components and how should they communicate?"
@@ -474,146 +373,175 @@ user_input = st.text_area(
 🌟 Open Source:
 "I'm a machine learning engineer looking to contribute to AI open source projects. Which projects should I focus on and how can I make meaningful contributions?"
 """
-)
 
-# Additional context options
-col1, col2, col3 = st.columns(3)
-with col1:
-    tech_stack = st.multiselect(
-        "Technology Stack:", 
-        ["Python", "JavaScript/Node.js", "Java", "Go", "Rust", "C++", "React", "Angular", "Vue.js", "Django", "FastAPI", "Spring Boot", "Docker", "Kubernetes", "AWS", "GCP", "Azure"]
+# Widget changes in the form rerun only this fragment: the form, its results and the
+# performance stats, not the static sidebar, tips and resources around them
+fragment = st.fragment if hasattr(st, "fragment") else (lambda func: func)
+
+
+@fragment
+def analysis_form():
+    timer = ScriptTimer(scope="analysis")
+    # Question Type Selection
+    st.subheader("🎯 Select Your Question Type")
+    question_type = st.selectbox(
+        "Choose the type of guidance you need:",
+        [AUTO_ROUTE] + QUESTION_TYPES
     )
-with col2:
-    complexity_level = st.selectbox("Complexity Level:", ["Beginner", "Intermediate", "Advanced", "Expert"])
-with col3:
-    project_scale = st.selectbox("Project Scale:", ["Personal/Small", "Startup/Medium", "Enterprise/Large", "Global Scale"])
 
-# Google Docs Save Options
-if GOOGLE_DOCS_AVAILABLE and google_docs.load_credentials():
-    st.subheader("📄 Google Docs Options")
-    col1, col2 = st.columns(2)
+    # Input field
+    st.subheader("📝 Describe Your Challenge")
+    user_input = st.text_area(
+        "Provide detailed information about your software development question:", 
+        height=200, 
+        placeholder=QUESTION_PLACEHOLDER
+    )
+    if user_input.strip():
+        input_tokens = count_tokens(user_input)
+        token_budget = ui.config.token_budget
+        if token_budget and input_tokens > token_budget.default:
+            st.caption(f"📏 About {input_tokens:,} tokens: more than the {token_budget.default:,}-token prompt budget, "
+                       "so repeated lines will be collapsed and the rest trimmed to fit")
+        else:
+            st.caption(f"📏 About {input_tokens:,} tokens")
+
+    # Additional context options
+    col1, col2, col3 = st.columns(3)
     with col1:
-        save_to_docs = st.checkbox("💾 Save response to Google Docs", value=False)
+        tech_stack = st.multiselect(
+            "Technology Stack:", 
+            ["Python", "JavaScript/Node.js", "Java", "Go", "Rust", "C++", "React", "Angular", "Vue.js", "Django", "FastAPI", "Spring Boot", "Docker", "Kubernetes", "AWS", "GCP", "Azure"]
+        )
     with col2:
-        if save_to_docs:
-            doc_title = st.text_input("📝 Document Title:", 
-                                    value=f"AI Analysis - {datetime.now().strftime('%Y-%m-%d %H:%M')}")
-
-# Process button
-button_col1, button_col2 = st.columns([3, 1])
-with button_col1:
-    analyze_button = st.button("🚀 Get Expert Analysis", type="primary")
-with button_col2:
-    if GOOGLE_DOCS_AVAILABLE and google_docs.load_credentials():
-        st.info("📄 Ready to save to Google Docs")
-
-if analyze_button:
-    if not api_key:
-        st.error("❌ API Key missing! Add it to `.streamlit/secrets.toml` as GEMINI_API_KEY.")
-    elif not user_input.strip():
-        st.warning("Please provide a detailed description of your challenge.")
-    else:
-        senior_developer, ai_agent_architect, system_designer, opensource_contributor = initialize_agents(api_key)
-        if all([senior_developer, ai_agent_architect, system_designer, opensource_contributor]):
+        complexity_level = st.selectbox("Complexity Level:", COMPLEXITY_LEVELS)
+    with col3:
+        project_scale = st.selectbox("Project Scale:", PROJECT_SCALES)
+
+    stream_responses = st.checkbox(
+        "⚡ Stream responses as they are generated",
+        value=bool(st.secrets.get("STREAM_RESPONSES", True))
+    )
+
+    # Follow-ups reuse what the experts already said
+    follow_up = False
+    if ui.conversation_enabled and ui.current_conversation().turns:
+        conversation = ui.current_conversation()
+        conversation_col1, conversation_col2 = st.columns([3, 1])
+        with conversation_col1:
+            follow_up = st.checkbox("💬 Follow-up: the experts remember this conversation", value=True)
+            st.caption(f"💬 {conversation.turns} earlier turn{'s' if conversation.turns != 1 else ''}, about {conversation.tokens():,} tokens of history")
+        with conversation_col2:
+            if st.button("🧹 New Conversation"):
+                ui.new_conversation()
+                st.rerun()
+
+    # Google Docs Save Options (credentials checked once per run)
+    docs_connected = GOOGLE_DOCS_AVAILABLE and google_docs.load_credentials()
+    if docs_connected:
+        st.subheader("📄 Google Docs Options")
+        col1, col2 = st.columns(2)
+        with col1:
+            save_to_docs = st.checkbox("💾 Save response to Google Docs", value=False)
+        with col2:
+            if save_to_docs:
+                doc_title = st.text_input("📝 Document Title:", 
+                                        value=f"AI Analysis - {datetime.now().strftime('%Y-%m-%d %H:%M')}")
+
+    # Speculate on the form as it stands; the button press picks up whatever is done
+    if ui.prefetch_enabled and ui.api_key and user_input.strip():
+        ui.session_prefetcher().update(AnalysisRequest(
+            user_input, question_type, tech_stack, complexity_level, project_scale,
+            ui.current_conversation().history() if follow_up else {},
+        ))
+    elif ui.prefetch_enabled and "prefetcher" in st.session_state:
+        st.session_state.prefetcher.cancel()
+
+    # Process button
+    button_col1, button_col2 = st.columns([3, 1])
+    with button_col1:
+        analyze_button = st.button("🚀 Get Expert Analysis", type="primary")
+    with button_col2:
+        if docs_connected:
+            st.info("📄 Ready to save to Google Docs")
+
+    if analyze_button:
+        if not ui.api_key:
+            st.error("❌ API Key missing! Add it to `.streamlit/secrets.toml` as GEMINI_API_KEY.")
+        elif not user_input.strip():
+            st.warning("Please provide a detailed description of your challenge.")
+        else:
+            st.session_state.pop("last_analysis", None)
             try:
-                # Prepare context
-                context = f"""
-                Question: {user_input}
-                Question Type: {question_type}
-                Tech Stack: {', '.join(tech_stack) if tech_stack else 'Not specified'}
-                Complexity Level: {complexity_level}
-                Project Scale: {project_scale}
-                """
-
-                # Store responses for Google Docs
-                agent_responses = {}
-
-                # Route to appropriate agent(s)
-                if question_type == "Software Development & Architecture":
-                    with st.spinner("🏗️ Senior Developer analyzing your challenge..."):
-                        response = senior_developer.run(message=context)
-                        st.subheader("🏗️ Senior Software Developer Analysis")
-                        st.markdown(response.content)
-                        agent_responses["🏗️ Senior Software Developer Analysis"] = response.content
-
-                elif question_type == "AI Agent System Design":
-                    with st.spinner("🤖 AI Agent Architect designing your system..."):
-                        response = ai_agent_architect.run(message=context)
-                        st.subheader("🤖 AI Agent Architecture Recommendations")
-                        st.markdown(response.content)
-                        agent_responses["🤖 AI Agent Architecture Recommendations"] = response.content
-
-                elif question_type == "System Design & Scalability":
-                    with st.spinner("🏢 System Designer creating architecture..."):
-                        response = system_designer.run(message=context)
-                        st.subheader("🏢 System Design & Architecture")
-                        st.markdown(response.content)
-                        agent_responses["🏢 System Design & Architecture"] = response.content
-
-                elif question_type == "Open Source AI Contribution":
-                    with st.spinner("🌟 Open Source Expert providing guidance..."):
-                        response = opensource_contributor.run(message=context)
-                        st.subheader("🌟 Open Source Contribution Strategy")
-                        st.markdown(response.content)
-                        agent_responses["🌟 Open Source Contribution Strategy"] = response.content
-
-                else:  # Comprehensive Analysis
-                    # Senior Developer Analysis
-                    with st.spinner("🏗️ Senior Developer analyzing..."):
-                        response = senior_developer.run(message=context)
-                        st.subheader("🏗️ Senior Developer Perspective")
-                        st.markdown(response.content)
-                        agent_responses["🏗️ Senior Developer Perspective"] = response.content
-                        st.markdown("---")
-
-                    # AI Agent Architect Analysis
-                    with st.spinner("🤖 AI Agent Architect designing..."):
-                        response = ai_agent_architect.run(message=context)
-                        st.subheader("🤖 AI Agent Architecture Insights")
-                        st.markdown(response.content)
-                        agent_responses["🤖 AI Agent Architecture Insights"] = response.content
-                        st.markdown("---")
-
-                    # System Designer Analysis
-                    with st.spinner("🏢 System Designer architecting..."):
-                        response = system_designer.run(message=context)
-                        st.subheader("🏢 System Design Recommendations")
-                        st.markdown(response.content)
-                        agent_responses["🏢 System Design Recommendations"] = response.content
-                        st.markdown("---")
-
-                    # Open Source Contributor Guidance
-                    with st.spinner("🌟 Open Source Expert advising..."):
-                        response = opensource_contributor.run(message=context)
-                        st.subheader("🌟 Open Source Strategy")
-                        st.markdown(response.content)
-                        agent_responses["🌟 Open Source Strategy"] = response.content
-
-                # Save to Google Docs if requested
-                if (GOOGLE_DOCS_AVAILABLE and 'save_to_docs' in locals() and save_to_docs 
-                    and google_docs.load_credentials()):
-                    
-                    with st.spinner("📄 Saving to Google Docs..."):
+                history = ui.current_conversation().history() if follow_up else {}
+                request = AnalysisRequest(user_input, question_type, tech_stack, complexity_level, project_scale, history)
+                if ui.prefetch_enabled:
+                    st.session_state.last_prefetch = ui.session_prefetcher().claim(request)
+                if question_type == AUTO_ROUTE:
+                    request = resolve_route(request, ui.expert_router())
+                    st.caption(routing_caption(request))
+                queued = ui.quota_caption(len(request.sections))
+                if queued:
+                    st.caption(queued)
+
+                save_requested = docs_connected and 'save_to_docs' in locals() and save_to_docs
+
+                if ui.job_runner:
+                    ui.start_job(request, stream_responses)
+                    if save_requested:
+                        # Exported in one go when the job finishes
+                        st.session_state.job_docs_export = (st.session_state.job_id, doc_title, user_input, question_type)
+                else:
+                    docs_job = None
+                    on_section = None
+                    if save_requested and docs_incremental_export:
+                        # Create the document now and write each section as its expert finishes
+                        docs_job = google_docs.start_export(
+                            doc_title, google_docs.format_header_for_docs(user_input, question_type)
+                        )
+                        st.session_state.docs_export = docs_job
+
+                        def on_section(result):
+                            docs_job.add(google_docs.format_section_for_docs(result.heading, result.content), slot=result.index)
+
+                    try:
+                        # Store responses for Google Docs
+                        agent_responses = ui.render_analysis(request, stream_responses, on_section=on_section if docs_job else None)
+                    finally:
+                        if docs_job:
+                            docs_job.add(google_docs.format_footer_for_docs())
+                            docs_job.close()
+
+                    if ui.conversation_enabled:
+                        ui.remember_turn(request, agent_responses)
+
+                    # Save to Google Docs if requested
+                    if save_requested and not docs_incremental_export:
+                        # Uploads in the background; the status panel below follows it
                         formatted_content = google_docs.format_response_for_docs(
                             user_input, question_type, agent_responses
                         )
-                        document_id = google_docs.create_document(doc_title, formatted_content)
-                        
-                        if document_id:
-                            doc_url = f"https://docs.google.com/document/d/{document_id}/edit"
-                            st.success("✅ Successfully saved to Google Docs!")
-                            st.markdown(f"📄 [**Open your document in Google Docs**]({doc_url})")
-                            
-                            # Show save confirmation
-                            st.info(f"📋 Document saved as: **{doc_title}**")
-                        else:
-                            st.error("❌ Failed to save to Google Docs. Please try again.")
+                        st.session_state.docs_export = google_docs.export_document(doc_title, formatted_content)
 
+            except AgentInitializationError as e:
+                st.error(f"Error initializing agents: {str(e)}")
+                st.error("⚠️ Agents failed to initialize. Please check your API key.")
             except Exception as e:
                 logger.error(f"Processing error: {str(e)}")
                 st.error("⚠️ An error occurred during analysis. Please try again.")
-        else:
-            st.error("⚠️ Agents failed to initialize. Please check your API key.")
+    elif st.session_state.get("last_analysis"):
+        show_analysis(st.session_state.last_analysis)
+    if ui.job_runner and ui.watched_job():
+        ui.watch_job(ui.watched_job(), on_finish=export_finished_job)
+
+    # Google Docs export status
+    if GOOGLE_DOCS_AVAILABLE and st.session_state.get('docs_export'):
+        render_docs_export()
+
+    ui.render_performance()
+    timer.finish()
+
+
+analysis_form()
 
 # Expert Tips Section
 st.markdown("---")
@@ -717,3 +645,5 @@ st.markdown("""
     <p>📄 <i>Now with Google Docs integration for seamless documentation</i></p>
 </div>
 """, unsafe_allow_html=True)
+
+script_timer.finish()
@@ -0,0 +1,22 @@
+"""Expert agents, routing and analysis engine behind the Streamlit apps"""
+from .agents import AGENT_SPECS, DEFAULT_MODEL_ID, AgentRegistry, build_agents, registry
+from .core import (
+    AUTO_ROUTE,
+    COMPLEXITY_LEVELS,
+    PROJECT_SCALES,
+    QUESTION_TYPES,
+    ROUTES,
+    AgentInitializationError,
+    AnalysisRequest,
+    AnalysisResult,
+    EngineConfig,
+    Section,
+    SectionResult,
+    aanalyze,
+    aiter_analysis,
+    analyze,
+    iter_analysis,
+    resolve_route,
+    run_analysis,
+)
+from .fanout import StreamChunk
@@ -0,0 +1,198 @@
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+import hashlib
+import threading
+
+DEFAULT_MODEL_ID = "gemini-2.0-flash-exp"
+
+# Expert personas: (name, instructions), in the order the UI presents them
+AGENT_SPECS = [
+    (
+        "Senior Software Developer",
+        [
+            "You are a seasoned Senior Software Developer with 10+ years of experience across multiple technologies and domains.",
+            "Your expertise includes:",
+            "1. **Code Architecture & Design**: Design scalable, maintainable, and robust software solutions",
+            "2. **Best Practices**: Apply SOLID principles, design patterns, clean code practices",
+            "3. **Technology Stack**: Deep knowledge of modern frameworks, databases, cloud services",
+            "4. **Code Review**: Identify potential issues, security vulnerabilities, performance bottlenecks",
+            "5. **Technical Leadership**: Guide junior developers, make architectural decisions",
+            "",
+            "When answering:",
+            "- Provide production-ready code examples with comprehensive error handling",
+            "- Explain the reasoning behind architectural choices",
+            "- Consider scalability, maintainability, and performance implications",
+            "- Suggest testing strategies and deployment considerations",
+            "- Include security best practices and potential pitfalls",
+            "- Reference industry standards and proven patterns",
+            "",
+            "Always structure responses with: Problem Analysis → Solution Design → Implementation → Best Practices → Next Steps"
+        ],
+    ),
+    (
+        "AI Agent Architect",
+        [
+            "You are an expert AI Agent Architect specializing in designing intelligent agent systems and multi-agent architectures.",
+            "Your core competencies:",
+            "1. **Agent Design Patterns**: Single agents, multi-agent systems, hierarchical architectures",
+            "2. **LLM Integration**: Prompt engineering, model selection, context management, token optimization",
+            "3. **Agent Orchestration**: Workflow design, agent communication, task delegation, state management",
+            "4. **AI Frameworks**: LangChain, AutoGen, CrewAI, Semantic Kernel, custom agent frameworks",
+            "5. **Production Deployment**: Scalable agent systems, monitoring, error handling, fallback strategies",
+            "",
+            "Approach each problem by:",
+            "- Analyzing the use case and identifying agent requirements",
+            "- Designing appropriate agent roles and responsibilities",
+            "- Creating detailed prompt templates and persona definitions",
+            "- Planning inter-agent communication and data flow",
+            "- Recommending suitable frameworks and implementation patterns",
+            "- Addressing scalability, reliability, and cost optimization",
+            "",
+            "Structure responses as: Use Case Analysis → Agent Architecture → Implementation Strategy → Framework Recommendations → Deployment Considerations"
+        ],
+    ),
+    (
+        "System Design Expert",
+        [
+            "You are a Principal System Design Engineer with expertise in building large-scale distributed systems.",
+            "Your specializations include:",
+            "1. **Scalability Design**: Horizontal/vertical scaling, load balancing, caching strategies",
+            "2. **Distributed Systems**: Microservices, service mesh, event-driven architecture, message queues",
+            "3. **Database Design**: SQL/NoSQL selection, sharding, replication, consistency models",
+            "4. **Cloud Architecture**: AWS/GCP/Azure services, serverless, containerization, orchestration",
+            "5. **Performance & Reliability**: Monitoring, observability, fault tolerance, disaster recovery",
+            "",
+            "For each system design question:",
+            "- Start with requirements gathering and constraint analysis",
+            "- Break down the system into core components and services",
+            "- Design data models and storage solutions",
+            "- Plan API design and communication patterns",
+            "- Address scalability bottlenecks and failure scenarios",
+            "- Estimate capacity, costs, and performance metrics",
+            "- Create detailed architectural diagrams and documentation",
+            "",
+            "Response format: Requirements Analysis → High-Level Design → Detailed Components → Data Flow → Scalability & Reliability → Implementation Roadmap"
+        ],
+    ),
+    (
+        "Open Source AI Contributor",
+        [
+            "You are an experienced Open Source AI Contributor and maintainer with deep knowledge of the AI/ML ecosystem.",
+            "Your expertise covers:",
+            "1. **Project Contribution**: Finding suitable projects, understanding codebases, making meaningful contributions",
+            "2. **AI/ML Libraries**: TensorFlow, PyTorch, Hugging Face, scikit-learn, OpenAI APIs, LangChain",
+            "3. **Community Engagement**: Writing documentation, creating tutorials, mentoring newcomers",
+            "4. **Project Maintenance**: Code review, issue triage, release management, community building",
+            "5. **AI Ethics & Best Practices**: Responsible AI development, bias detection, model evaluation",
+            "",
+            "When providing guidance:",
+            "- Recommend specific projects aligned with user's interests and skill level",
+            "- Explain contribution workflows and community etiquette",
+            "- Suggest ways to add value through code, documentation, or community support",
+            "- Share insights on building reputation and network in the AI community",
+            "- Provide practical steps for getting started with contributions",
+            "- Discuss trends and opportunities in the AI open source ecosystem",
+            "",
+            "Structure advice as: Goal Assessment → Project Recommendations → Contribution Strategy → Skill Development → Community Engagement → Long-term Growth"
+        ],
+    ),
+]
+
+
+def build_model(api_key: str, model_id: str = DEFAULT_MODEL_ID):
+    """The model behind the agents; ``fake`` ids select the offline stand-in"""
+    # Imported here: agno and the Gemini SDK take over a second to load, and
+    # the apps have no need of them until the first question is asked
+    from .fake_model import FakeModel, is_fake_model
+    if is_fake_model(model_id):
+        return FakeModel.from_id(model_id)
+    from agno.models.google import Gemini
+    return Gemini(id=model_id, api_key=api_key)
+
+
+def build_agents(api_key: str, model_id: str = DEFAULT_MODEL_ID, shared_model: bool = True) -> tuple:
+    """Build the four expert agents on a fresh model, or each on its own"""
+    from agno.agent import Agent
+    model = build_model(api_key, model_id)
+    return tuple(
+        Agent(model=model if shared_model else build_model(api_key, model_id),
+              name=name, instructions=instructions, markdown=True)
+        for name, instructions in AGENT_SPECS
+    )
+
+
+def _fingerprint(api_key: str) -> str:
+    """Hash the API key so the raw secret is never used as a dict key"""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+
+class AgentRegistry:
+    """Process-wide pool of expert agent sets, keyed by API key and model id.
+
+    Agents are built lazily on first use and handed out through
+    ``acquire()``/``lease()``. An agno ``Agent`` keeps per-run state, so a set is leased exclusively to
+    one request at a time and returned to the pool afterwards; concurrent
+    requests for the same key get their own set. Sets whose agents each
+    need their own model (to point at per-expert cached prompts) are
+    pooled separately with ``shared_model=False``.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._idle: Dict[Tuple[str, str, bool], List[tuple]] = {}
+        self.built = 0
+        self.reused = 0
+
+    def acquire(self, api_key: str, model_id: str = DEFAULT_MODEL_ID, shared_model: bool = True) -> tuple:
+        """Check out a set of the four agents, building one if none is idle"""
+        key = (_fingerprint(api_key), model_id, shared_model)
+        with self._lock:
+            # A different key means the secrets changed: drop agents built
+            # for any previous key so they can't be handed out again.
+            for stale in [k for k in self._idle if k[0] != key[0]]:
+                del self._idle[stale]
+            pool = self._idle.setdefault(key, [])
+            if pool:
+                agents = pool.pop()
+                self.reused += len(agents)
+                return agents
+
+        agents = build_agents(api_key, model_id, shared_model)
+        with self._lock:
+            self.built += len(agents)
+        return agents
+
+    def release(self, api_key: str, model_id: str, agents: tuple, shared_model: bool = True):
+        """Return a leased set to the pool"""
+        key = (_fingerprint(api_key), model_id, shared_model)
+        with self._lock:
+            # Only keep the set if its key hasn't been invalidated meanwhile
+            if key in self._idle:
+                self._idle[key].append(agents)
+
+    @contextmanager
+    def lease(self, api_key: str, model_id: str = DEFAULT_MODEL_ID, shared_model: bool = True):
+        """Context manager around acquire()/release()"""
+        agents = self.acquire(api_key, model_id, shared_model)
+        try:
+            yield agents
+        finally:
+            self.release(api_key, model_id, agents, shared_model)
+
+    def invalidate(self):
+        """Drop every pooled agent set; the next lease rebuilds"""
+        with self._lock:
+            self._idle.clear()
+
+    def stats(self) -> dict:
+        """Counts of agents built versus reused since process start"""
+        with self._lock:
+            return {
+                "built": self.built,
+                "reused": self.reused,
+                "pooled_sets": sum(len(pool) for pool in self._idle.values()),
+            }
+
+
+# Shared by every Streamlit session in this process
+registry = AgentRegistry()
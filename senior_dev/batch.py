@@ -0,0 +1,172 @@
+"""Headless batch mode: run a JSONL file of questions through the experts.
+
+Each input line is a JSON object::
+
+    {"id": "faq-1", "question": "...", "question_type": "...",
+     "tech_stack": ["Python"], "complexity_level": "Intermediate",
+     "project_scale": "Startup/Medium"}
+
+Only ``question`` is required; ``id`` defaults to the line number and the
+other fields default to the first option the UI offers. Results are
+appended to the output JSONL as they complete, which doubles as the
+checkpoint: rerunning with the same output skips records that already
+finished without errors. Each record asks its experts in parallel, as the
+UI does; ``--concurrency`` records run at once, and ``--rpm``/``--tpm``
+bound the model calls they make between them.
+
+Usage::
+
+    GEMINI_API_KEY=... python -m senior_dev.batch questions.jsonl -o answers.jsonl --concurrency 8
+"""
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+from typing import Iterator, Set, Tuple
+import argparse
+import json
+import logging
+import os
+import sys
+
+from .config import add_engine_arguments, config_from_args
+from .core import AnalysisRequest, EngineConfig, run_analysis
+from .metrics import metrics
+
+logger = logging.getLogger("batch")
+
+
+def read_records(path: str) -> Iterator[Tuple[str, dict]]:
+    """Yield (id, record) pairs from a JSONL file, one line at a time"""
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                logger.error(f"{path}:{line_number}: invalid JSON ({e}), skipped")
+                continue
+            if not isinstance(record, dict):
+                logger.error(f"{path}:{line_number}: not a JSON object, skipped")
+                continue
+            if not str(record.get("question", "")).strip():
+                logger.error(f"{path}:{line_number}: no question, skipped")
+                continue
+            yield str(record.get("id", line_number)), record
+
+
+def completed_ids(path: str) -> Set[str]:
+    """Ids already answered without errors in an existing output file"""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # a partial line left by an interrupted run
+            # Not a result this tool wrote (hand-edited, or from another tool)
+            if not isinstance(result, dict) or "id" not in result or not isinstance(result.get("sections"), list):
+                continue
+            if not any(not isinstance(section, dict) or section.get("error") for section in result["sections"]):
+                done.add(str(result["id"]))
+    return done
+
+
+def ends_mid_line(path: str) -> bool:
+    """Whether a file ends in a partial line, as an interrupted run can leave it"""
+    if not os.path.exists(path):
+        return False
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        if f.tell() == 0:
+            return False
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) != b"\n"
+
+
+def process_record(record_id: str, record: dict, config: EngineConfig) -> dict:
+    """Route one question to its experts and collect their answers"""
+    request = AnalysisRequest(
+        question=record["question"],
+        question_type=record.get("question_type", AnalysisRequest.question_type),
+        tech_stack=record.get("tech_stack"),
+        complexity_level=record.get("complexity_level", AnalysisRequest.complexity_level),
+        project_scale=record.get("project_scale", AnalysisRequest.project_scale),
+    )
+    return {
+        "id": record_id,
+        **run_analysis(request, config).to_dict(),
+        "completed_at": datetime.now().isoformat(timespec="seconds"),
+    }
+
+
+def run_batch(input_path: str, output_path: str, config: EngineConfig, concurrency: int = 4) -> dict:
+    """Process every pending record, appending results as they complete"""
+    done = completed_ids(output_path)
+    # The next result starts on its own line, not glued to a partial one
+    broken_line = ends_mid_line(output_path)
+    counts = {"skipped": 0, "completed": 0, "failed": 0}
+    pending = {}
+
+    def drain(block_until: int):
+        # Write out finished records until at most block_until are in flight
+        while len(pending) > block_until:
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                record_id = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logger.error(f"{record_id}: {e}")
+                    counts["failed"] += 1
+                    continue
+                out.write(json.dumps(result, ensure_ascii=False) + "\n")
+                out.flush()
+                failed = any(section["error"] for section in result["sections"])
+                counts["failed" if failed else "completed"] += 1
+                logger.info(f"{record_id}: {'errors' if failed else 'done'} in {result['elapsed']:.1f}s")
+
+    with open(output_path, "a", encoding="utf-8") as out, \
+            ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch") as executor:
+        if broken_line:
+            out.write("\n")
+        for record_id, record in read_records(input_path):
+            if record_id in done:
+                counts["skipped"] += 1
+                continue
+            done.add(record_id)  # guard against duplicate ids in the input
+            future = executor.submit(process_record, record_id, record, config)
+            pending[future] = record_id
+            # Bounded read-ahead keeps memory flat for large inputs
+            drain(block_until=2 * concurrency)
+        drain(block_until=0)
+
+    return counts
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Run a JSONL file of questions through the expert agents.")
+    parser.add_argument("input", help="JSONL file of question records")
+    parser.add_argument("-o", "--output", required=True, help="JSONL file to append results to (also the checkpoint)")
+    parser.add_argument("-c", "--concurrency", type=int, default=4, help="records processed in parallel")
+    add_engine_arguments(parser)
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format="%(asctime)s %(levelname)s %(message)s")
+    api_key = os.environ.get("GEMINI_API_KEY")
+    if not api_key:
+        print("GEMINI_API_KEY is not set", file=sys.stderr)
+        return 2
+
+    metrics.set_trace_path(args.trace)
+    config = config_from_args(args, api_key)
+    counts = run_batch(args.input, args.output, config, max(1, args.concurrency))
+    print(f"completed={counts['completed']} failed={counts['failed']} skipped={counts['skipped']}", file=sys.stderr)
+    return 1 if counts["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,220 @@
+"""Load-test harness: latency, throughput and memory of the analysis paths.
+
+Drives the single-expert and "Comprehensive Analysis" paths at one or more
+concurrency levels and reports p50/p95/p99 latency, throughput, errors and
+peak RSS. It runs offline against the fake model by default, so it needs
+no API key; pass a Gemini ``--model`` (and ``GEMINI_API_KEY``) to measure
+the real thing. Caches are off unless ``--cache`` is given.
+
+Usage::
+
+    python -m senior_dev.benchmark --concurrency 1,4,16 --requests 40
+    python -m senior_dev.benchmark --model "fake:median=1.2,fail=0.02" --stream --json run.json
+    python -m senior_dev.benchmark --baseline run.json --tolerance 0.2   # exit 1 on regression
+    python -m senior_dev.benchmark --model "fake:prefill=2000" --json inline.json
+    python -m senior_dev.benchmark --model "fake:prefill=2000" --prefix-cache --baseline inline.json
+"""
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, replace
+from typing import List, Optional
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+from .core import AUTO_ROUTE, QUESTION_TYPES, AnalysisRequest, EngineConfig, iter_analysis
+from .fanout import DEFAULT_AGENT_TIMEOUT, DEFAULT_MAX_CONCURRENCY, StreamChunk
+from .fake_model import FAKE_MODEL_PREFIX
+from .prefix_cache import shared_prefix_cache
+from .resilience import RetryPolicy, shared_resilience
+from .response_cache import shared_cache
+
+logger = logging.getLogger("benchmark")
+
+# The shapes of work the UI produces: one expert, all four, or whichever the router picks
+PATHS = {
+    "single": QUESTION_TYPES[0],
+    "all": QUESTION_TYPES[-1],
+    "auto": AUTO_ROUTE,
+}
+DEFAULT_MODEL = FAKE_MODEL_PREFIX + ":median=0.5,sigma=0.4,tps=200,tokens=200"
+
+
+@dataclass
+class ScenarioResult:
+    path: str
+    concurrency: int
+    requests: int
+    errors: int
+    wall: float
+    p50: float
+    p95: float
+    p99: float
+    ttft_p50: Optional[float]
+    throughput: float
+    peak_rss_mb: Optional[float]
+
+    @property
+    def key(self) -> str:
+        return f"{self.path}@{self.concurrency}"
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Linearly interpolated percentile, ``q`` in [0, 100]"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * q / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def peak_rss_mb() -> Optional[float]:
+    """Peak resident memory of this process so far, if the OS reports it"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def timed_request(request: AnalysisRequest, config: EngineConfig, stream: bool) -> dict:
+    """Run one analysis to completion and time it"""
+    started = time.perf_counter()
+    first_chunk = None
+    errors = 0
+    for event in iter_analysis(request, config, stream=stream):
+        if isinstance(event, StreamChunk):
+            if first_chunk is None:
+                first_chunk = time.perf_counter() - started
+        elif event.error is not None:
+            errors += 1
+    return {"latency": time.perf_counter() - started, "ttft": first_chunk, "errors": errors}
+
+
+def run_scenario(path: str, concurrency: int, requests: int, config: EngineConfig, stream: bool = False) -> ScenarioResult:
+    """Send ``requests`` analyses down one path, ``concurrency`` at a time"""
+    question_type = PATHS[path]
+
+    def request(i: int) -> AnalysisRequest:
+        # Distinct questions so the fake model draws distinct latencies
+        return AnalysisRequest(f"Benchmark question {i}: how should we scale service {i % 97}?", question_type)
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="bench") as executor:
+        # Warm the agent pool so construction isn't billed to the first requests
+        list(executor.map(lambda i: timed_request(request(-1 - i), config, stream), range(concurrency)))
+        started = time.perf_counter()
+        samples = list(executor.map(lambda i: timed_request(request(i), config, stream), range(requests)))
+        wall = time.perf_counter() - started
+
+    latencies = [sample["latency"] for sample in samples]
+    ttfts = [sample["ttft"] for sample in samples if sample["ttft"] is not None]
+    return ScenarioResult(
+        path=path,
+        concurrency=concurrency,
+        requests=requests,
+        errors=sum(1 for sample in samples if sample["errors"]),
+        wall=wall,
+        p50=percentile(latencies, 50),
+        p95=percentile(latencies, 95),
+        p99=percentile(latencies, 99),
+        ttft_p50=percentile(ttfts, 50) if ttfts else None,
+        throughput=requests / wall if wall else 0.0,
+        peak_rss_mb=peak_rss_mb(),
+    )
+
+
+def find_regressions(results: List[ScenarioResult], baseline: List[dict], tolerance: float) -> List[str]:
+    """Scenarios whose p95 or throughput got worse than ``tolerance`` allows"""
+    previous = {f"{entry['path']}@{entry['concurrency']}": entry for entry in baseline}
+    regressions = []
+    for result in results:
+        before = previous.get(result.key)
+        if before is None:
+            continue
+        if result.p95 > before["p95"] * (1 + tolerance):
+            regressions.append(f"{result.key}: p95 {before['p95']:.3f}s -> {result.p95:.3f}s")
+        if result.throughput < before["throughput"] / (1 + tolerance):
+            regressions.append(f"{result.key}: throughput {before['throughput']:.2f}/s -> {result.throughput:.2f}/s")
+    return regressions
+
+
+def format_table(results: List[ScenarioResult]) -> str:
+    header = f"{'scenario':<12}{'reqs':>6}{'errors':>8}{'p50 s':>9}{'p95 s':>9}{'p99 s':>9}{'ttft s':>9}{'req/s':>9}{'rss MB':>9}"
+    rows = [header, "-" * len(header)]
+    for r in results:
+        ttft = f"{r.ttft_p50:.3f}" if r.ttft_p50 is not None else "-"
+        rss = f"{r.peak_rss_mb:.0f}" if r.peak_rss_mb is not None else "-"
+        rows.append(f"{r.key:<12}{r.requests:>6}{r.errors:>8}{r.p50:>9.3f}{r.p95:>9.3f}{r.p99:>9.3f}{ttft:>9}{r.throughput:>9.2f}{rss:>9}")
+    return "\n".join(rows)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the expert analysis paths.")
+    parser.add_argument("--model", default=DEFAULT_MODEL, help="model id; 'fake:...' runs offline")
+    parser.add_argument("--paths", default="single,all", help=f"comma-separated, from: {', '.join(PATHS)}")
+    parser.add_argument("--concurrency", default="1,4,16", help="comma-separated concurrency levels")
+    parser.add_argument("-n", "--requests", type=int, default=40, help="requests per scenario")
+    parser.add_argument("--stream", action="store_true", help="use the streaming path and report time to first token")
+    parser.add_argument("--fanout", type=int, default=DEFAULT_MAX_CONCURRENCY, help="experts per request in parallel")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_AGENT_TIMEOUT, help="per-expert deadline in seconds")
+    parser.add_argument("--cache", help="response cache path; off by default")
+    parser.add_argument("--prefix-cache", action="store_true", help="send experts' system prompts as cached prefixes")
+    parser.add_argument("--attempts", type=int, default=1,
+                        help="model calls per expert with retries and a circuit breaker; off by default")
+    parser.add_argument("--json", dest="json_path", help="write results to this file")
+    parser.add_argument("--baseline", help="results file from an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown versus the baseline")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format="%(asctime)s %(levelname)s %(message)s")
+    paths = [path.strip() for path in args.paths.split(",") if path.strip()]
+    unknown = [path for path in paths if path not in PATHS]
+    if unknown:
+        parser.error(f"unknown path: {', '.join(unknown)}")
+    levels = [int(level) for level in args.concurrency.split(",") if level.strip()]
+
+    api_key = os.environ.get("GEMINI_API_KEY")
+    if not args.model.startswith(FAKE_MODEL_PREFIX):
+        if not api_key:
+            print("GEMINI_API_KEY is not set", file=sys.stderr)
+            return 2
+    config = EngineConfig(
+        api_key=api_key or "offline",
+        model_id=args.model,
+        max_concurrency=args.fanout,
+        timeout=args.timeout,
+        response_cache=shared_cache(args.cache) if args.cache else None,
+        prefix_cache=shared_prefix_cache() if args.prefix_cache else None,
+        resilience=shared_resilience(RetryPolicy(attempts=args.attempts)) if args.attempts > 1 else None,
+    )
+
+    results = []
+    for path in paths:
+        for level in levels:
+            logger.info(f"{path} at concurrency {level}")
+            results.append(run_scenario(path, level, args.requests, replace(config), args.stream))
+    print(format_table(results))
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump({"model": args.model, "stream": args.stream, "results": [asdict(r) for r in results]}, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = find_regressions(results, json.load(f)["results"], args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
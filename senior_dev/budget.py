@@ -0,0 +1,329 @@
+"""Prompt token budgeting and compaction of long questions.
+
+Users paste whole log files and sources into the question. Before the
+experts run, the question is measured against each expert's prompt budget
+(the budget minus that expert's instructions and the rest of the context)
+and, only if it doesn't fit, compacted in stages until it does:
+
+1. runs of repeated log lines collapse to one line and a count,
+2. later repeats of long lines already seen are dropped,
+3. optionally, the text is summarized chunk by chunk by the model,
+4. as a last resort the middle is cut, keeping the head and the tail
+   (where the errors at the end of a log usually are), inside a line if
+   one line alone is over budget.
+
+Tokens are counted locally: with ``tiktoken`` if it is installed, else by
+a word-piece approximation.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, replace
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+import functools
+import logging
+import math
+import re
+import threading
+from collections import OrderedDict
+
+from .agents import AGENT_SPECS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TOKEN_BUDGET = 16000
+DEFAULT_CHUNK_TOKENS = 2000
+# Never squeeze a question below this, whatever the instructions cost
+MIN_QUESTION_TOKENS = 256
+# Repeats of lines at least this long are dropped in the second stage
+MIN_REPEAT_LINE_CHARS = 20
+# Compactions kept for reruns and for experts sharing a budget
+MAX_REMEMBERED = 64
+
+_WORD_PIECE = re.compile(r"\w+|[^\w\s]")
+# Numbers, hex ids and the like vary between otherwise identical log lines
+_VARIABLE = re.compile(r"0x[0-9a-f]+|\b[0-9a-f]{8,}\b|\d+", re.IGNORECASE)
+
+SUMMARIZER_INSTRUCTIONS = [
+    "You compress pasted logs, code and documents so another expert can work from the summary.",
+    "Keep every error message, exception, stack frame, file name, identifier, version and number that matters verbatim.",
+    "Drop repetition, boilerplate and routine lines. Use terse bullet points; no preamble.",
+]
+
+
+@functools.lru_cache(maxsize=1)
+def _encoding():
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        # Not installed, or its vocabulary can't be downloaded here
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """Local token count; exact for tiktoken's vocabulary, close for Gemini's"""
+    if not text:
+        return 0
+    encoding = _encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    # Roughly one token per four characters of a word, one per punctuation mark
+    return sum(math.ceil(len(piece) / 4) for piece in _WORD_PIECE.findall(text))
+
+
+@functools.lru_cache(maxsize=None)
+def instruction_tokens(agent_name: str) -> int:
+    """What an expert's instructions cost in every prompt"""
+    for name, instructions in AGENT_SPECS:
+        if name == agent_name:
+            return count_tokens("\n".join(instructions))
+    return 0
+
+
+def _template(line: str) -> str:
+    return _VARIABLE.sub("#", line.strip().lower())
+
+
+def collapse_runs(lines: List[str]) -> Tuple[List[str], int]:
+    """Collapse runs of lines that differ only in numbers and ids"""
+    kept, dropped = [], 0
+    run_template, run_length = None, 0
+
+    def close_run():
+        if run_length > 1:
+            kept.append(f"    [... previous line repeated {run_length - 1} more times ...]")
+
+    for line in lines:
+        template = _template(line) if line.strip() else None
+        if template is not None and template == run_template:
+            run_length += 1
+            dropped += 1
+            continue
+        close_run()
+        kept.append(line)
+        run_template, run_length = template, 1
+    close_run()
+    return kept, dropped
+
+
+def drop_repeats(lines: List[str]) -> Tuple[List[str], int]:
+    """Drop long lines whose pattern already appeared earlier"""
+    seen = set()
+    kept, dropped = [], 0
+    for line in lines:
+        if len(line.strip()) >= MIN_REPEAT_LINE_CHARS:
+            template = _template(line)
+            if template in seen:
+                dropped += 1
+                continue
+            seen.add(template)
+        kept.append(line)
+    if dropped:
+        kept.append(f"[... {dropped} lines repeating earlier ones omitted ...]")
+    return kept, dropped
+
+
+def iter_chunks(lines: List[str], chunk_tokens: int) -> Iterator[str]:
+    """Yield consecutive groups of lines of about ``chunk_tokens`` each"""
+    chunk, size = [], 0
+    for line in lines:
+        tokens = count_tokens(line) + 1
+        if chunk and size + tokens > chunk_tokens:
+            yield "\n".join(chunk)
+            chunk, size = [], 0
+        chunk.append(line)
+        size += tokens
+    if chunk:
+        yield "\n".join(chunk)
+
+
+def clip_tokens(text: str, max_tokens: int, from_end: bool = False) -> str:
+    """The longest start (or end) of ``text`` that fits in ``max_tokens``"""
+    if max_tokens <= 0:
+        return ""
+    encoding = _encoding()
+    if encoding is not None:
+        tokens = encoding.encode(text, disallowed_special=())
+        if len(tokens) <= max_tokens:
+            return text
+        kept = tokens[-max_tokens:] if from_end else tokens[:max_tokens]
+        # A cut through a multi-byte character leaves half of it; drop that
+        return encoding.decode_bytes(kept).decode("utf-8", errors="ignore")
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if count_tokens(text[len(text) - middle:] if from_end else text[:middle]) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return text[len(text) - low:] if from_end else text[:low]
+
+
+def truncate_middle(lines: List[str], budget: int) -> Tuple[List[str], int]:
+    """Keep the first two thirds of the budget from the head, the rest from the tail.
+
+    Whole lines are kept where they fit; a line longer than its side's whole
+    budget (minified code, a base64 blob, a log without newlines) is cut
+    inside, so its ends are still kept. Returns the lines and how many were
+    cut, wholly or partly.
+    """
+    head_budget = budget * 2 // 3
+    tail_budget = budget - head_budget
+    head, head_used = [], 0
+    for line in lines:
+        tokens = count_tokens(line) + 1
+        if head_used + tokens > head_budget:
+            break
+        head.append(line)
+        head_used += tokens
+    tail, tail_used = [], 0
+    for line in reversed(lines[len(head):]):
+        tokens = count_tokens(line) + 1
+        if tail_used + tokens > tail_budget:
+            break
+        tail.append(line)
+        tail_used += tokens
+    tail.reverse()
+    middle = lines[len(head):len(lines) - len(tail)]
+    if not middle:
+        return lines, 0
+
+    first = clip_tokens(middle[0], head_budget - head_used - 1) if count_tokens(middle[0]) >= head_budget else ""
+    last = (clip_tokens(middle[-1], tail_budget - tail_used - 1, from_end=True)
+            if count_tokens(middle[-1]) >= tail_budget else "")
+    if len(middle) == 1 and first and last:
+        if len(first) + len(last) >= len(middle[0]):
+            return lines, 0
+        # Both ends of the same line stay on one line
+        omitted = len(middle[0]) - len(first) - len(last)
+        return head + [f"{first} [... {omitted} characters omitted to fit the token budget ...] {last}"] + tail, 1
+    if first or last:
+        omitted = sum(len(line) for line in middle) - len(first) - len(last)
+        marker = f"[... {omitted} characters omitted to fit the token budget ...]"
+    else:
+        marker = f"[... {len(middle)} lines omitted to fit the token budget ...]"
+    return head + [part for part in (first, marker, last) if part] + tail, len(middle)
+
+
+@dataclass
+class Compaction:
+    """A question before and after fitting it into a budget"""
+    text: str
+    original_tokens: int
+    compacted_tokens: int
+    budget: int
+    steps: List[str] = field(default_factory=list)
+
+    @property
+    def compacted(self) -> bool:
+        return bool(self.steps)
+
+
+class Summarizer:
+    """Summarizes chunks of text with the configured model"""
+
+    def __init__(self, api_key: str, model_id: str, max_concurrency: int = 4):
+        self.api_key = api_key
+        self.model_id = model_id
+        self.max_concurrency = max_concurrency
+
+    def _summarize(self, chunk: str, max_tokens: int) -> str:
+        # Imported here so budgeting without summaries needs no model SDK
+        from agno.agent import Agent
+        from .agents import build_model
+        from .streaming import iter_content
+
+        agent = Agent(model=build_model(self.api_key, self.model_id), name="Input Summarizer",
+                      instructions=SUMMARIZER_INSTRUCTIONS)
+        # Streamed, so a summary running past its share is cut off there instead of waited for
+        parts, used = [], 0
+        for text in iter_content(agent, f"Summarize in at most {max(max_tokens * 3 // 4, 30)} words:\n\n{chunk}"):
+            parts.append(text)
+            used += count_tokens(text)
+            if used >= max_tokens:
+                break
+        return "".join(parts)
+
+    def __call__(self, chunks: List[str], max_tokens: int) -> List[str]:
+        """Summaries of ``chunks`` in order, sharing ``max_tokens`` between them"""
+        share = max(max_tokens // max(len(chunks), 1), 32)
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_concurrency, len(chunks))),
+                                thread_name_prefix="summarize") as executor:
+            return list(executor.map(lambda chunk: self._summarize(chunk, share), chunks))
+
+
+# Shared by every TokenBudget in this process; Streamlit builds one per rerun
+_remembered: "OrderedDict[tuple, Compaction]" = OrderedDict()
+_remembered_lock = threading.Lock()
+
+
+class TokenBudget:
+    """Per-expert prompt budgets and the compaction that enforces them"""
+
+    def __init__(
+        self,
+        default: int = DEFAULT_TOKEN_BUDGET,
+        per_agent: Optional[Dict[str, int]] = None,
+        summarizer: Optional[Callable[[List[str], int], List[str]]] = None,
+        chunk_tokens: int = DEFAULT_CHUNK_TOKENS,
+    ):
+        self.default = default
+        self.per_agent = dict(per_agent or {})
+        self.summarizer = summarizer
+        self.chunk_tokens = chunk_tokens
+
+    def question_budget(self, request, agent_name: str) -> int:
+        """Tokens left for the question once instructions and context are paid for"""
+        total = self.per_agent.get(agent_name, self.default)
+        overhead = instruction_tokens(agent_name) + count_tokens(replace(request, question="").context_for(agent_name))
+        return max(total - overhead, MIN_QUESTION_TOKENS)
+
+    def compact(self, question: str, budget: int) -> Compaction:
+        """Fit ``question`` into ``budget`` tokens, reusing earlier results"""
+        key = (question, budget, self.summarizer is not None, self.chunk_tokens)
+        with _remembered_lock:
+            if key in _remembered:
+                _remembered.move_to_end(key)
+                return _remembered[key]
+        result = self._compact(question, budget)
+        with _remembered_lock:
+            _remembered[key] = result
+            while len(_remembered) > MAX_REMEMBERED:
+                _remembered.popitem(last=False)
+        return result
+
+    def _compact(self, question: str, budget: int) -> Compaction:
+        original = count_tokens(question)
+        result = Compaction(question, original, original, budget)
+        if original <= budget:
+            return result
+
+        lines = question.splitlines()
+        lines, dropped = collapse_runs(lines)
+        if dropped:
+            result.steps.append(f"collapsed {dropped} repeated lines")
+        if count_tokens("\n".join(lines)) > budget:
+            lines, dropped = drop_repeats(lines)
+            if dropped:
+                result.steps.append(f"dropped {dropped} lines repeating earlier ones")
+
+        if self.summarizer is not None and count_tokens("\n".join(lines)) > budget:
+            chunks = list(iter_chunks(lines, self.chunk_tokens))
+            try:
+                summaries = self.summarizer(chunks, budget)
+                lines = "\n\n".join(summaries).splitlines()
+                result.steps.append(f"summarized {len(chunks)} chunk{'s' if len(chunks) != 1 else ''}")
+            except Exception as e:
+                logger.error(f"Summarizing the question failed: {str(e)}")
+
+        if count_tokens("\n".join(lines)) > budget:
+            lines, omitted = truncate_middle(lines, budget)
+            if omitted:
+                result.steps.append(f"cut {omitted} line{'s' if omitted != 1 else ''} from the middle")
+
+        result.text = "\n".join(lines)
+        result.compacted_tokens = count_tokens(result.text)
+        return result
+
+    def fit(self, request, agent_name: str) -> Compaction:
+        """The question as ``agent_name`` should see it"""
+        return self.compact(request.question, self.question_budget(request, agent_name))
@@ -0,0 +1,133 @@
+"""Build an ``EngineConfig`` from the apps' secrets or a CLI's arguments.
+
+Every entry point configures the engine here, so a setting means the same
+thing everywhere: the Streamlit apps and the worker processes they start
+read ``.streamlit/secrets.toml`` through ``config_from_secrets()``; the
+server and batch CLIs share their flags through ``add_engine_arguments()``
+and ``config_from_args()``, with defaults from the same environment
+variables.
+"""
+from typing import Mapping
+import argparse
+import os
+
+from .agents import DEFAULT_MODEL_ID
+from .budget import DEFAULT_TOKEN_BUDGET, Summarizer, TokenBudget
+from .core import EngineConfig
+from .fanout import DEFAULT_AGENT_TIMEOUT, DEFAULT_MAX_CONCURRENCY
+from .prefix_cache import DEFAULT_PREFIX_TTL, shared_prefix_cache
+from .rate_limit import shared_rate_limiter
+from .resilience import (
+    DEFAULT_ATTEMPT_TIMEOUT, DEFAULT_ATTEMPTS, DEFAULT_FAILURE_THRESHOLD, DEFAULT_RESET_AFTER, RetryPolicy,
+    shared_resilience
+)
+from .response_cache import DEFAULT_CACHE_PATH, DEFAULT_MAX_BYTES, DEFAULT_TTL_SECONDS, shared_cache
+from .single_flight import shared_single_flight
+
+DEFAULT_RATE_STATE_PATH = os.path.join(".cache", "ratelimit.sqlite3")
+
+
+def config_from_secrets(secrets: Mapping) -> EngineConfig:
+    """The engine configured by the apps' secrets"""
+    api_key = secrets.get("GEMINI_API_KEY")
+    model_id = secrets.get("GEMINI_MODEL_ID", DEFAULT_MODEL_ID)
+    config = EngineConfig(
+        api_key=api_key,
+        model_id=model_id,
+        # All-experts fan-out tuning
+        max_concurrency=int(secrets.get("FANOUT_MAX_CONCURRENCY", DEFAULT_MAX_CONCURRENCY)),
+        timeout=float(secrets.get("AGENT_TIMEOUT_SECONDS", DEFAULT_AGENT_TIMEOUT)),
+    )
+
+    # Response cache: in-memory LRU in front of a SQLite file, shared by all sessions
+    if secrets.get("RESPONSE_CACHE_ENABLED", True):
+        config.response_cache = shared_cache(
+            secrets.get("RESPONSE_CACHE_PATH", DEFAULT_CACHE_PATH),
+            ttl=float(secrets.get("RESPONSE_CACHE_TTL_SECONDS", DEFAULT_TTL_SECONDS)),
+            max_bytes=int(secrets.get("RESPONSE_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES)),
+        )
+
+    # Semantic cache: reuse answers to paraphrased questions (opt-in)
+    if secrets.get("SEMANTIC_CACHE_ENABLED", False):
+        # Imported only when enabled: a local embedding model brings in torch
+        from .semantic_cache import DEFAULT_THRESHOLD, shared_semantic_cache
+        config.semantic_cache = shared_semantic_cache(
+            embedder=secrets.get("SEMANTIC_CACHE_EMBEDDER", "tfidf"),
+            threshold=float(secrets.get("SEMANTIC_CACHE_THRESHOLD", DEFAULT_THRESHOLD)),
+            thresholds={name: float(value) for name, value in secrets.get("SEMANTIC_CACHE_THRESHOLDS", {}).items()},
+        )
+
+    # Prompt token budget: compact pasted logs and sources that don't fit an expert's prompt
+    if secrets.get("PROMPT_BUDGET_ENABLED", True):
+        config.token_budget = TokenBudget(
+            default=int(secrets.get("PROMPT_TOKEN_BUDGET", DEFAULT_TOKEN_BUDGET)),
+            per_agent={name: int(value) for name, value in secrets.get("PROMPT_TOKEN_BUDGETS", {}).items()},
+            summarizer=Summarizer(api_key, model_id) if secrets.get("PROMPT_SUMMARIZE", False) else None,
+        )
+
+    # Prompt cache: register each expert's system prompt once and send only the question (opt-in)
+    if secrets.get("PROMPT_CACHE_ENABLED", False):
+        config.prefix_cache = shared_prefix_cache(ttl=float(secrets.get("PROMPT_CACHE_TTL_SECONDS", DEFAULT_PREFIX_TTL)))
+
+    # Resilience: retry transient model failures, and fail fast while the model is down
+    if secrets.get("RETRY_ENABLED", True):
+        config.resilience = shared_resilience(
+            RetryPolicy(
+                attempts=int(secrets.get("RETRY_ATTEMPTS", DEFAULT_ATTEMPTS)),
+                attempt_timeout=float(secrets.get("RETRY_ATTEMPT_TIMEOUT_SECONDS", DEFAULT_ATTEMPT_TIMEOUT)),
+            ),
+            failure_threshold=int(secrets.get("CIRCUIT_FAILURE_THRESHOLD", DEFAULT_FAILURE_THRESHOLD)),
+            reset_after=float(secrets.get("CIRCUIT_RESET_SECONDS", DEFAULT_RESET_AFTER)),
+        )
+
+    # Rate limiter: every session shares the key's requests/tokens per minute (off unless a limit is set)
+    if secrets.get("RATE_LIMIT_RPM") or secrets.get("RATE_LIMIT_TPM"):
+        workers = int(secrets.get("WORKER_PROCESSES", 0))
+        config.rate_limiter = shared_rate_limiter(
+            float(secrets.get("RATE_LIMIT_RPM", 0)) or None,
+            float(secrets.get("RATE_LIMIT_TPM", 0)) or None,
+            # Worker processes share their buckets through a file; the UI reads the same one
+            secrets.get("RATE_LIMIT_STATE_PATH", DEFAULT_RATE_STATE_PATH if workers else None),
+        )
+
+    # Single flight: identical expert calls in flight at once share one model call. Only within
+    # a process: identical calls on different worker processes each ask the model
+    if secrets.get("SINGLE_FLIGHT_ENABLED", True):
+        config.single_flight = shared_single_flight()
+    return config
+
+
+def add_engine_arguments(parser: argparse.ArgumentParser):
+    """The engine flags the server and batch CLIs share"""
+    parser.add_argument("--timeout", type=float, default=DEFAULT_AGENT_TIMEOUT, help="per-expert deadline in seconds")
+    parser.add_argument("--model", default=os.environ.get("GEMINI_MODEL_ID", DEFAULT_MODEL_ID))
+    parser.add_argument("--cache", default=os.environ.get("RESPONSE_CACHE_PATH", DEFAULT_CACHE_PATH),
+                        help="response cache shared with the UI")
+    parser.add_argument("--no-cache", action="store_true", help="always call the model")
+    parser.add_argument("--trace", default=os.environ.get("METRICS_TRACE_PATH"), help="append a JSONL trace of every request")
+    parser.add_argument("--token-budget", type=int, default=int(os.environ.get("PROMPT_TOKEN_BUDGET", DEFAULT_TOKEN_BUDGET)),
+                        help="prompt tokens per expert; longer questions are compacted (0 disables)")
+    parser.add_argument("--prefix-cache", action="store_true", help="cache each expert's system prompt on the model side")
+    parser.add_argument("--rpm", type=float, default=float(os.environ.get("RATE_LIMIT_RPM", 0)),
+                        help="model requests per minute for the API key (0 for no limit)")
+    parser.add_argument("--tpm", type=float, default=float(os.environ.get("RATE_LIMIT_TPM", 0)),
+                        help="model tokens per minute for the API key (0 for no limit)")
+    parser.add_argument("--rate-state", default=os.environ.get("RATE_LIMIT_STATE_PATH"),
+                        help="SQLite file to share the rate limits with other processes")
+    parser.add_argument("--attempts", type=int, default=DEFAULT_ATTEMPTS,
+                        help="model calls per expert; transient failures are retried (1 disables retries and the circuit breaker)")
+
+
+def config_from_args(args: argparse.Namespace, api_key: str, **options) -> EngineConfig:
+    """The engine configured by ``add_engine_arguments()``'s flags; ``options`` set other fields"""
+    return EngineConfig(
+        api_key=api_key,
+        model_id=args.model,
+        timeout=args.timeout,
+        response_cache=None if args.no_cache else shared_cache(args.cache),
+        token_budget=TokenBudget(args.token_budget) if args.token_budget > 0 else None,
+        prefix_cache=shared_prefix_cache() if args.prefix_cache else None,
+        resilience=shared_resilience(RetryPolicy(attempts=args.attempts)) if args.attempts > 1 else None,
+        rate_limiter=shared_rate_limiter(args.rpm or None, args.tpm or None, args.rate_state) if args.rpm or args.tpm else None,
+        **options,
+    )
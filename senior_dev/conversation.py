@@ -0,0 +1,248 @@
+"""Per-session conversation memory for the experts.
+
+Every expert remembers its own side of the conversation: the latest turns
+verbatim and everything older rolled into a running summary, with the
+whole memory held under a token bound. ``history()`` renders it for
+``AnalysisRequest.history`` so follow-up questions don't need to repeat
+what was already said. Summaries are extractive (the question, and each
+heading of the answer with the start of its text) unless a model
+summarizer is given.
+
+A ``Conversation`` is small and plain enough to keep in session state;
+``ConversationStore`` optionally persists it to SQLite so it survives a
+restart, pruning old conversations so the file stays bounded.
+"""
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+
+from .budget import count_tokens, truncate_middle
+
+DEFAULT_HISTORY_TOKENS = 4000
+DEFAULT_RECENT_TURNS = 2
+DEFAULT_CONVERSATIONS_PATH = os.path.join(".cache", "conversations.sqlite3")
+DEFAULT_CONVERSATION_TTL = 30 * 24 * 3600
+DEFAULT_MAX_CONVERSATIONS = 1000
+
+
+def _clip(text: str, max_tokens: int) -> str:
+    """Cut ``text`` to about ``max_tokens``, marking the cut"""
+    if count_tokens(text) <= max_tokens:
+        return text
+    lines, _ = truncate_middle(text.splitlines(), max_tokens)
+    return "\n".join(lines)
+
+
+def condense_turn(question: str, answer: str, max_tokens: int) -> str:
+    """One summary line for a turn: what was asked and what the answer covered"""
+    # Each heading with the start of the text under it
+    points, heading = [], None
+    for line in answer.splitlines():
+        line = line.strip()
+        if line.startswith("#"):
+            if heading:
+                points.append(heading)
+            heading = line.lstrip("#").strip()
+        elif line and heading:
+            points.append(f"{heading}: {' '.join(line.split()[:12])}")
+            heading = None
+    if heading:
+        points.append(heading)
+    covered = "; ".join(points) or " ".join(answer.split())
+    asked = " ".join(question.split())
+    return _clip(f"- Asked: {_clip(asked, max_tokens // 2)} | Answered: {covered}", max_tokens)
+
+
+@dataclass
+class ExpertMemory:
+    """One expert's side of a conversation"""
+    summary: str = ""
+    turns: List[Tuple[str, str]] = field(default_factory=list)
+
+    def render(self) -> str:
+        parts = []
+        if self.summary:
+            parts.append(f"Summary of earlier turns:\n{self.summary}")
+        for question, answer in self.turns:
+            parts.append(f"User asked:\n{question}\n\nYou answered:\n{answer}")
+        return "\n\n".join(parts)
+
+    def tokens(self) -> int:
+        return count_tokens(self.render())
+
+
+class Conversation:
+    """Bounded, summarized memory of a session's turns, per expert"""
+
+    def __init__(
+        self,
+        conversation_id: Optional[str] = None,
+        max_tokens: int = DEFAULT_HISTORY_TOKENS,
+        recent_turns: int = DEFAULT_RECENT_TURNS,
+        summarizer: Optional[Callable[[List[str], int], List[str]]] = None,
+    ):
+        self.id = conversation_id or uuid.uuid4().hex
+        self.max_tokens = max_tokens
+        self.recent_turns = recent_turns
+        self.summarizer = summarizer
+        self.experts: Dict[str, ExpertMemory] = {}
+        self.turns = 0
+
+    @property
+    def summary_tokens(self) -> int:
+        return self.max_tokens // 4
+
+    def history(self) -> Dict[str, str]:
+        """Each expert's memory, rendered for ``AnalysisRequest.history``"""
+        return {name: memory.render() for name, memory in self.experts.items() if memory.summary or memory.turns}
+
+    def record(self, question: str, answers: Dict[str, str]):
+        """Remember a turn: the question and each expert's answer"""
+        question = _clip(question, self.max_tokens // 4)
+        for name, answer in answers.items():
+            if not answer:
+                continue
+            memory = self.experts.setdefault(name, ExpertMemory())
+            memory.turns.append((question, answer))
+            self._compact(memory)
+        self.turns += 1
+
+    def _compact(self, memory: ExpertMemory):
+        # Roll the oldest verbatim turns into the summary until the memory fits
+        while memory.turns and (len(memory.turns) > self.recent_turns or memory.tokens() > self.max_tokens):
+            question, answer = memory.turns.pop(0)
+            memory.summary = self._summarize(memory.summary, question, answer)
+
+    def _summarize(self, summary: str, question: str, answer: str) -> str:
+        if self.summarizer is not None:
+            try:
+                text = f"{summary}\n\nUser asked:\n{question}\n\nExpert answered:\n{answer}".strip()
+                return _clip(self.summarizer([text], self.summary_tokens)[0], self.summary_tokens)
+            except Exception:
+                pass  # the extractive summary below still works
+        lines = (summary.splitlines() if summary else []) + [condense_turn(question, answer, self.summary_tokens // 2)]
+        # Oldest lines go first once the summary is over its share
+        while len(lines) > 1 and count_tokens("\n".join(lines)) > self.summary_tokens:
+            lines.pop(0)
+        return "\n".join(lines)
+
+    def clear(self):
+        self.experts.clear()
+        self.turns = 0
+
+    def tokens(self) -> int:
+        return sum(memory.tokens() for memory in self.experts.values())
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "turns": self.turns,
+            "experts": {
+                name: {"summary": memory.summary, "turns": [list(turn) for turn in memory.turns]}
+                for name, memory in self.experts.items()
+            },
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict, **options) -> "Conversation":
+        conversation = cls(data["id"], **options)
+        conversation.turns = data.get("turns", 0)
+        for name, memory in data.get("experts", {}).items():
+            conversation.experts[name] = ExpertMemory(memory["summary"], [tuple(turn) for turn in memory["turns"]])
+        return conversation
+
+
+class ConversationStore:
+    """Conversations in a SQLite file, expiring after ``ttl`` and capped in number"""
+
+    def __init__(
+        self,
+        path: str = DEFAULT_CONVERSATIONS_PATH,
+        ttl: float = DEFAULT_CONVERSATION_TTL,
+        max_conversations: int = DEFAULT_MAX_CONVERSATIONS,
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.max_conversations = max_conversations
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS conversations (
+                id TEXT PRIMARY KEY,
+                data BLOB NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        self._db.commit()
+
+    def load(self, conversation_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT data, updated_at FROM conversations WHERE id = ?", (conversation_id,)
+            ).fetchone()
+        if row is None or time.time() - row[1] >= self.ttl:
+            return None
+        return json.loads(zlib.decompress(row[0]).decode("utf-8"))
+
+    def save(self, conversation: Conversation):
+        data = zlib.compress(json.dumps(conversation.to_dict(), ensure_ascii=False).encode("utf-8"))
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO conversations (id, data, updated_at) VALUES (?, ?, ?)",
+                (conversation.id, data, now),
+            )
+            self._evict(now)
+            self._db.commit()
+
+    def delete(self, conversation_id: str):
+        with self._lock:
+            self._db.execute("DELETE FROM conversations WHERE id = ?", (conversation_id,))
+            self._db.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            count, size = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(data)), 0) FROM conversations"
+            ).fetchone()
+        return {"conversations": count, "bytes": size}
+
+    def _evict(self, now: float):
+        self._db.execute("DELETE FROM conversations WHERE updated_at <= ?", (now - self.ttl,))
+        self._db.execute(
+            """
+            DELETE FROM conversations WHERE id NOT IN (
+                SELECT id FROM conversations ORDER BY updated_at DESC LIMIT ?
+            )
+            """,
+            (self.max_conversations,),
+        )
+
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def shared_conversation_store(path: str = DEFAULT_CONVERSATIONS_PATH, **options) -> ConversationStore:
+    """Process-wide store per file, shared by every session"""
+    path = os.path.abspath(path)
+    with _shared_lock:
+        store = _shared.get(path)
+        if store is None:
+            store = _shared[path] = ConversationStore(path, **options)
+        else:
+            for name, value in options.items():
+                setattr(store, name, value)
+        return store
@@ -0,0 +1,424 @@
+"""Question routing and the analysis API shared by the UIs and batch mode"""
+from contextlib import closing
+from dataclasses import asdict, dataclass, field, replace
+from typing import AsyncIterator, Dict, Iterator, List, NamedTuple, Optional, Union
+import asyncio
+import functools
+import logging
+import threading
+import time
+
+from .agents import AGENT_SPECS, DEFAULT_MODEL_ID, registry
+from .fanout import DEFAULT_AGENT_TIMEOUT, DEFAULT_MAX_CONCURRENCY, StreamChunk, fan_out, fan_out_stream
+from .metrics import metrics
+from .rate_limit import PRIORITY_FANOUT, PRIORITY_SINGLE
+from .response_cache import AnswerCache, CacheHit
+from .streaming import Usage
+
+logger = logging.getLogger(__name__)
+
+class Section(NamedTuple):
+    """One expert's part of an answer: which agent, and how the UI labels it"""
+    agent_index: int
+    heading: str
+    status: str
+
+
+# Question types offered in the UI, and the sections (experts) each is routed to
+ROUTES = {
+    "Software Development & Architecture": [
+        Section(0, "🏗️ Senior Software Developer Analysis", "🏗️ Senior Developer analyzing your challenge..."),
+    ],
+    "AI Agent System Design": [
+        Section(1, "🤖 AI Agent Architecture Recommendations", "🤖 AI Agent Architect designing your system..."),
+    ],
+    "System Design & Scalability": [
+        Section(2, "🏢 System Design & Architecture", "🏢 System Designer creating architecture..."),
+    ],
+    "Open Source AI Contribution": [
+        Section(3, "🌟 Open Source Contribution Strategy", "🌟 Open Source Expert providing guidance..."),
+    ],
+    "Comprehensive Analysis (All Experts)": [
+        Section(0, "🏗️ Senior Developer Perspective", "🏗️ Senior Developer analyzing..."),
+        Section(1, "🤖 AI Agent Architecture Insights", "🤖 AI Agent Architect designing..."),
+        Section(2, "🏢 System Design Recommendations", "🏢 System Designer architecting..."),
+        Section(3, "🌟 Open Source Strategy", "🌟 Open Source Expert advising..."),
+    ],
+}
+QUESTION_TYPES = list(ROUTES)
+# Not a fixed route: the router picks the experts from the question
+AUTO_ROUTE = "Auto-Route (Smart Expert Selection)"
+COMPLEXITY_LEVELS = ["Beginner", "Intermediate", "Advanced", "Expert"]
+PROJECT_SCALES = ["Personal/Small", "Startup/Medium", "Enterprise/Large", "Global Scale"]
+
+
+class AgentInitializationError(RuntimeError):
+    """The expert agents could not be built (bad key, missing model SDK)"""
+
+
+@dataclass
+class AnalysisRequest:
+    question: str
+    question_type: str = QUESTION_TYPES[0]
+    tech_stack: List[str] = field(default_factory=list)
+    complexity_level: str = COMPLEXITY_LEVELS[0]
+    project_scale: str = PROJECT_SCALES[0]
+    # Expert name -> that expert's memory of earlier turns (see conversation.py)
+    history: Dict[str, str] = field(default_factory=dict)
+    # The experts an AUTO_ROUTE request was routed to, once resolve_route() ran;
+    # on a fixed route, the part of it to run (what a resumed job still needs)
+    experts: List[int] = field(default_factory=list)
+
+    def __post_init__(self):
+        if self.question_type not in ROUTES and self.question_type != AUTO_ROUTE:
+            raise ValueError(f"Unknown question_type: {self.question_type}")
+        self.tech_stack = list(self.tech_stack or [])
+        self.history = dict(self.history or {})
+        self.experts = list(self.experts or [])
+
+    @property
+    def sections(self) -> List[Section]:
+        if self.question_type != AUTO_ROUTE:
+            sections = ROUTES[self.question_type]
+            return [section for section in sections if section.agent_index in self.experts] if self.experts else sections
+        if not self.experts:
+            raise ValueError("An auto-routed request needs resolve_route() before it can run")
+        return sections_for(self.experts)
+
+    @property
+    def agent_names(self) -> List[str]:
+        """The expert behind each section"""
+        return [AGENT_SPECS[section.agent_index][0] for section in self.sections]
+
+    @property
+    def context(self) -> str:
+        """The prompt every routed expert receives"""
+        return f"""
+                Question: {self.question}
+                Question Type: {self.question_type}
+                Tech Stack: {', '.join(self.tech_stack) if self.tech_stack else 'Not specified'}
+                Complexity Level: {self.complexity_level}
+                Project Scale: {self.project_scale}
+                """
+
+    def context_for(self, agent_name: str) -> str:
+        """The prompt one expert receives: its earlier turns, if any, then the context"""
+        history = self.history.get(agent_name)
+        if not history:
+            return self.context
+        return f"\nConversation so far:\n{history}\n\nNew question follows.\n{self.context}"
+
+    @property
+    def scope(self) -> list:
+        """Everything but the question; semantic cache matches stay within it"""
+        scope = [self.question_type, self.tech_stack, self.complexity_level, self.project_scale]
+        # A follow-up only means the same thing within the same conversation
+        return scope + [self.history] if self.history else scope
+
+
+def sections_for(experts: List[int]) -> List[Section]:
+    """Sections for a routed subset: one expert's own route, or those experts' all-experts sections"""
+    if len(experts) == 1:
+        for sections in ROUTES.values():
+            if len(sections) == 1 and sections[0].agent_index == experts[0]:
+                return sections
+    return [section for section in ROUTES[QUESTION_TYPES[-1]] if section.agent_index in experts]
+
+
+def resolve_route(request: AnalysisRequest, router=None) -> AnalysisRequest:
+    """Pick the experts for an AUTO_ROUTE request; other requests pass through"""
+    if request.question_type != AUTO_ROUTE or request.experts:
+        return request
+    if router is None:
+        from .router import shared_router
+        router = shared_router()
+    decision = router.route(request.question)
+    metrics.observe_route(decision)
+    logger.info(f"Routed to {', '.join(decision.names)}"
+                f"{' (not confident, asking everyone)' if decision.fallback else ''}; "
+                f"{decision.saved} of {len(AGENT_SPECS)} expert calls saved")
+    return replace(request, experts=decision.experts)
+
+
+@dataclass
+class EngineConfig:
+    """How analyses are run: credentials, model, limits and caches"""
+    api_key: str
+    model_id: str = DEFAULT_MODEL_ID
+    max_concurrency: int = DEFAULT_MAX_CONCURRENCY
+    timeout: Optional[float] = DEFAULT_AGENT_TIMEOUT
+    response_cache: object = None
+    semantic_cache: object = None
+    token_budget: object = None
+    prefix_cache: object = None
+    resilience: object = None
+    rate_limiter: object = None
+    single_flight: object = None
+
+
+@dataclass
+class SectionResult:
+    index: int
+    agent_name: str
+    heading: str
+    content: Optional[str] = None
+    error: Optional[BaseException] = None
+    elapsed: float = 0.0
+    cache_hit: Optional[CacheHit] = None
+    queue_wait: float = 0.0
+    ttft: Optional[float] = None
+    usage: Optional[Usage] = None
+    prefix_cached: bool = False
+    attempts: int = 1
+    rate_wait: float = 0.0
+    coalesced: bool = False
+
+    @property
+    def timed_out(self) -> bool:
+        return isinstance(self.error, TimeoutError)
+
+    @property
+    def partial(self) -> bool:
+        """Failed after streaming some of its answer, which ``content`` keeps"""
+        return self.error is not None and bool(self.content)
+
+    @property
+    def cached(self) -> bool:
+        return self.cache_hit is not None
+
+    def to_dict(self) -> dict:
+        return {
+            "agent": self.agent_name,
+            "heading": self.heading,
+            "content": self.content,
+            "error": str(self.error) if self.error else None,
+            "cached": self.cached,
+            "similarity": round(self.cache_hit.similarity, 4) if self.cache_hit else None,
+            "elapsed": round(self.elapsed, 3),
+            "queue_wait": round(self.queue_wait, 3),
+            "ttft": round(self.ttft, 3) if self.ttft is not None else None,
+            "input_tokens": self.usage.input_tokens if self.usage else 0,
+            "output_tokens": self.usage.output_tokens if self.usage else 0,
+            "cached_prompt_tokens": self.usage.cached_tokens if self.usage else 0,
+            "attempts": self.attempts,
+            "rate_wait": round(self.rate_wait, 3),
+            "coalesced": self.coalesced,
+        }
+
+
+@dataclass
+class AnalysisResult:
+    request: AnalysisRequest
+    sections: List[SectionResult]
+    agent_setup: float = 0.0
+    elapsed: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return all(section.error is None for section in self.sections)
+
+    def to_dict(self) -> dict:
+        data = asdict(self.request)
+        for optional in ("history", "experts"):
+            if not data[optional]:
+                del data[optional]
+        data.update({
+            "sections": [section.to_dict() for section in self.sections],
+            "agent_setup": round(self.agent_setup, 3),
+            "elapsed": round(self.elapsed, 3),
+        })
+        return data
+
+
+def iter_analysis(
+    request: AnalysisRequest,
+    config: EngineConfig,
+    stream: bool = False,
+    timings: Optional[dict] = None,
+    priority: Optional[int] = None,
+    cancel: Optional[threading.Event] = None,
+    speculative: bool = False,
+) -> Iterator[Union[StreamChunk, SectionResult]]:
+    """Run the experts a request is routed to and yield results as they come.
+
+    An AUTO_ROUTE request is routed first (see resolve_route()); callers
+    that lay out sections before iterating should resolve it themselves.
+
+    Without ``stream`` one ``SectionResult`` is yielded per section, in
+    section order. With ``stream`` text arrives as ``StreamChunk`` events
+    from all sections interleaved, and each section's ``SectionResult``
+    follows whenever that expert finishes. Expert failures and timeouts are
+    reported on the result rather than raised, so one failing expert
+    doesn't cost the others' answers; with a ``resilience`` in the config
+    failed calls are retried first, and with a ``rate_limiter`` every call
+    waits for the shared API quota, single experts ahead of fan-outs. If
+    given, ``timings`` is filled in with how long leasing the agents took,
+    how the question was compacted to fit each expert's token budget (with
+    a ``token_budget`` in the config) and, once the run ends, the request's
+    trace record. Every run is recorded in ``metrics``. ``priority``
+    overrides the rate limiter priority, and setting ``cancel`` stops the
+    experts' calls (see fanout.CallCancelled). A ``speculative`` run (see
+    prefetch.py) is nobody's request yet: it leaves ``metrics``, the trace
+    and the caches' hit/miss stats alone.
+    """
+    started = time.perf_counter()
+    request = resolve_route(request)
+    sections = request.sections
+    # Experts on cached prompts each point their own model at their own cache
+    shared_model = config.prefix_cache is None
+    try:
+        agents = registry.acquire(config.api_key, config.model_id, shared_model)
+        routed = [agents[section.agent_index] for section in sections]
+        prefixes = [None] * len(sections)
+        if config.prefix_cache is not None:
+            prefixes = config.prefix_cache.bind(config.api_key, config.model_id, routed)
+    except Exception as e:
+        if not speculative:
+            metrics.observe_failure(request.question_type, "agent_setup")
+        raise AgentInitializationError(str(e)) from e
+    agent_setup = time.perf_counter() - started
+    if timings is not None:
+        timings["agent_setup"] = agent_setup
+
+    names = request.agent_names
+    messages = [request.context_for(name) for name in names]
+    compactions = None
+    if config.token_budget is not None:
+        compactions = [config.token_budget.fit(request, name) for name in names]
+        messages = [replace(request, question=compaction.text).context_for(name)
+                    for compaction, name in zip(compactions, names)]
+        if timings is not None:
+            timings["compaction"] = compactions
+    cache = AnswerCache(config.response_cache, config.semantic_cache, request.question, request.scope,
+                        count=not speculative)
+    engine = fan_out_stream if stream else fan_out
+    if priority is None:
+        priority = PRIORITY_SINGLE if len(sections) == 1 else PRIORITY_FANOUT
+    results = []
+    abandoned = False
+    try:
+        with closing(engine(routed, messages, config.max_concurrency, config.timeout, cache,
+                            config.resilience, config.rate_limiter, priority, config.single_flight, cancel)) as events:
+            for event in events:
+                if isinstance(event, StreamChunk):
+                    yield event
+                    continue
+                abandoned = abandoned or event.abandoned
+                usage, prefix = event.usage, prefixes[event.index]
+                if prefix is not None and usage is not None and not usage.cached_tokens:
+                    # The model didn't say; the whole cached prompt was left out of the call
+                    usage = usage._replace(cached_tokens=prefix.tokens)
+                result = SectionResult(
+                    index=event.index,
+                    agent_name=event.agent_name,
+                    heading=sections[event.index].heading,
+                    content=event.content,
+                    error=event.error,
+                    elapsed=event.elapsed,
+                    cache_hit=event.cache_hit,
+                    queue_wait=event.queue_wait,
+                    ttft=event.ttft,
+                    usage=usage,
+                    prefix_cached=prefix is not None,
+                    attempts=event.attempts,
+                    rate_wait=event.rate_wait,
+                    coalesced=event.coalesced,
+                )
+                results.append(result)
+                if not speculative:
+                    metrics.observe_section(result, cache_enabled=bool(cache))
+                yield result
+    finally:
+        # If a call or one of its attempts timed out, or the caller stopped
+        # early, one may still be running on these agents; leave them out of the pool
+        finished = sum(1 for result in results if not result.timed_out)
+        if finished == len(sections) and not abandoned:
+            registry.release(config.api_key, config.model_id, agents, shared_model)
+        if not speculative:
+            trace = metrics.observe_request(
+                request, results, agent_setup, time.perf_counter() - started,
+                complete=len(results) == len(sections), stream=stream, compactions=compactions,
+            )
+            if timings is not None:
+                timings["trace"] = trace
+
+
+def run_analysis(request: AnalysisRequest, config: EngineConfig) -> AnalysisResult:
+    """Run a request to completion and return every section with timings"""
+    started = time.perf_counter()
+    timings = {}
+    request = resolve_route(request)
+    sections = list(iter_analysis(request, config, timings=timings))
+    return AnalysisResult(request, sections, timings["agent_setup"], time.perf_counter() - started)
+
+
+def analyze(
+    question: str,
+    question_type: str = QUESTION_TYPES[0],
+    tech_stack: Optional[List[str]] = None,
+    complexity_level: str = COMPLEXITY_LEVELS[0],
+    project_scale: str = PROJECT_SCALES[0],
+    *,
+    config: EngineConfig,
+) -> AnalysisResult:
+    """Ask the experts a question; the synchronous entry point"""
+    request = AnalysisRequest(question, question_type, tech_stack, complexity_level, project_scale)
+    return run_analysis(request, config)
+
+
+async def aanalyze(
+    question: str,
+    question_type: str = QUESTION_TYPES[0],
+    tech_stack: Optional[List[str]] = None,
+    complexity_level: str = COMPLEXITY_LEVELS[0],
+    project_scale: str = PROJECT_SCALES[0],
+    *,
+    config: EngineConfig,
+) -> AnalysisResult:
+    """Async analyze(); the experts run on worker threads off the event loop"""
+    request = AnalysisRequest(question, question_type, tech_stack, complexity_level, project_scale)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, functools.partial(run_analysis, request, config))
+
+
+async def aiter_analysis(
+    request: AnalysisRequest,
+    config: EngineConfig,
+    stream: bool = False,
+) -> AsyncIterator[Union[StreamChunk, SectionResult]]:
+    """Async iter_analysis(), bridged from a worker thread through a queue"""
+    loop = asyncio.get_running_loop()
+    events: asyncio.Queue = asyncio.Queue()
+    done = object()
+    cancelled = threading.Event()
+
+    def put(event):
+        try:
+            loop.call_soon_threadsafe(events.put_nowait, event)
+        except RuntimeError:
+            pass  # the loop is gone; nobody is listening any more
+
+    def produce():
+        try:
+            with closing(iter_analysis(request, config, stream, cancel=cancelled)) as results:
+                for event in results:
+                    if cancelled.is_set():
+                        break
+                    put(event)
+        except Exception as e:
+            put(e)
+        finally:
+            put(done)
+
+    loop.run_in_executor(None, produce)
+    try:
+        while True:
+            event = await events.get()
+            if event is done:
+                break
+            if isinstance(event, BaseException):
+                raise event
+            yield event
+    finally:
+        # Stops the experts' calls too (unless another caller follows them); don't wait them out
+        cancelled.set()
@@ -0,0 +1,411 @@
+"""Export analyses to Google Docs as native document structure.
+
+Markdown answers are parsed into paragraphs (headings, bullet and numbered
+lists, code blocks, bold, inline code and links) and appended to the end of
+a document in size-bounded ``batchUpdate`` calls. ``DocsWriter`` tracks the
+insertion indexes so sections written out of order still land in order,
+and retries failed calls; before retrying it checks whether the failed
+call landed anyway so text is never inserted twice. ``ExportJob`` runs an
+export on a background thread, taking sections as they are ready, and the
+UI polls it.
+"""
+from concurrent.futures import Future
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+import logging
+import math
+import queue
+import random
+import re
+import sys
+import threading
+import time
+
+from .google_clients import build_service
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+DOCS_URL = "https://docs.google.com/document/d/{}/edit"
+# Bounds for one batchUpdate: inserted characters and number of requests
+MAX_BATCH_CHARS = 20000
+MAX_BATCH_REQUESTS = 400
+DEFAULT_RETRIES = 4
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# An export nobody closes finishes after this many idle seconds
+IDLE_TIMEOUT = 900.0
+CODE_FONT = "Roboto Mono"
+LIST_PRESETS = {
+    "bullet": "BULLET_DISC_CIRCLE_SQUARE",
+    "number": "NUMBERED_DECIMAL_ALPHA_ROMAN",
+}
+
+_HEADING = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+_LIST_ITEM = re.compile(r"^\s*(?:([-*+])|\d+[.)])\s+(.*)$")
+_RULE = re.compile(r"^\s*([-*_])(\s*\1){2,}\s*$")
+_INLINE = re.compile(r"`([^`]+)`|\*\*(.+?)\*\*|__(.+?)__|\[([^\]]+)\]\(([^)\s]+)\)")
+
+
+class Span(NamedTuple):
+    """Inline styling within a paragraph, in UTF-16 offsets from its start"""
+    start: int
+    end: int
+    kind: str  # "bold", "code" or "link"
+    url: Optional[str] = None
+
+
+class Block(NamedTuple):
+    """One paragraph of the exported document"""
+    text: str
+    style: str = "NORMAL_TEXT"
+    list_kind: Optional[str] = None
+    code: bool = False
+    spans: Tuple[Span, ...] = ()
+
+
+class Batch(NamedTuple):
+    """One batchUpdate: its requests and the index range it fills"""
+    requests: List[dict]
+    start: int
+    end: int
+
+
+def utf16_len(text: str) -> int:
+    """Docs indexes text in UTF-16 code units, not Python characters"""
+    return len(text.encode("utf-16-le")) // 2
+
+
+def parse_inline(text: str) -> Tuple[str, Tuple[Span, ...]]:
+    """Strip inline markdown from a line and record where its styles go"""
+    plain, spans, position, offset = [], [], 0, 0
+    for match in _INLINE.finditer(text):
+        before = text[position:match.start()]
+        plain.append(before)
+        offset += utf16_len(before)
+        code, bold, underscored, label, url = match.groups()
+        inner = code or bold or underscored or label
+        kind = "code" if code else "link" if label else "bold"
+        plain.append(inner)
+        spans.append(Span(offset, offset + utf16_len(inner), kind, url))
+        offset += utf16_len(inner)
+        position = match.end()
+    plain.append(text[position:])
+    return "".join(plain), tuple(spans)
+
+
+def parse_markdown(markdown: str, heading_offset: int = 0) -> List[Block]:
+    """Turn markdown into paragraphs; ``heading_offset`` demotes headings"""
+    blocks = []
+    in_code = False
+    for line in markdown.splitlines():
+        if line.strip().startswith("```"):
+            in_code = not in_code
+            continue
+        if in_code:
+            blocks.append(Block(line.rstrip(), code=True))
+            continue
+        if not line.strip() or _RULE.match(line):
+            continue
+        heading = _HEADING.match(line)
+        if heading:
+            level = min(len(heading.group(1)) + heading_offset, 6)
+            text, spans = parse_inline(heading.group(2))
+            blocks.append(Block(text, style=f"HEADING_{level}", spans=spans))
+            continue
+        item = _LIST_ITEM.match(line)
+        if item:
+            text, spans = parse_inline(item.group(2))
+            blocks.append(Block(text, list_kind="bullet" if item.group(1) else "number", spans=spans))
+            continue
+        text, spans = parse_inline(line.strip().lstrip(">").strip())
+        blocks.append(Block(text, spans=spans))
+    return blocks
+
+
+def _range(start: int, end: int) -> dict:
+    return {"startIndex": start, "endIndex": end}
+
+
+def _block_requests(block: Block, start: int) -> List[dict]:
+    """Styling for one paragraph whose text starts at ``start``"""
+    requests = []
+    end = start + utf16_len(block.text)
+    if block.style != "NORMAL_TEXT":
+        requests.append({"updateParagraphStyle": {
+            "range": _range(start, end + 1),
+            "paragraphStyle": {"namedStyleType": block.style},
+            "fields": "namedStyleType",
+        }})
+    if block.code and end > start:
+        requests.append({"updateTextStyle": {
+            "range": _range(start, end),
+            "textStyle": {"weightedFontFamily": {"fontFamily": CODE_FONT}},
+            "fields": "weightedFontFamily",
+        }})
+    for span in block.spans:
+        if span.kind == "bold":
+            style, fields = {"bold": True}, "bold"
+        elif span.kind == "code":
+            style, fields = {"weightedFontFamily": {"fontFamily": CODE_FONT}}, "weightedFontFamily"
+        else:
+            style, fields = {"link": {"url": span.url}}, "link"
+        requests.append({"updateTextStyle": {
+            "range": _range(start + span.start, start + span.end),
+            "textStyle": style,
+            "fields": fields,
+        }})
+    return requests
+
+
+def _units(blocks: Iterable[Block]) -> List[List[Block]]:
+    """Group consecutive items of the same list so a batch never splits one"""
+    units: List[List[Block]] = []
+    for block in blocks:
+        if block.list_kind and units and units[-1][-1].list_kind == block.list_kind:
+            units[-1].append(block)
+        else:
+            units.append([block])
+    return units
+
+
+def _batch(blocks: List[Block], start: int) -> Batch:
+    text = "".join(block.text + "\n" for block in blocks)
+    end = start + utf16_len(text)
+    requests = [
+        {"insertText": {"location": {"index": start}, "text": text}},
+        # Inserted paragraphs inherit the style around the insertion point; reset it
+        {"updateParagraphStyle": {
+            "range": _range(start, end),
+            "paragraphStyle": {"namedStyleType": "NORMAL_TEXT"},
+            "fields": "namedStyleType",
+        }},
+        {"deleteParagraphBullets": {"range": _range(start, end)}},
+        {"updateTextStyle": {
+            "range": _range(start, end),
+            "textStyle": {},
+            "fields": "bold,italic,link,weightedFontFamily",
+        }},
+    ]
+    position = start
+    list_start, list_kind = None, None
+    for block in blocks:
+        if block.list_kind != list_kind:
+            if list_kind:
+                requests.append(_bullets(list_start, position, list_kind))
+            list_start, list_kind = position, block.list_kind
+        requests.extend(_block_requests(block, position))
+        position += utf16_len(block.text) + 1
+    if list_kind:
+        requests.append(_bullets(list_start, position, list_kind))
+    return Batch(requests, start, end)
+
+
+def _bullets(start: int, end: int, kind: str) -> dict:
+    return {"createParagraphBullets": {"range": _range(start, end), "bulletPreset": LIST_PRESETS[kind]}}
+
+
+def plan_batches(
+    blocks: Iterable[Block],
+    start: int,
+    max_chars: int = MAX_BATCH_CHARS,
+    max_requests: int = MAX_BATCH_REQUESTS,
+) -> List[Batch]:
+    """Split paragraphs into batchUpdates appended one after another at ``start``"""
+    batches = []
+    pending: List[Block] = []
+    chars = requests = 0
+    for unit in _units(blocks):
+        unit_chars = sum(utf16_len(block.text) + 1 for block in unit)
+        unit_requests = sum(len(_block_requests(block, 0)) for block in unit) + 1
+        if pending and (chars + unit_chars > max_chars or requests + unit_requests > max_requests):
+            batches.append(_batch(pending, start))
+            start = batches[-1].end
+            pending, chars, requests = [], 0, 0
+        pending.extend(unit)
+        chars += unit_chars
+        requests += unit_requests
+    if pending:
+        batches.append(_batch(pending, start))
+    return batches
+
+
+def _retryable(error: BaseException) -> bool:
+    # Only the API client raises HttpError, so it is loaded by the time one is seen
+    errors = sys.modules.get("googleapiclient.errors")
+    if errors is not None and isinstance(error, errors.HttpError):
+        return error.resp.status in RETRY_STATUSES
+    # Dropped connections and socket timeouts
+    return isinstance(error, OSError)
+
+
+class DocsWriter:
+    """Writes paragraphs into one document, keeping track of where its end is"""
+
+    def __init__(self, service, document_id: str, index: int = 1, retries: int = DEFAULT_RETRIES,
+                 backoff: float = 1.0, max_chars: int = MAX_BATCH_CHARS, max_requests: int = MAX_BATCH_REQUESTS):
+        self.service = service
+        self.document_id = document_id
+        # Where appended text goes: just before the body's final newline
+        self.index = index
+        self.retries = retries
+        self.backoff = backoff
+        self.max_chars = max_chars
+        self.max_requests = max_requests
+        self.batches_written = 0
+
+    @classmethod
+    def create(cls, service, title: str, **options) -> "DocsWriter":
+        """Create an empty document and a writer for it"""
+        document = _with_retries(
+            lambda: service.documents().create(body={"title": title}).execute(),
+            options.get("retries", DEFAULT_RETRIES), options.get("backoff", 1.0),
+        )
+        return cls(service, document["documentId"], **options)
+
+    @property
+    def url(self) -> str:
+        return DOCS_URL.format(self.document_id)
+
+    def plan(self, blocks: Iterable[Block], at: Optional[int] = None) -> List[Batch]:
+        """Batches that insert ``blocks`` at index ``at`` (default: the end)"""
+        return plan_batches(blocks, self.index if at is None else at, self.max_chars, self.max_requests)
+
+    def append(self, blocks: Iterable[Block]) -> int:
+        """Write paragraphs at the end of the document; returns the batches used"""
+        return self.insert(blocks, self.index)
+
+    def insert(self, blocks: Iterable[Block], at: int) -> int:
+        """Write paragraphs starting at index ``at``; returns the batches used"""
+        batches = self.plan(blocks, at)
+        for batch in batches:
+            self.write(batch)
+        return len(batches)
+
+    def write(self, batch: Batch):
+        """Apply one planned batch, retrying transient failures"""
+        if not 1 <= batch.start <= self.index:
+            raise ValueError(f"Batch planned for index {batch.start}, document ends at {self.index}")
+        # Wherever the batch goes, the document grows by exactly its length
+        expected = self.index + batch.end - batch.start
+        _with_retries(
+            lambda: self.service.documents().batchUpdate(
+                documentId=self.document_id, body={"requests": batch.requests}).execute(),
+            self.retries, self.backoff,
+            landed=lambda: self.end_index() == expected,
+        )
+        self.index = expected
+        self.batches_written += 1
+
+    def end_index(self) -> int:
+        """Where text appended to the document goes right now"""
+        document = self.service.documents().get(
+            documentId=self.document_id, fields="body/content/endIndex").execute()
+        # The body always ends with a newline that appended text goes before
+        return document["body"]["content"][-1]["endIndex"] - 1
+
+
+def _with_retries(call, retries: int, backoff: float, landed=None):
+    """Run ``call``, retrying transient errors with jittered exponential backoff.
+
+    If given, ``landed`` is asked before each retry whether the failed
+    attempt took effect anyway (the response was lost, not the write).
+    """
+    for attempt in range(retries + 1):
+        try:
+            return call()
+        except Exception as e:
+            if attempt == retries or not _retryable(e):
+                raise
+            delay = backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+            logger.warning(f"Google Docs call failed ({e}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+            try:
+                if landed is not None and landed():
+                    return None
+            except Exception as check_error:
+                logger.warning(f"Could not check the document: {check_error}")
+
+
+class ExportJob:
+    """A background export the UI can poll.
+
+    The document is created as soon as the job starts. Content is added to
+    numbered slots with ``add()`` in any order and lands in slot order: a
+    slot is inserted after everything already written to lower slots, so
+    sections can be written as their experts finish. ``close()`` says no
+    more content is coming. One worker thread does all the writes.
+    """
+
+    def __init__(self, credentials, title: str, idle_timeout: float = IDLE_TIMEOUT):
+        self.title = title
+        self.status = "queued"  # queued, creating, uploading, done, failed
+        self.document_id: Optional[str] = None
+        self.batches_done = 0
+        self.batches_total = 0
+        self.error: Optional[BaseException] = None
+        self.elapsed: Optional[float] = None
+        self.future: Future = Future()
+        self.idle_timeout = idle_timeout
+        self._credentials = credentials
+        self._pending: "queue.Queue" = queue.Queue()
+        self._written: Dict[float, int] = {}
+        threading.Thread(target=self._run, name="docs-export", daemon=True).start()
+
+    @property
+    def url(self) -> Optional[str]:
+        return DOCS_URL.format(self.document_id) if self.document_id else None
+
+    @property
+    def done(self) -> bool:
+        return self.status in ("done", "failed")
+
+    def add(self, blocks: Iterable[Block], slot: float = math.inf):
+        """Queue paragraphs for a slot; the default slot is after everything"""
+        self._pending.put((slot, list(blocks)))
+
+    def close(self):
+        self._pending.put(None)
+
+    def _run(self):
+        started = time.perf_counter()
+        try:
+            # Each export gets its own client: the HTTP transport isn't thread-safe
+            service = build_service("docs", "v1", self._credentials)
+            self.status = "creating"
+            writer = DocsWriter.create(service, self.title)
+            start = writer.index
+            self.document_id = writer.document_id
+            self.status = "uploading"
+            while True:
+                try:
+                    item = self._pending.get(timeout=self.idle_timeout)
+                except queue.Empty:
+                    logger.warning(f"Google Docs export '{self.title}' was never closed, finishing it")
+                    break
+                if item is None:
+                    break
+                slot, blocks = item
+                at = start + sum(length for written, length in self._written.items() if written <= slot)
+                batches = writer.plan(blocks, at)
+                self.batches_total += len(batches)
+                for batch in batches:
+                    writer.write(batch)
+                    self.batches_done += 1
+                self._written[slot] = self._written.get(slot, 0) + sum(batch.end - batch.start for batch in batches)
+            self.status = "done"
+            self.future.set_result(self.document_id)
+        except Exception as e:
+            logger.error(f"Google Docs export failed: {str(e)}")
+            self.error = e
+            self.status = "failed"
+            self.future.set_exception(e)
+        finally:
+            self.elapsed = time.perf_counter() - started
+            metrics.observe_docs_export(self.elapsed, self.status, self.batches_done, self.document_id)
+
+
+def export_document(credentials, title: str, blocks: Iterable[Block]) -> ExportJob:
+    """Create a document from ``blocks`` in the background"""
+    job = ExportJob(credentials, title)
+    job.add(blocks)
+    job.close()
+    return job
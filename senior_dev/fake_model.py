@@ -0,0 +1,189 @@
+"""Offline stand-in for the Gemini model, for benchmarks and tests.
+
+``FakeModel`` is an agno ``Model`` that never touches the network: it
+sleeps for a sampled latency, then returns (or streams) a canned markdown
+answer at a configurable token rate, and can be told to fail or hang a
+fraction of calls. Draws are seeded from the prompt, so the same prompt
+always gets the same latency, answer and failure.
+
+Select it anywhere a model id is accepted with a ``fake`` id; options go
+after a colon::
+
+    fake
+    fake:latency=lognormal,median=1.5,sigma=0.6,tps=80,tokens=400
+    fake:fail=0.05,hang=0.01,seed=7
+    fake:flaky=2               # every prompt fails twice, then answers (to exercise retries)
+    fake:prefill=2000          # prompt processing takes time, so shorter prompts answer sooner
+"""
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Iterator, List, Optional
+import asyncio
+import math
+import random
+import threading
+import time
+import zlib
+
+from agno.models.base import Model
+from agno.models.message import Message
+from agno.models.response import ModelResponse
+
+try:
+    from agno.metrics import MessageMetrics
+except ImportError:
+    MessageMetrics = None
+
+FAKE_MODEL_PREFIX = "fake"
+LATENCY_DISTRIBUTIONS = ("fixed", "uniform", "lognormal")
+
+_WORDS = (
+    "cache queue shard replica service latency throughput index partition "
+    "agent prompt token model retry backoff deadline budget pipeline worker "
+    "schema migration rollout canary observability trace metric alert"
+).split()
+
+
+class FakeModelError(ConnectionError):
+    """An injected model failure, transient as a provider's 503 is. agno reports it by
+    its message alone, so that carries the status too."""
+    status_code = 503
+
+
+# Calls seen per (model id, prompt), for flaky failures
+_calls = {}
+_calls_lock = threading.Lock()
+
+
+def is_fake_model(model_id: str) -> bool:
+    return model_id == FAKE_MODEL_PREFIX or model_id.startswith(FAKE_MODEL_PREFIX + ":")
+
+
+@dataclass
+class FakeModel(Model):
+    """Deterministic offline model with tunable latency, speed and failures"""
+    id: str = FAKE_MODEL_PREFIX
+    name: str = "FakeModel"
+    provider: str = "Fake"
+
+    # Time to first token, in seconds
+    latency: str = "lognormal"
+    median: float = 0.8
+    sigma: float = 0.5
+    low: float = 0.2
+    high: float = 2.0
+    # Prompt processing speed; 0 makes prompt length free
+    prefill_tokens_per_second: float = 0.0
+    # Generation speed and answer length
+    tokens_per_second: float = 120.0
+    response_tokens: int = 300
+    # Fraction of calls that raise, and that never finish
+    failure_rate: float = 0.0
+    hang_rate: float = 0.0
+    hang_seconds: float = 3600.0
+    # Failures before each distinct prompt gets an answer, like a transient outage
+    flaky_failures: int = 0
+    seed: int = 0
+    # Set by prefix_cache; the system prompt then isn't part of the messages
+    cached_content: Optional[str] = None
+
+    @classmethod
+    def from_id(cls, model_id: str) -> "FakeModel":
+        """Parse ``fake:key=value,...`` into a model"""
+        aliases = {"tps": "tokens_per_second", "tokens": "response_tokens", "fail": "failure_rate", "hang": "hang_rate",
+                   "prefill": "prefill_tokens_per_second", "flaky": "flaky_failures"}
+        options = {}
+        _, _, spec = model_id.partition(":")
+        for item in filter(None, (part.strip() for part in spec.split(","))):
+            key, sep, value = item.partition("=")
+            key = aliases.get(key.strip(), key.strip())
+            if not sep or key not in cls.__dataclass_fields__ or key in ("id", "name", "provider", "cached_content"):
+                raise ValueError(f"Unknown fake model option: {item}")
+            default = cls.__dataclass_fields__[key].default
+            options[key] = type(default)(value.strip())
+        if options.get("latency", "lognormal") not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"latency must be one of {', '.join(LATENCY_DISTRIBUTIONS)}")
+        return cls(id=model_id, **options)
+
+    def _plan(self, messages: List[Message]):
+        """Draw this call's latency, outcome and answer from the prompt"""
+        prompt = "\n".join(str(message.content) for message in messages if message.content)
+        rng = random.Random(zlib.crc32(prompt.encode("utf-8")) ^ self.seed)
+        if self.latency == "fixed":
+            delay = self.median
+        elif self.latency == "uniform":
+            delay = rng.uniform(self.low, self.high)
+        else:
+            delay = rng.lognormvariate(math.log(self.median), self.sigma)
+        if self.prefill_tokens_per_second > 0:
+            delay += len(prompt) / 4 / self.prefill_tokens_per_second
+        if self.flaky_failures:
+            key = (self.id, zlib.crc32(prompt.encode("utf-8")))
+            with _calls_lock:
+                _calls[key] = calls = _calls.get(key, 0) + 1
+            if calls <= self.flaky_failures:
+                return delay, FakeModelError("Injected model failure (503 UNAVAILABLE)"), []
+        outcome = rng.random()
+        if outcome < self.failure_rate:
+            return delay, FakeModelError("Injected model failure (503 UNAVAILABLE)"), []
+        if outcome < self.failure_rate + self.hang_rate:
+            return self.hang_seconds, None, []
+        tokens = ["## Answer\n\n"] + [rng.choice(_WORDS) + " " for _ in range(max(self.response_tokens - 1, 0))]
+        return delay, None, tokens
+
+    def _usage(self, messages: List[Message], tokens: List[str]):
+        if MessageMetrics is None:
+            return None
+        # Roughly four characters per token, like the real tokenizers
+        input_tokens = sum(len(str(message.content or "")) for message in messages) // 4
+        return MessageMetrics(input_tokens=input_tokens, output_tokens=len(tokens), total_tokens=input_tokens + len(tokens))
+
+    def _final(self, messages: List[Message], tokens: List[str], content) -> ModelResponse:
+        return ModelResponse(role="assistant", content=content, response_usage=self._usage(messages, tokens))
+
+    def invoke(self, messages: List[Message], assistant_message: Message, *args, **kwargs) -> ModelResponse:
+        delay, error, tokens = self._plan(messages)
+        assistant_message.metrics.start_timer()
+        time.sleep(delay + len(tokens) / self.tokens_per_second)
+        assistant_message.metrics.stop_timer()
+        if error is not None:
+            raise error
+        return self._final(messages, tokens, "".join(tokens))
+
+    async def ainvoke(self, messages: List[Message], assistant_message: Message, *args, **kwargs) -> ModelResponse:
+        delay, error, tokens = self._plan(messages)
+        assistant_message.metrics.start_timer()
+        await asyncio.sleep(delay + len(tokens) / self.tokens_per_second)
+        assistant_message.metrics.stop_timer()
+        if error is not None:
+            raise error
+        return self._final(messages, tokens, "".join(tokens))
+
+    def invoke_stream(self, messages: List[Message], assistant_message: Message, *args, **kwargs) -> Iterator[ModelResponse]:
+        delay, error, tokens = self._plan(messages)
+        assistant_message.metrics.start_timer()
+        time.sleep(delay)
+        if error is not None:
+            raise error
+        for token in tokens:
+            time.sleep(1 / self.tokens_per_second)
+            yield ModelResponse(content=token)
+        assistant_message.metrics.stop_timer()
+        yield self._final(messages, tokens, None)
+
+    async def ainvoke_stream(self, messages: List[Message], assistant_message: Message, *args, **kwargs) -> AsyncIterator[ModelResponse]:
+        delay, error, tokens = self._plan(messages)
+        assistant_message.metrics.start_timer()
+        await asyncio.sleep(delay)
+        if error is not None:
+            raise error
+        for token in tokens:
+            await asyncio.sleep(1 / self.tokens_per_second)
+            yield ModelResponse(content=token)
+        assistant_message.metrics.stop_timer()
+        yield self._final(messages, tokens, None)
+
+    def _parse_provider_response(self, response: Any, **kwargs) -> ModelResponse:
+        return response
+
+    def _parse_provider_response_delta(self, response: Any) -> ModelResponse:
+        return response
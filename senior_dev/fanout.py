@@ -0,0 +1,406 @@
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from dataclasses import dataclass
+from .resilience import AttemptTimeoutError, run_attempt
+from .response_cache import CacheHit
+from .streaming import ContentStream, Usage, estimate_tokens, run_agent
+from typing import Iterator, List, Optional, Sequence, Union
+import queue
+import threading
+import time
+
+DEFAULT_MAX_CONCURRENCY = 4
+DEFAULT_AGENT_TIMEOUT = 120.0
+
+
+@dataclass
+class FanOutResult:
+    """Outcome of one agent call in a fan-out"""
+    index: int
+    agent_name: str
+    content: Optional[str] = None
+    error: Optional[BaseException] = None
+    elapsed: float = 0.0
+    cache_hit: Optional[CacheHit] = None
+    # Time spent waiting for a worker, and from start to the first streamed text
+    queue_wait: float = 0.0
+    ttft: Optional[float] = None
+    usage: Optional[Usage] = None
+    # Model calls made, retries included
+    attempts: int = 1
+    # Time spent waiting for the shared API quota
+    rate_wait: float = 0.0
+    # Answered by an identical call already in flight (see single_flight.py)
+    coalesced: bool = False
+    # A timed-out attempt may still be running on the agent, even if a retry answered
+    abandoned: bool = False
+
+    @property
+    def cached(self) -> bool:
+        return self.cache_hit is not None
+
+    @property
+    def timed_out(self) -> bool:
+        return isinstance(self.error, TimeoutError)
+
+
+class CallCancelled(RuntimeError):
+    """The caller stopped wanting the answer, and no other caller was waiting for it"""
+
+
+@dataclass
+class StreamChunk:
+    """A piece of streamed text from one agent in a fan-out"""
+    index: int
+    text: str
+
+
+class _Quota:
+    """One agent's turns at the rate limiter: wait before each attempt, settle after"""
+
+    def __init__(self, limiter, message: str, priority: int, deadline: Optional[float]):
+        self.limiter = limiter
+        self.message = message
+        self.priority = priority
+        self.deadline = deadline
+        self.permit = None
+        self.waited = 0.0
+
+    def wait(self):
+        if self.limiter is not None:
+            self.permit = self.limiter.reserve(self.message, self.priority, self.deadline)
+            self.waited += self.permit.waited
+
+    def settle(self, permit, usage: Optional[Usage] = None, error: Optional[BaseException] = None):
+        if permit is not None:
+            self.limiter.settle(permit, usage.input_tokens + usage.output_tokens if usage else None, error)
+
+
+def _deadline(started_at: float, timeout: Optional[float]) -> Optional[float]:
+    return started_at + timeout if timeout is not None else None
+
+
+def _remaining(deadline: Optional[float]) -> Optional[float]:
+    return max(deadline - time.perf_counter(), 0.0) if deadline is not None else None
+
+
+class _Call:
+    """Runs one agent and records when it actually started"""
+
+    def __init__(self, agent, message: str, cache=None, resilience=None, timeout: Optional[float] = None,
+                 limiter=None, priority: int = 0, flights=None, cancel: Optional[threading.Event] = None):
+        self.agent = agent
+        self.message = message
+        self.cache = cache
+        self.resilience = resilience
+        self.timeout = timeout
+        self.limiter = limiter
+        self.priority = priority
+        self.flights = flights
+        self.cancel = cancel
+        self.cache_hit = None
+        self.usage = None
+        self.attempts = 1
+        self.rate_wait = 0.0
+        self.coalesced = False
+        self.abandoned = False
+        self.submitted_at = time.perf_counter()
+        self.started = threading.Event()
+        self.started_at = 0.0
+
+    def __call__(self):
+        self.started_at = time.perf_counter()
+        self.started.set()
+        if self.cache:
+            self.cache_hit = self.cache.lookup(self.agent, self.message)
+            if self.cache_hit is not None:
+                return self.cache_hit.content
+        if self.cancel is not None and self.cancel.is_set():
+            raise CallCancelled(f"{self.agent.name} was cancelled before it started")
+        deadline = _deadline(self.started_at, self.timeout)
+        flight = None
+        if self.flights is not None:
+            flight, leads = self.flights.join(self.agent, self.message)
+            if not leads:
+                self.coalesced = True
+                return flight.wait(deadline)
+        quota = _Quota(self.limiter, self.message, self.priority, deadline)
+
+        def attempt(cancelled):
+            permit = quota.permit
+            try:
+                content, usage = run_agent(self.agent, self.message)
+            except Exception as e:
+                quota.settle(permit, error=e)
+                raise
+            quota.settle(permit, usage)
+            return content, usage
+
+        content, error = None, None
+        try:
+            if self.resilience is None:
+                quota.wait()
+                try:
+                    # On its own thread, so a hung call gives up this worker at the deadline
+                    content, self.usage = run_attempt(attempt, _remaining(deadline), deadline=deadline)
+                except AttemptTimeoutError:
+                    self.abandoned = True
+                    raise
+            else:
+                outcome = self.resilience.call(self.agent.model.id, attempt, deadline, before_attempt=quota.wait)
+                self.attempts, self.abandoned = outcome.attempts, outcome.abandoned
+                if outcome.error is not None:
+                    raise outcome.error
+                content, self.usage = outcome.value
+            # Stored before the flight lands, so a caller arriving in between finds it
+            if self.cache:
+                self.cache.store(self.agent, self.message, content)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self.rate_wait = quota.waited
+            if flight is not None:
+                self.flights.land(flight, content, self.usage, error)
+        return content
+
+
+def _usage(message: str, content: Optional[str], reported: Optional[Usage]) -> Usage:
+    """The model's own token counts, or an estimate when it gave none"""
+    return reported or Usage(estimate_tokens(message), estimate_tokens(content), estimated=True)
+
+
+def _messages(message: Union[str, Sequence[str]], count: int) -> List[str]:
+    """One message per agent: the same for all, or each its own"""
+    if isinstance(message, str):
+        return [message] * count
+    if len(message) != count:
+        raise ValueError(f"Expected {count} messages, got {len(message)}")
+    return list(message)
+
+
+def fan_out(
+    agents: Sequence,
+    message: Union[str, Sequence[str]],
+    max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+    timeout: Optional[float] = DEFAULT_AGENT_TIMEOUT,
+    cache=None,
+    resilience=None,
+    limiter=None,
+    priority: int = 0,
+    flights=None,
+    cancel: Optional[threading.Event] = None,
+) -> Iterator[FanOutResult]:
+    """Run every agent on the same message (or each on its own) concurrently.
+
+    Results are yielded in the order of ``agents``, each one as soon as it
+    and everything before it has finished, so callers can render sections
+    in a fixed order while later agents are still running. ``timeout``
+    applies per agent and is measured from when that agent starts, not
+    from when it was queued behind the concurrency limit. A timed-out call
+    is abandoned: it keeps running in the background on its own thread,
+    its worker moves on to the next agent, and its result is reported as a
+    ``TimeoutError``. With a ``cache`` (a response_cache.AnswerCache), hits
+    return without calling the agent and fresh answers are stored. With
+    ``resilience`` (a resilience.Resilience), failed calls are retried
+    within ``timeout`` and a failing model is cut off by its breaker. With
+    a ``limiter`` (a rate_limit.RateLimiter), every model call first waits
+    for quota at ``priority``; that wait counts against ``timeout``. With
+    ``flights`` (a single_flight.SingleFlight), a call identical to one
+    already in flight waits for that one's answer instead of asking the model.
+    Calls that haven't started once ``cancel`` is set fail with ``CallCancelled``.
+    """
+    executor = ThreadPoolExecutor(
+        max_workers=max(1, min(max_concurrency, len(agents))),
+        thread_name_prefix="fanout",
+    )
+    messages = _messages(message, len(agents))
+    calls = [_Call(agent, text, cache, resilience, timeout, limiter, priority, flights, cancel)
+             for agent, text in zip(agents, messages)]
+    futures = [executor.submit(call) for call in calls]
+    try:
+        for index, (agent, call, future) in enumerate(zip(agents, calls, futures)):
+            result = FanOutResult(index=index, agent_name=agent.name)
+            call.started.wait()
+            remaining = None
+            if timeout is not None:
+                remaining = max(0.0, timeout - (time.perf_counter() - call.started_at))
+            try:
+                result.content = future.result(timeout=remaining)
+            except Exception as e:
+                # The call's own timeouts are TimeoutErrors too; only an unfinished call ran out of time here
+                if isinstance(e, FutureTimeoutError) and not future.done():
+                    e = TimeoutError(f"{agent.name} did not answer within {timeout:g}s")
+                    result.abandoned = True
+                result.error = e
+            result.elapsed = time.perf_counter() - call.started_at
+            result.queue_wait = call.started_at - call.submitted_at
+            result.cache_hit = call.cache_hit
+            result.attempts = call.attempts
+            result.rate_wait = call.rate_wait
+            result.coalesced = call.coalesced
+            result.abandoned = result.abandoned or call.abandoned
+            if result.content is not None and not result.cached and not result.coalesced:
+                result.usage = _usage(call.message, result.content, call.usage)
+            yield result
+    finally:
+        # Don't block on stragglers that already timed out
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+
+def fan_out_stream(
+    agents: Sequence,
+    message: Union[str, Sequence[str]],
+    max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+    timeout: Optional[float] = DEFAULT_AGENT_TIMEOUT,
+    cache=None,
+    resilience=None,
+    limiter=None,
+    priority: int = 0,
+    flights=None,
+    cancel: Optional[threading.Event] = None,
+    poll_interval: float = 0.05,
+) -> Iterator[Union[StreamChunk, FanOutResult]]:
+    """Streaming variant of fan_out().
+
+    Every agent runs in streaming mode on a worker thread. Text chunks from
+    all agents are yielded interleaved as ``StreamChunk`` events as soon as
+    they arrive, followed by one ``FanOutResult`` per agent when it finishes,
+    fails or runs past ``timeout``. Callers own the layout: the index on
+    each event says which section it belongs to. A cache hit arrives as a
+    single chunk holding the whole answer. If an agent fails after some of
+    its text was streamed, its result keeps that text alongside the error;
+    with ``resilience`` it is only retried if nothing was streamed yet. A
+    call that follows an identical one in flight (see ``flights``) streams
+    that call's text, from the start. Once ``cancel`` is set, calls stop
+    between chunks with ``CallCancelled``, unless another caller follows them.
+    """
+    messages = _messages(message, len(agents))
+    events = queue.Queue()
+    started_at = {}
+    submitted_at = time.perf_counter()
+
+    def worker(index, agent):
+        started_at[index] = time.perf_counter()
+        message = messages[index]
+        parts = []
+        progress = threading.Event()
+        attempts, abandoned = 1, False
+        deadline = _deadline(started_at[index], timeout)
+        quota = _Quota(limiter, message, priority, deadline)
+        flight, leads = None, True
+
+        def check_cancelled():
+            # A call others are following keeps going; abandon() stops new ones joining it
+            if cancel is not None and cancel.is_set() and (flight is None or flights.abandon(flight)):
+                raise CallCancelled(f"{agent.name} was cancelled")
+
+        def attempt(cancelled):
+            permit = quota.permit
+            stream = ContentStream(agent, message)
+            try:
+                check_cancelled()
+                for text in stream:
+                    # An abandoned attempt must not add to the retry's text
+                    if cancelled is not None and cancelled.is_set():
+                        break
+                    check_cancelled()
+                    parts.append(text)
+                    progress.set()
+                    events.put(StreamChunk(index, text))
+                    if flight is not None:
+                        flight.publish(text)
+            except Exception as e:
+                quota.settle(permit, error=e)
+                raise
+            quota.settle(permit, stream.usage)
+            return stream
+
+        try:
+            hit = cache.lookup(agent, message) if cache else None
+            if hit is None and flights is not None:
+                flight, leads = flights.join(agent, message)
+            if hit is not None:
+                events.put(StreamChunk(index, hit.content))
+                result = FanOutResult(index=index, agent_name=agent.name, content=hit.content, cache_hit=hit)
+            elif not leads:
+                for text in flight.follow(deadline):
+                    if not parts:
+                        first_token_at = time.perf_counter()
+                    parts.append(text)
+                    events.put(StreamChunk(index, text))
+                result = FanOutResult(index=index, agent_name=agent.name, content="".join(parts), coalesced=True)
+                if parts:
+                    result.ttft = first_token_at - started_at[index]
+            else:
+                if resilience is None:
+                    quota.wait()
+                    try:
+                        # On its own thread, so a hung call gives up this worker at the deadline
+                        stream = run_attempt(attempt, _remaining(deadline), progress, deadline)
+                    except AttemptTimeoutError:
+                        abandoned = True
+                        raise
+                else:
+                    outcome = resilience.call(agent.model.id, attempt, deadline, retry_if=lambda error: not parts,
+                                              progress=progress, before_attempt=quota.wait)
+                    attempts, abandoned = outcome.attempts, outcome.abandoned
+                    if outcome.error is not None:
+                        raise outcome.error
+                    stream = outcome.value
+                result = FanOutResult(index=index, agent_name=agent.name, content="".join(parts))
+                result.usage = _usage(message, result.content, stream.usage)
+                if stream.first_token_at is not None:
+                    result.ttft = stream.first_token_at - started_at[index]
+                if cache:
+                    cache.store(agent, message, result.content)
+        except Exception as e:
+            # Whatever was streamed before the failure is kept
+            result = FanOutResult(index=index, agent_name=agent.name, content="".join(parts) or None, error=e,
+                                  coalesced=not leads)
+        if flight is not None and leads:
+            flights.land(flight, result.content, result.usage, result.error)
+        result.attempts, result.abandoned = attempts, abandoned
+        result.rate_wait = quota.waited
+        result.elapsed = time.perf_counter() - started_at[index]
+        result.queue_wait = started_at[index] - submitted_at
+        events.put(result)
+
+    executor = ThreadPoolExecutor(
+        max_workers=max(1, min(max_concurrency, len(agents))),
+        thread_name_prefix="fanout",
+    )
+    futures = [executor.submit(worker, index, agent) for index, agent in enumerate(agents)]
+    pending = set(range(len(agents)))
+    try:
+        while pending:
+            try:
+                event = events.get(timeout=poll_interval)
+            except queue.Empty:
+                event = None
+            # Late events from agents that already timed out are dropped
+            if event is not None and event.index in pending:
+                if isinstance(event, FanOutResult):
+                    pending.discard(event.index)
+                yield event
+
+            if timeout is not None:
+                now = time.perf_counter()
+                for index in sorted(pending):
+                    start = started_at.get(index)
+                    if start is not None and now - start > timeout:
+                        pending.discard(index)
+                        yield FanOutResult(
+                            index=index,
+                            agent_name=agents[index].name,
+                            error=TimeoutError(f"{agents[index].name} did not answer within {timeout:g}s"),
+                            elapsed=now - start,
+                            queue_wait=start - submitted_at,
+                            # Still running on the agent
+                            abandoned=True,
+                        )
+    finally:
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=False)
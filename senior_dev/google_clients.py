@@ -0,0 +1,101 @@
+"""Google Docs and Drive API clients, built once and reused.
+
+``googleapiclient.discovery.build()`` reads and parses a discovery
+document on every call. Here the bundled documents are parsed once per
+process, each session keeps the clients built on its credentials, and the
+access token is only refreshed when it is close to expiring.
+"""
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+import functools
+import json
+
+from .startup import module_available
+
+# Optional Google API stack, imported on first use: it costs a cold start
+# about 0.2s, and most sessions never connect Google
+GOOGLE_CLIENTS_AVAILABLE = module_available("google.auth", "google.oauth2", "googleapiclient")
+
+# Refresh access tokens this long before they expire
+REFRESH_MARGIN = timedelta(minutes=5)
+
+
+@functools.lru_cache(maxsize=None)
+def discovery_document(service_name: str, version: str) -> Optional[dict]:
+    """The discovery document bundled with googleapiclient, parsed once"""
+    from googleapiclient.discovery_cache import get_static_doc
+    content = get_static_doc(service_name, version)
+    return json.loads(content) if content else None
+
+
+def build_service(service_name: str, version: str, credentials):
+    """Build an API client from the cached discovery document"""
+    from googleapiclient.discovery import build, build_from_document
+    document = discovery_document(service_name, version)
+    if document is None:
+        return build(service_name, version, credentials=credentials)
+    return build_from_document(document, credentials=credentials)
+
+
+def credentials_to_dict(credentials) -> dict:
+    """What the app keeps in session state to rebuild the credentials"""
+    return {
+        'token': credentials.token,
+        'refresh_token': credentials.refresh_token,
+        'token_uri': credentials.token_uri,
+        'client_id': credentials.client_id,
+        'client_secret': credentials.client_secret,
+        'scopes': credentials.scopes,
+        'expiry': credentials.expiry.isoformat() if credentials.expiry else None,
+    }
+
+
+def credentials_from_dict(data: dict):
+    from google.oauth2.credentials import Credentials
+    # google-auth compares expiry against naive UTC datetimes
+    expiry = data.get('expiry')
+    return Credentials(
+        token=data['token'],
+        refresh_token=data['refresh_token'],
+        token_uri=data['token_uri'],
+        client_id=data['client_id'],
+        client_secret=data['client_secret'],
+        scopes=data['scopes'],
+        expiry=datetime.fromisoformat(expiry) if expiry else None,
+    )
+
+
+def needs_refresh(credentials, margin: timedelta = REFRESH_MARGIN) -> bool:
+    """True if the token is missing or expires within ``margin``"""
+    if not credentials.refresh_token:
+        return False
+    if not credentials.token:
+        return True
+    if credentials.expiry is None:
+        return False  # unknown; the HTTP client still refreshes on a 401
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    return credentials.expiry - margin <= now
+
+
+class GoogleClients:
+    """One session's credentials and the Docs and Drive clients built on them"""
+
+    def __init__(self, credentials):
+        self.credentials = credentials
+        self.docs = build_service('docs', 'v1', credentials)
+        self.drive = build_service('drive', 'v3', credentials)
+        self.refreshes = 0
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "GoogleClients":
+        return cls(credentials_from_dict(data))
+
+    def ensure_fresh(self) -> bool:
+        """Refresh the token if it is close to expiry; True if it was"""
+        if not needs_refresh(self.credentials):
+            return False
+        from google.auth.transport.requests import Request
+        # The clients hold this same credentials object, so they pick it up
+        self.credentials.refresh(Request())
+        self.refreshes += 1
+        return True
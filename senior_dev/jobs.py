@@ -0,0 +1,448 @@
+"""Durable analysis jobs: queued in a SQLite file, run in the background.
+
+Run inline, an analysis lives and dies with the Streamlit script run that
+started it: a page refresh or a dropped websocket mid-run throws the work
+away, and asking again pays for it again. In job mode the analyze button
+only submits a job and gets its id. ``JobRunner`` threads claim queued jobs
+and run them, saving each expert's section to the ``JobStore`` as soon as
+it finishes, and a streaming section's text so far every
+``flush_interval``. The page just reads the store, so it can reattach to a
+job by its id (kept in the URL) after a reload and show what is done so
+far, or all of it.
+
+Every process with a runner on the same file heartbeats the jobs it is
+running. A job whose heartbeat goes stale (its process died) is queued
+again, and only the experts without a finished section run again. The
+first page to see a job finished ``deliver()``s it, so its follow-up work
+(remembering the turn, exporting it) happens once. Jobs expire after
+``ttl``.
+"""
+from dataclasses import asdict, dataclass, field, replace
+from typing import Callable, Dict, Iterator, List, Optional
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from .budget import Compaction
+from .core import AnalysisRequest, EngineConfig, SectionResult, iter_analysis, resolve_route
+from .fanout import CallCancelled, StreamChunk
+from .metrics import error_kind
+from .resilience import CircuitOpenError
+from .response_cache import CacheHit
+from .streaming import Usage
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_JOBS_PATH = os.path.join(".cache", "jobs.sqlite3")
+DEFAULT_RUNNER_THREADS = 2
+DEFAULT_JOB_TTL = 24 * 3600.0
+# How often streamed text is saved while a section is still running
+DEFAULT_FLUSH_INTERVAL = 0.5
+HEARTBEAT_SECONDS = 5.0
+# A running job not heartbeated for this long lost its process
+STALE_AFTER_SECONDS = 30.0
+# How often idle runners look for jobs queued by other processes
+POLL_SECONDS = 1.0
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+_ERROR_TYPES = {"timeout": TimeoutError, "circuit_open": CircuitOpenError, "cancelled": CallCancelled}
+
+
+def section_record(result: SectionResult) -> dict:
+    """What the store keeps of a finished section"""
+    record = result.to_dict()
+    record.update({
+        "error_kind": error_kind(result.error) if result.error else None,
+        "matched_question": result.cache_hit.matched_question if result.cache_hit else None,
+        "tokens_estimated": bool(result.usage and result.usage.estimated),
+        "prefix_cached": result.prefix_cached,
+    })
+    return record
+
+
+def section_from_record(index: int, record: dict) -> SectionResult:
+    """A SectionResult again, with an error of the same kind as the original"""
+    error = None
+    if record["error"] is not None:
+        error = _ERROR_TYPES.get(record["error_kind"], RuntimeError)(record["error"])
+    cache_hit = None
+    if record["cached"]:
+        cache_hit = CacheHit(record["content"], record["similarity"] or 1.0, record["matched_question"])
+    usage = None
+    if record["input_tokens"] or record["output_tokens"]:
+        usage = Usage(record["input_tokens"], record["output_tokens"], record["tokens_estimated"],
+                      record["cached_prompt_tokens"])
+    return SectionResult(
+        index=index,
+        agent_name=record["agent"],
+        heading=record["heading"],
+        content=record["content"],
+        error=error,
+        elapsed=record["elapsed"],
+        cache_hit=cache_hit,
+        queue_wait=record["queue_wait"],
+        ttft=record["ttft"],
+        usage=usage,
+        prefix_cached=record["prefix_cached"],
+        attempts=record["attempts"],
+        rate_wait=record["rate_wait"],
+        coalesced=record.get("coalesced", False),
+    )
+
+
+@dataclass
+class Job:
+    """A job as the store has it: finished sections, and text so far for running ones"""
+    id: str
+    request: AnalysisRequest
+    stream: bool
+    status: str
+    error: Optional[str] = None
+    error_type: Optional[str] = None
+    # By section index, in the request's section order
+    sections: Dict[int, SectionResult] = field(default_factory=dict)
+    partial: Dict[int, str] = field(default_factory=dict)
+    compactions: List[Compaction] = field(default_factory=list)
+    created_at: float = 0.0
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (DONE, FAILED)
+
+    @property
+    def results(self) -> List[SectionResult]:
+        return [self.sections[index] for index in sorted(self.sections)]
+
+    @property
+    def timings(self) -> dict:
+        """The parts of iter_analysis() timings the store keeps"""
+        return {"compaction": self.compactions} if self.compactions else {}
+
+
+def _request_to_json(request: AnalysisRequest) -> str:
+    return json.dumps(asdict(request), ensure_ascii=False)
+
+
+class JobStore:
+    """Jobs and their finished sections in a SQLite file, shared by every process using it"""
+
+    def __init__(self, path: str = DEFAULT_JOBS_PATH, ttl: float = DEFAULT_JOB_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                request TEXT NOT NULL,
+                stream INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                error TEXT,
+                error_type TEXT,
+                compactions TEXT,
+                delivered INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                heartbeat REAL NOT NULL
+            )
+            """
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS sections (
+                job_id TEXT NOT NULL,
+                agent_index INTEGER NOT NULL,
+                finished INTEGER NOT NULL,
+                data TEXT NOT NULL,
+                PRIMARY KEY (job_id, agent_index)
+            )
+            """
+        )
+
+    def submit(self, request: AnalysisRequest, stream: bool = False) -> str:
+        """Queue a request; returns the job id"""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO jobs (id, request, stream, status, created_at, heartbeat) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, _request_to_json(request), int(stream), QUEUED, now, now),
+            )
+        return job_id
+
+    def claim(self) -> Optional[Job]:
+        """Take the oldest queued job, marking it running; None if there is none"""
+        with self._lock:
+            # BEGIN IMMEDIATE takes the file's write lock, so two processes never claim the same job
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute(
+                    "SELECT id FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1", (QUEUED,)
+                ).fetchone()
+                if row is not None:
+                    self._db.execute("UPDATE jobs SET status = ?, heartbeat = ? WHERE id = ?",
+                                     (RUNNING, time.time(), row[0]))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return self.get(row[0]) if row is not None else None
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT request, stream, status, error, error_type, compactions, created_at FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+            if row is None:
+                return None
+            section_rows = self._db.execute(
+                "SELECT agent_index, finished, data FROM sections WHERE job_id = ?", (job_id,)
+            ).fetchall()
+        request, stream, status, error, error_type, compactions, created_at = row
+        job = Job(job_id, AnalysisRequest(**json.loads(request)), bool(stream), status, error, error_type,
+                  created_at=created_at)
+        if compactions:
+            job.compactions = [Compaction(**compaction) for compaction in json.loads(compactions)]
+        positions = {section.agent_index: index for index, section in enumerate(job.request.sections)}
+        for agent_index, finished, data in section_rows:
+            index = positions.get(agent_index)
+            if index is None:
+                continue
+            if finished:
+                job.sections[index] = section_from_record(index, json.loads(data))
+            else:
+                job.partial[index] = json.loads(data)["content"]
+        return job
+
+    def save_request(self, job_id: str, request: AnalysisRequest):
+        """Replace the job's request; the routed one, once routing picked its experts"""
+        with self._lock:
+            self._db.execute("UPDATE jobs SET request = ? WHERE id = ?", (_request_to_json(request), job_id))
+
+    def save_section(self, job_id: str, agent_index: int, result: SectionResult):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO sections (job_id, agent_index, finished, data) VALUES (?, ?, 1, ?)",
+                (job_id, agent_index, json.dumps(section_record(result), ensure_ascii=False)),
+            )
+
+    def save_partial(self, job_id: str, texts: Dict[int, str]):
+        """Streamed text so far, by agent index, for sections still running"""
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO sections (job_id, agent_index, finished, data) "
+                "SELECT ?, ?, 0, ? WHERE NOT EXISTS "
+                "(SELECT 1 FROM sections WHERE job_id = ? AND agent_index = ? AND finished = 1)",
+                [(job_id, agent_index, json.dumps({"content": text}, ensure_ascii=False), job_id, agent_index)
+                 for agent_index, text in texts.items()],
+            )
+
+    def finish(self, job_id: str, error: Optional[BaseException] = None,
+               compactions: Optional[List[Compaction]] = None):
+        # The pages only report sizes and steps; the compacted question itself isn't kept
+        saved = json.dumps([{**asdict(compaction), "text": ""} for compaction in compactions]) if compactions else None
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = ?, error = ?, error_type = ?, compactions = COALESCE(?, compactions) "
+                "WHERE id = ?",
+                (FAILED if error else DONE, str(error) if error else None,
+                 type(error).__name__ if error else None, saved, job_id),
+            )
+
+    def deliver(self, job_id: str) -> bool:
+        """True for the first caller once the job has finished, False after that"""
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE jobs SET delivered = 1 WHERE id = ? AND delivered = 0 AND status IN (?, ?)",
+                (job_id, DONE, FAILED),
+            )
+        return cursor.rowcount == 1
+
+    def heartbeat(self, job_ids: List[str]):
+        if not job_ids:
+            return
+        now = time.time()
+        with self._lock:
+            self._db.executemany("UPDATE jobs SET heartbeat = ? WHERE id = ? AND status = ?",
+                                 [(now, job_id, RUNNING) for job_id in job_ids])
+
+    def requeue_stale(self, stale_after: float = STALE_AFTER_SECONDS) -> int:
+        """Queue again the running jobs whose process stopped heartbeating them"""
+        with self._lock:
+            cursor = self._db.execute("UPDATE jobs SET status = ? WHERE status = ? AND heartbeat < ?",
+                                      (QUEUED, RUNNING, time.time() - stale_after))
+        if cursor.rowcount:
+            logger.warning(f"Requeued {cursor.rowcount} job(s) whose runner stopped")
+        return cursor.rowcount
+
+    def evict(self):
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            self._db.execute("DELETE FROM sections WHERE job_id IN (SELECT id FROM jobs WHERE created_at < ?)", (cutoff,))
+            self._db.execute("DELETE FROM jobs WHERE created_at < ?", (cutoff,))
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = dict(self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        return {status: counts.get(status, 0) for status in (QUEUED, RUNNING, DONE, FAILED)}
+
+
+class JobRunner:
+    """Background threads that run queued jobs from a store.
+
+    ``config`` (and ``pool``, a workers.WorkerPool, to run the experts in
+    worker processes instead) may be swapped at any time; each job uses
+    what is set when it starts.
+    """
+
+    def __init__(
+        self,
+        store: JobStore,
+        config: EngineConfig,
+        pool=None,
+        threads: int = DEFAULT_RUNNER_THREADS,
+        flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+    ):
+        self.store = store
+        self.config = config
+        self.pool = pool
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._running = set()
+        self._closed = False
+        self.completed = 0
+        self.resumed = 0
+        self._threads = [
+            threading.Thread(target=self._work, name=f"job-runner-{i}", daemon=True) for i in range(max(threads, 1))
+        ]
+        self._threads.append(threading.Thread(target=self._monitor, name="job-monitor", daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, request: AnalysisRequest, stream: bool = False) -> str:
+        job_id = self.store.submit(request, stream)
+        self._wake.set()
+        return job_id
+
+    def _events(self, request: AnalysisRequest, stream: bool, timings: dict) -> Iterator:
+        pool = self.pool
+        if pool is not None:
+            return pool.iter_analysis(request, stream=stream, timings=timings)
+        return iter_analysis(request, self.config, stream=stream, timings=timings)
+
+    def _work(self):
+        while not self._closed:
+            try:
+                job = self.store.claim()
+            except sqlite3.Error as e:
+                logger.error(f"Could not claim a job: {str(e)}")
+                job = None
+            if job is None:
+                self._wake.wait(POLL_SECONDS)
+                self._wake.clear()
+                continue
+            with self._lock:
+                self._running.add(job.id)
+            try:
+                self._run(job)
+            finally:
+                with self._lock:
+                    self._running.discard(job.id)
+                    self.completed += 1
+
+    def _run(self, job: Job):
+        try:
+            request = resolve_route(job.request)
+            if request is not job.request:
+                self.store.save_request(job.id, request)
+            sections = request.sections
+            # A resumed job only asks the experts that haven't answered yet
+            remaining = [section.agent_index for index, section in enumerate(sections) if index not in job.sections]
+            if job.sections:
+                with self._lock:
+                    self.resumed += 1
+                logger.info(f"Resuming job {job.id}: {len(remaining)} of {len(sections)} experts left")
+            timings = {}
+            if remaining:
+                todo = replace(request, experts=remaining) if len(remaining) < len(sections) else request
+                # Events are numbered within ``todo``; the store and the page go by the full request
+                positions = {section.agent_index: index for index, section in enumerate(sections)}
+                agent_indexes = [section.agent_index for section in todo.sections]
+                partial: Dict[int, str] = {}
+                flushed = time.monotonic()
+                for event in self._events(todo, job.stream, timings):
+                    agent_index = agent_indexes[event.index]
+                    if isinstance(event, StreamChunk):
+                        partial[agent_index] = partial.get(agent_index, "") + event.text
+                        if time.monotonic() - flushed >= self.flush_interval:
+                            self.store.save_partial(job.id, partial)
+                            flushed = time.monotonic()
+                        continue
+                    partial.pop(agent_index, None)
+                    position = positions[agent_index]
+                    self.store.save_section(job.id, agent_index,
+                                            replace(event, index=position, heading=sections[position].heading))
+            self.store.finish(job.id, compactions=timings.get("compaction"))
+        except Exception as e:
+            logger.error(f"Job {job.id} failed: {str(e)}")
+            self.store.finish(job.id, error=e)
+
+    def _monitor(self):
+        # Heartbeat this process's jobs; pick up the ones other processes dropped
+        while not self._closed:
+            time.sleep(HEARTBEAT_SECONDS)
+            try:
+                with self._lock:
+                    running = list(self._running)
+                self.store.heartbeat(running)
+                if self.store.requeue_stale():
+                    self._wake.set()
+                self.store.evict()
+            except sqlite3.Error as e:
+                logger.error(f"Job heartbeat failed: {str(e)}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"running": len(self._running), "completed": self.completed, "resumed": self.resumed}
+
+    def close(self):
+        self._closed = True
+        self._wake.set()
+
+
+_stores = {}
+_runners = {}
+_shared_lock = threading.Lock()
+
+
+def shared_job_store(path: str = DEFAULT_JOBS_PATH, **options) -> JobStore:
+    """Process-wide store per file"""
+    path = os.path.abspath(path)
+    with _shared_lock:
+        store = _stores.get(path)
+        if store is None:
+            store = _stores[path] = JobStore(path, **options)
+        return store
+
+
+def shared_job_runner(store: JobStore, config: EngineConfig, pool=None,
+                      threads: int = DEFAULT_RUNNER_THREADS) -> JobRunner:
+    """Process-wide runner per store; later calls update its engine config"""
+    with _shared_lock:
+        runner = _runners.get(store.path)
+        if runner is None:
+            runner = _runners[store.path] = JobRunner(store, config, pool, threads)
+        else:
+            runner.config, runner.pool = config, pool
+        return runner
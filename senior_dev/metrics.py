@@ -0,0 +1,385 @@
+"""Per-request latency and token instrumentation.
+
+``metrics`` is process-wide and fed by ``iter_analysis`` for every run,
+whichever front end started it. It keeps Prometheus counters and
+histograms (queue wait, agent construction, time to first token, model
+time, prompt and completion tokens, cache hits and misses, Docs export
+time), serves them in the Prometheus text format, and can append one JSON
+line per request to a trace file.
+
+Usage::
+
+    metrics.set_trace_path(".cache/trace.jsonl")
+    serve_metrics(9464)   # http://127.0.0.1:9464/metrics
+"""
+from bisect import bisect_left
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, Optional, Tuple
+import json
+import logging
+import os
+import threading
+import uuid
+
+from .fanout import CallCancelled
+from .resilience import CircuitOpenError
+
+logger = logging.getLogger(__name__)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+# name: (type, help, label names)
+_DEFINITIONS = {
+    "senior_dev_requests_total": ("counter", "Analyses run, by outcome", ("question_type", "outcome")),
+    "senior_dev_request_seconds": ("histogram", "Wall time of a whole analysis", ("question_type",)),
+    "senior_dev_agent_setup_seconds": ("histogram", "Time to lease or build the expert agents", ()),
+    "senior_dev_failures_total": ("counter", "Analyses that failed before any expert ran", ("question_type", "stage")),
+    "senior_dev_queue_wait_seconds": ("histogram", "Time spent waiting for a worker", ("stage",)),
+    "senior_dev_time_to_first_token_seconds": ("histogram", "Time from an expert starting to its first streamed text", ("agent", "prefix")),
+    "senior_dev_model_seconds": ("histogram", "Time an expert spent answering (cache misses only)", ("agent", "prefix")),
+    "senior_dev_tokens_total": ("counter", "Tokens used, reported by the model or estimated", ("agent", "kind")),
+    "senior_dev_compacted_tokens_total": ("counter", "Question tokens removed to fit the prompt budget", ("agent",)),
+    "senior_dev_cache_lookups_total": ("counter", "Answer cache lookups", ("agent", "result")),
+    "senior_dev_agent_errors_total": ("counter", "Expert calls that failed, timed out or were cut off by the circuit breaker", ("agent", "kind")),
+    "senior_dev_retries_total": ("counter", "Model calls retried after a transient failure", ("agent",)),
+    "senior_dev_coalesced_calls_total": ("counter", "Expert calls answered by an identical call already in flight", ("agent",)),
+    "senior_dev_prefetch_total": ("counter", "Analyze presses, by how much speculative preparation had done (none, stale, partial, done)", ("outcome",)),
+    "senior_dev_prefetch_calls_total": ("counter", "Speculative expert calls, by outcome (answered, failed, cancelled)", ("outcome",)),
+    "senior_dev_prefetch_head_start_seconds": ("histogram", "Time from the form settling, when speculative preparation starts, to the analyze press", ()),
+    "senior_dev_route_decisions_total": ("counter", "Auto-routing decisions; fallback asks every expert", ("outcome",)),
+    "senior_dev_route_expert_calls_total": ("counter", "Expert calls auto-routing made, and saved against asking all", ("kind",)),
+    "senior_dev_route_selected_total": ("counter", "Times auto-routing picked each expert", ("agent",)),
+    "senior_dev_docs_export_seconds": ("histogram", "Time to export an analysis to Google Docs", ()),
+    "senior_dev_docs_exports_total": ("counter", "Google Docs exports, by status", ("status",)),
+    "senior_dev_startup_seconds": ("histogram", "Time from the top of the app script to each phase of its first run in the process", ("phase",)),
+    "senior_dev_rerun_seconds": ("histogram", "Time of each later app script run, or of a fragment rerunning on its own", ("scope",)),
+}
+
+
+def error_kind(error: BaseException) -> str:
+    """How an expert call failed: timeout, circuit_open, cancelled or error"""
+    if isinstance(error, TimeoutError):
+        return "timeout"
+    if isinstance(error, CallCancelled):
+        return "cancelled"
+    return "circuit_open" if isinstance(error, CircuitOpenError) else "error"
+
+
+class _Histogram:
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: Iterable[str], values: Iterable[str], le: Optional[str] = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if le is not None:
+        pairs.append(f'le="{le}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class TraceWriter:
+    """Appends one JSON object per line to a file"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def write(self, record: dict):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line)
+
+
+class PipelineMetrics:
+    """Counters and histograms for the analysis pipeline, plus an optional trace"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[tuple, float]] = {}
+        self._histograms: Dict[str, Dict[tuple, _Histogram]] = {}
+        self.trace: Optional[TraceWriter] = None
+        # Last snapshot absorbed from each worker process
+        self._absorbed: Dict[str, dict] = {}
+
+    def set_trace_path(self, path: Optional[str]):
+        """Start (or with ``None`` stop) writing the JSONL trace"""
+        if path is None:
+            self.trace = None
+        elif self.trace is None or self.trace.path != path:
+            self.trace = TraceWriter(path)
+
+    def inc(self, name: str, labels: tuple = (), value: float = 1.0):
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[labels] = series.get(labels, 0.0) + value
+
+    def observe(self, name: str, value: float, labels: tuple = ()):
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            if labels not in series:
+                series[labels] = _Histogram()
+            series[labels].observe(value)
+
+    def _write_trace(self, record: dict):
+        if self.trace is None:
+            return
+        try:
+            self.trace.write(record)
+        except OSError as e:
+            logger.error(f"Trace write failed: {str(e)}")
+
+    def observe_section(self, section, cache_enabled: bool = False):
+        """Record one expert's call as it finishes"""
+        agent = section.agent_name
+        self.observe("senior_dev_queue_wait_seconds", section.queue_wait, ("fanout",))
+        if section.rate_wait:
+            self.observe("senior_dev_queue_wait_seconds", section.rate_wait, ("rate_limit",))
+        if cache_enabled:
+            result = "miss" if not section.cached else "semantic_hit" if section.cache_hit.semantic else "hit"
+            self.inc("senior_dev_cache_lookups_total", (agent, result))
+        if section.attempts > 1:
+            self.inc("senior_dev_retries_total", (agent,), section.attempts - 1)
+        if section.coalesced:
+            self.inc("senior_dev_coalesced_calls_total", (agent,))
+        if section.error is not None:
+            self.inc("senior_dev_agent_errors_total", (agent, error_kind(section.error)))
+            return
+        if section.cached or section.coalesced:
+            # A shared call's model time and tokens are counted on the call that made it
+            return
+        # Cached versus inline system prompts, to compare their latency
+        prefix = "cached" if section.prefix_cached else "inline"
+        self.observe("senior_dev_model_seconds", section.elapsed, (agent, prefix))
+        if section.ttft is not None:
+            self.observe("senior_dev_time_to_first_token_seconds", section.ttft, (agent, prefix))
+        if section.usage:
+            self.inc("senior_dev_tokens_total", (agent, "prompt"), section.usage.input_tokens)
+            self.inc("senior_dev_tokens_total", (agent, "completion"), section.usage.output_tokens)
+            if section.usage.cached_tokens:
+                self.inc("senior_dev_tokens_total", (agent, "cached_prompt"), section.usage.cached_tokens)
+
+    def observe_request(self, request, sections, agent_setup: float, elapsed: float,
+                        complete: bool = True, stream: bool = False, compactions=None) -> dict:
+        """Record a finished analysis; returns its trace record"""
+        failed = not complete or any(section.error is not None for section in sections)
+        ok = [section for section in sections if section.error is None]
+        outcome = "ok" if not failed else "partial" if ok else "failed"
+        self.inc("senior_dev_requests_total", (request.question_type, outcome))
+        self.observe("senior_dev_request_seconds", elapsed, (request.question_type,))
+        self.observe("senior_dev_agent_setup_seconds", agent_setup)
+
+        record = {
+            "type": "request",
+            "id": uuid.uuid4().hex[:12],
+            "ts": datetime.now().isoformat(timespec="milliseconds"),
+            "question_type": request.question_type,
+            "question_chars": len(request.question),
+            "question_tokens": compactions[0].original_tokens if compactions else None,
+            "stream": stream,
+            "outcome": outcome,
+            "agent_setup": round(agent_setup, 4),
+            "elapsed": round(elapsed, 4),
+            "sections": [
+                {
+                    "agent": section.agent_name,
+                    "queue_wait": round(section.queue_wait, 4),
+                    "ttft": round(section.ttft, 4) if section.ttft is not None else None,
+                    "elapsed": round(section.elapsed, 4),
+                    "input_tokens": section.usage.input_tokens if section.usage else 0,
+                    "output_tokens": section.usage.output_tokens if section.usage else 0,
+                    "tokens_estimated": bool(section.usage and section.usage.estimated),
+                    "cached_prompt_tokens": section.usage.cached_tokens if section.usage else 0,
+                    "prefix_cached": section.prefix_cached,
+                    "question_tokens": compactions[section.index].compacted_tokens if compactions else None,
+                    "cached": section.cached,
+                    "coalesced": section.coalesced,
+                    "attempts": section.attempts,
+                    "rate_wait": round(section.rate_wait, 4),
+                    "similarity": round(section.cache_hit.similarity, 4) if section.cached else None,
+                    "error": str(section.error) if section.error else None,
+                }
+                for section in sorted(sections, key=lambda section: section.index)
+            ],
+        }
+        for section in sections:
+            compaction = compactions[section.index] if compactions else None
+            if compaction is not None and compaction.compacted:
+                self.inc("senior_dev_compacted_tokens_total", (section.agent_name,),
+                         compaction.original_tokens - compaction.compacted_tokens)
+        self._write_trace(record)
+        return record
+
+    def observe_failure(self, question_type: str, stage: str):
+        self.inc("senior_dev_failures_total", (question_type, stage))
+
+    def observe_queue_wait(self, seconds: float, stage: str):
+        self.observe("senior_dev_queue_wait_seconds", seconds, (stage,))
+
+    def observe_route(self, decision) -> dict:
+        """Record an auto-routing decision; returns its trace record"""
+        self.inc("senior_dev_route_decisions_total", ("fallback" if decision.fallback else "routed",))
+        self.inc("senior_dev_route_expert_calls_total", ("made",), len(decision.experts))
+        self.inc("senior_dev_route_expert_calls_total", ("saved",), decision.saved)
+        for name in decision.names:
+            self.inc("senior_dev_route_selected_total", (name,))
+        record = {"type": "route", "ts": datetime.now().isoformat(timespec="milliseconds"), **decision.to_dict()}
+        self._write_trace(record)
+        return record
+
+    def observe_docs_export(self, seconds: float, status: str, batches: int = 0, document_id: Optional[str] = None):
+        self.inc("senior_dev_docs_exports_total", (status,))
+        self.observe("senior_dev_docs_export_seconds", seconds)
+        self._write_trace({
+            "type": "docs_export",
+            "ts": datetime.now().isoformat(timespec="milliseconds"),
+            "status": status,
+            "seconds": round(seconds, 4),
+            "batches": batches,
+            "document_id": document_id,
+        })
+
+    def snapshot(self) -> dict:
+        """Everything recorded so far, as plain data another process can absorb"""
+        with self._lock:
+            return {
+                "counters": {name: dict(series) for name, series in self._counters.items()},
+                "histograms": {
+                    name: {labels: (list(h.counts), h.sum, h.count) for labels, h in series.items()}
+                    for name, series in self._histograms.items()
+                },
+            }
+
+    def absorb(self, source: str, snapshot: dict):
+        """Add what process ``source`` recorded since its previous snapshot"""
+        with self._lock:
+            previous = self._absorbed.get(source, {"counters": {}, "histograms": {}})
+            for name, series in snapshot["counters"].items():
+                totals = self._counters.setdefault(name, {})
+                seen = previous["counters"].get(name, {})
+                for labels, value in series.items():
+                    totals[labels] = totals.get(labels, 0.0) + value - seen.get(labels, 0.0)
+            for name, series in snapshot["histograms"].items():
+                histograms = self._histograms.setdefault(name, {})
+                seen = previous["histograms"].get(name, {})
+                for labels, (counts, total, count) in series.items():
+                    seen_counts, seen_total, seen_count = seen.get(labels, ([0] * len(counts), 0.0, 0))
+                    histogram = histograms.setdefault(labels, _Histogram())
+                    histogram.counts = [a + b - c for a, b, c in zip(histogram.counts, counts, seen_counts)]
+                    histogram.sum += total - seen_total
+                    histogram.count += count - seen_count
+            self._absorbed[source] = snapshot
+
+    def totals(self) -> dict:
+        """Process-wide sums for a dashboard"""
+        with self._lock:
+            requests = self._counters.get("senior_dev_requests_total", {})
+            tokens = self._counters.get("senior_dev_tokens_total", {})
+            lookups = self._counters.get("senior_dev_cache_lookups_total", {})
+            routed = self._counters.get("senior_dev_route_expert_calls_total", {})
+            retries = self._counters.get("senior_dev_retries_total", {})
+            coalesced = self._counters.get("senior_dev_coalesced_calls_total", {})
+            return {
+                "requests": int(sum(requests.values())),
+                "prompt_tokens": int(sum(v for (_, kind), v in tokens.items() if kind == "prompt")),
+                "completion_tokens": int(sum(v for (_, kind), v in tokens.items() if kind == "completion")),
+                "cached_prompt_tokens": int(sum(v for (_, kind), v in tokens.items() if kind == "cached_prompt")),
+                "cache_hits": int(sum(v for (_, result), v in lookups.items() if result != "miss")),
+                "cache_lookups": int(sum(lookups.values())),
+                "routed_calls": int(routed.get(("made",), 0)),
+                "routed_calls_saved": int(routed.get(("saved",), 0)),
+                "retries": int(sum(retries.values())),
+                "coalesced_calls": int(sum(coalesced.values())),
+            }
+
+    def prefix_savings(self) -> Dict[str, dict]:
+        """Per expert: prompt tokens served from cache, and mean latency cached versus inline"""
+        with self._lock:
+            tokens = self._counters.get("senior_dev_tokens_total", {})
+            model = self._histograms.get("senior_dev_model_seconds", {})
+            ttft = self._histograms.get("senior_dev_time_to_first_token_seconds", {})
+            savings = {}
+            for agent, prefix in sorted(set(model) | set(ttft)):
+                entry = savings.setdefault(agent, {"cached_prompt_tokens": int(tokens.get((agent, "cached_prompt"), 0))})
+                for name, series in (("model", model), ("ttft", ttft)):
+                    histogram = series.get((agent, prefix))
+                    if histogram is not None and histogram.count:
+                        entry[f"{name}_{prefix}"] = histogram.sum / histogram.count
+            return savings
+
+    def render(self) -> str:
+        """Everything recorded so far, in the Prometheus text format"""
+        lines = []
+        with self._lock:
+            for name, (kind, help_text, label_names) in _DEFINITIONS.items():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                if kind == "counter":
+                    for labels, value in sorted(self._counters.get(name, {}).items()):
+                        lines.append(f"{name}{_labels(label_names, labels)} {value:g}")
+                    continue
+                for labels, histogram in sorted(self._histograms.get(name, {}).items()):
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                        lines.append(f"{name}_bucket{_labels(label_names, labels, le)} {cumulative}")
+                    lines.append(f"{name}_sum{_labels(label_names, labels)} {histogram.sum:.6f}")
+                    lines.append(f"{name}_count{_labels(label_names, labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+# Shared by everything in this process
+metrics = PipelineMetrics()
+
+_servers: Dict[Tuple[str, int], ThreadingHTTPServer] = {}
+_servers_lock = threading.Lock()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", PROMETHEUS_CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # scrapes every few seconds would flood the log
+
+
+def serve_metrics(port: int, host: str = "127.0.0.1") -> Optional[ThreadingHTTPServer]:
+    """Serve /metrics on a background thread, once per process and port"""
+    with _servers_lock:
+        if (host, port) in _servers:
+            return _servers[(host, port)]
+        try:
+            server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        except OSError as e:
+            # Usually another process (or app) already serves this port
+            logger.error(f"Metrics endpoint not started on {host}:{port}: {str(e)}")
+            return None
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+        _servers[(host, port)] = server
+        return server
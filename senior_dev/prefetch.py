@@ -0,0 +1,208 @@
+"""Speculative work on a question while the user is still filling in the form.
+
+The question type, context options and question are all known before the
+analyze button is pressed, but nothing happens until then. A ``Prefetcher``
+(one per session) is handed the request the form would submit every time
+the form reruns. Once it has stayed the same for ``settle`` seconds, a
+background thread prepares for it:
+
+- routing: the router is trained on first use, and the question classified;
+- compaction: the question is fitted to each routed expert's prompt budget
+  (remembered by budget.TokenBudget, so the real run reuses it);
+- agents: a set of agents is built or leased, and each expert's system
+  prompt registered with the prompt cache;
+- cache lookups: cached answers move into the response cache's memory tier
+  (and a local semantic cache embedder loads).
+
+With ``call_expert``, the most likely expert's call starts too, at the
+rate limiter's lowest priority. It needs single flight and the response
+cache (see EngineConfig). If the button is pressed while the call runs,
+the real run follows it; if it has finished, the real run finds its answer
+in the cache. If the inputs change first, the call is cancelled, unless
+someone else follows it already.
+
+``claim()`` at the button press says how much of the work was done, and
+records it as ``senior_dev_prefetch_total{outcome}`` and
+``senior_dev_prefetch_head_start_seconds``. Speculative calls are counted
+in ``senior_dev_prefetch_calls_total{outcome}`` only: the cache stats,
+request metrics and trace show what users asked.
+"""
+from dataclasses import asdict, dataclass, field, replace
+from typing import Callable, Dict, Optional
+import json
+import logging
+import threading
+import time
+
+from .agents import AGENT_SPECS, registry
+from .core import AUTO_ROUTE, AnalysisRequest, EngineConfig, SectionResult, iter_analysis
+from .fanout import CallCancelled
+from .metrics import metrics
+from .rate_limit import PRIORITY_SPECULATIVE
+from .response_cache import AnswerCache
+
+logger = logging.getLogger(__name__)
+
+# How long the form must stay unchanged before speculating on it
+DEFAULT_SETTLE_SECONDS = 1.0
+
+
+def _key(request: AnalysisRequest) -> str:
+    return json.dumps(asdict(request), sort_keys=True, ensure_ascii=False)
+
+
+@dataclass
+class Speculation:
+    """Work started for one version of the form"""
+    request: AnalysisRequest
+    key: str
+    created_at: float = field(default_factory=time.perf_counter)
+    # The request with its experts picked, once routing ran
+    routed: Optional[AnalysisRequest] = None
+    # Seconds each finished step took, in order
+    steps: Dict[str, float] = field(default_factory=dict)
+    # Routed experts whose answers are already cached
+    cached: int = 0
+    # The expert the speculative call went to, if one was made
+    expert: Optional[str] = None
+    claimed: bool = False
+    # Seconds from the form settling to the button press
+    head_start: float = 0.0
+    cancel: threading.Event = field(default_factory=threading.Event)
+    done: threading.Event = field(default_factory=threading.Event)
+
+
+class Prefetcher:
+    """Speculates on one session's form; see the module docstring"""
+
+    def __init__(
+        self,
+        config: EngineConfig,
+        router: Optional[Callable] = None,
+        settle: float = DEFAULT_SETTLE_SECONDS,
+        call_expert: bool = False,
+    ):
+        self.config = config
+        # Called on the background thread: building the router trains it
+        self.router = router
+        self.settle = settle
+        self.call_expert = call_expert
+        self.current: Optional[Speculation] = None
+        self._lock = threading.Lock()
+
+    def update(self, request: AnalysisRequest):
+        """The form as it stands; a change cancels the last speculation and starts over"""
+        key = _key(request)
+        with self._lock:
+            if self.current is not None and self.current.key == key:
+                return
+            if self.current is not None:
+                self.current.cancel.set()
+            speculation = self.current = Speculation(request, key)
+        threading.Thread(target=self._run, args=(speculation,), name="prefetch", daemon=True).start()
+
+    def cancel(self):
+        with self._lock:
+            if self.current is not None:
+                self.current.cancel.set()
+            self.current = None
+
+    def claim(self, request: AnalysisRequest) -> Optional[Speculation]:
+        """At the button press: the speculation on this request, if any. A speculative call
+        still running is left to run, since the real one follows it."""
+        key = _key(request)
+        with self._lock:
+            speculation, self.current = self.current, None
+        if speculation is None or speculation.key != key:
+            if speculation is not None:
+                speculation.cancel.set()
+            metrics.inc("senior_dev_prefetch_total", ("stale" if speculation is not None else "none",))
+            return None
+        speculation.claimed = True
+        speculation.head_start = max(time.perf_counter() - speculation.created_at - self.settle, 0.0)
+        metrics.inc("senior_dev_prefetch_total", ("done" if speculation.done.is_set() else "partial",))
+        metrics.observe("senior_dev_prefetch_head_start_seconds", speculation.head_start)
+        return speculation
+
+    def _step(self, speculation: Speculation, name: str, started: float) -> bool:
+        speculation.steps[name] = time.perf_counter() - started
+        return not speculation.cancel.is_set()
+
+    def _run(self, speculation: Speculation):
+        # Inputs that change again within ``settle`` were still being typed
+        if speculation.cancel.wait(self.settle):
+            return
+        try:
+            self._prepare(speculation)
+        except Exception as e:
+            logger.warning(f"Prefetch failed: {str(e)}")
+        finally:
+            speculation.done.set()
+
+    def _prepare(self, speculation: Speculation):
+        config = self.config
+        request = speculation.request
+
+        started = time.perf_counter()
+        likely = None
+        if request.question_type == AUTO_ROUTE and not request.experts and self.router is not None:
+            decision = self.router().route(request.question)
+            speculation.routed = replace(request, experts=decision.experts)
+            likely = max(decision.experts, key=lambda index: decision.scores[index])
+        elif request.question_type != AUTO_ROUTE or request.experts:
+            speculation.routed = request
+            likely = request.sections[0].agent_index
+        if speculation.routed is None or not self._step(speculation, "route", started):
+            return
+        routed = speculation.routed
+        names = routed.agent_names
+
+        started = time.perf_counter()
+        messages = [routed.context_for(name) for name in names]
+        # A summarizer would call the model; that is only worth it when speculating on calls too
+        if config.token_budget is not None and (config.token_budget.summarizer is None or self.call_expert):
+            compactions = [config.token_budget.fit(routed, name) for name in names]
+            messages = [replace(routed, question=compaction.text).context_for(name)
+                        for compaction, name in zip(compactions, names)]
+        if not self._step(speculation, "compaction", started):
+            return
+
+        started = time.perf_counter()
+        shared_model = config.prefix_cache is None
+        agents = registry.acquire(config.api_key, config.model_id, shared_model)
+        try:
+            routed_agents = [agents[section.agent_index] for section in routed.sections]
+            if config.prefix_cache is not None:
+                config.prefix_cache.bind(config.api_key, config.model_id, routed_agents)
+            if not self._step(speculation, "agents", started):
+                return
+
+            started = time.perf_counter()
+            # Not a real lookup yet, so the caches' hit/miss stats aren't touched
+            cache = AnswerCache(config.response_cache, config.semantic_cache, routed.question, routed.scope, count=False)
+            cached = set()
+            if cache:
+                cached = {section.agent_index for section, agent, message in zip(routed.sections, routed_agents, messages)
+                          if cache.lookup(agent, message) is not None}
+            speculation.cached = len(cached)
+            if not self._step(speculation, "cache", started):
+                return
+        finally:
+            registry.release(config.api_key, config.model_id, agents, shared_model)
+
+        # Only worth a call if the real run can pick it up, and nobody pressed the button yet
+        if (not self.call_expert or likely in cached or config.single_flight is None
+                or config.response_cache is None or speculation.claimed):
+            return
+        started = time.perf_counter()
+        speculation.expert = AGENT_SPECS[likely][0]
+        # Kept out of the request metrics and the trace; only the prefetch series count it
+        events = iter_analysis(replace(routed, experts=[likely]), config, stream=True,
+                               priority=PRIORITY_SPECULATIVE, cancel=speculation.cancel, speculative=True)
+        outcome = "cancelled"
+        for event in events:
+            if isinstance(event, SectionResult):
+                outcome = ("cancelled" if isinstance(event.error, CallCancelled)
+                           else "failed" if event.error else "answered")
+        metrics.inc("senior_dev_prefetch_calls_total", (outcome,))
+        self._step(speculation, "call", started)
@@ -0,0 +1,214 @@
+"""Expert system prompts registered once as cached contexts.
+
+Each expert's persona and instructions form the same long system prompt on
+every call. In prefix-cache mode that prompt is registered once per
+persona with Gemini's context caching, and each call sends only the
+question: the agent's model points at the cached content and agno builds
+no system message of its own. Caches live for ``ttl`` and are renewed
+when a call finds them within ``renew_margin`` of expiring.
+
+Fake models get a local stand-in that names and times prefixes the same
+way without any API, so the whole path runs offline. If a cache can't be
+created (a model without caching support, or a prompt under the model's
+minimum cacheable size) that expert falls back to sending its prompt
+inline, and creation is retried after ``retry_after``.
+"""
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+import atexit
+import hashlib
+import logging
+import threading
+import time
+
+from .agents import _fingerprint
+from .budget import count_tokens
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PREFIX_TTL = 3600.0
+DEFAULT_RENEW_MARGIN = 300.0
+DEFAULT_RETRY_AFTER = 600.0
+
+
+@dataclass
+class CachedPrefix:
+    """One persona's system prompt as a cached context"""
+    agent_name: str
+    name: str
+    tokens: int
+    expires_at: float
+    renewals: int = 0
+
+
+def system_prompt(agent) -> str:
+    """The system message agno would send for ``agent``"""
+    from agno.session import AgentSession
+
+    build_context = agent.build_context
+    agent.build_context = True
+    try:
+        message = agent.get_system_message(session=AgentSession(session_id="prefix-cache"))
+    finally:
+        agent.build_context = build_context
+    return str(message.content) if message is not None and message.content else ""
+
+
+class LocalPrefixBackend:
+    """Stand-in for models without remote caching: names prefixes, stores nothing"""
+
+    def create(self, model_id: str, agent_name: str, prompt: str, ttl: float) -> str:
+        digest = hashlib.sha256(f"{model_id}\n{prompt}".encode("utf-8")).hexdigest()[:16]
+        return f"cachedContents/local-{digest}"
+
+    def renew(self, name: str, ttl: float):
+        pass
+
+    def delete(self, name: str):
+        pass
+
+
+class GeminiPrefixBackend:
+    """Gemini context caching through the google-genai client"""
+
+    def __init__(self, api_key: str):
+        from google import genai
+        self.client = genai.Client(api_key=api_key)
+
+    def create(self, model_id: str, agent_name: str, prompt: str, ttl: float) -> str:
+        from google.genai import types
+        cache = self.client.caches.create(
+            model=model_id,
+            config=types.CreateCachedContentConfig(
+                display_name=f"senior-dev {agent_name}",
+                system_instruction=prompt,
+                ttl=f"{int(ttl)}s",
+            ),
+        )
+        return cache.name
+
+    def renew(self, name: str, ttl: float):
+        from google.genai import types
+        self.client.caches.update(name=name, config=types.UpdateCachedContentConfig(ttl=f"{int(ttl)}s"))
+
+    def delete(self, name: str):
+        self.client.caches.delete(name=name)
+
+
+class PrefixCache:
+    """Cached persona prompts per API key, model and expert, renewed before expiry"""
+
+    def __init__(
+        self,
+        ttl: float = DEFAULT_PREFIX_TTL,
+        renew_margin: float = DEFAULT_RENEW_MARGIN,
+        retry_after: float = DEFAULT_RETRY_AFTER,
+    ):
+        self.ttl = ttl
+        self.renew_margin = renew_margin
+        self.retry_after = retry_after
+        self._lock = threading.Lock()
+        self._key_locks: Dict[tuple, threading.Lock] = {}
+        self._prefixes: Dict[tuple, CachedPrefix] = {}
+        self._backends: Dict[tuple, object] = {}
+        self._failed_until: Dict[tuple, float] = {}
+        self.created = 0
+        self.renewed = 0
+        self.failures = 0
+
+    def _backend(self, api_key: str, model_id: str):
+        key = (_fingerprint(api_key), model_id)
+        with self._lock:
+            backend = self._backends.get(key)
+            if backend is None:
+                from .fake_model import is_fake_model
+                backend = LocalPrefixBackend() if is_fake_model(model_id) else GeminiPrefixBackend(api_key)
+                self._backends[key] = backend
+            return backend
+
+    def prefix_for(self, api_key: str, model_id: str, agent) -> Optional[CachedPrefix]:
+        """The agent's live cached prefix, created or renewed as needed; None to send it inline"""
+        key = (_fingerprint(api_key), model_id, agent.name)
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        # One creation or renewal per persona at a time; other sessions wait for it
+        with key_lock:
+            now = time.time()
+            prefix = self._prefixes.get(key)
+            if prefix is not None and prefix.expires_at - now > self.renew_margin:
+                return prefix
+            if prefix is None and self._failed_until.get(key, 0.0) > now:
+                return None
+            try:
+                backend = self._backend(api_key, model_id)
+                if prefix is not None and prefix.expires_at > now:
+                    backend.renew(prefix.name, self.ttl)
+                    prefix.expires_at = now + self.ttl
+                    prefix.renewals += 1
+                    self.renewed += 1
+                    return prefix
+                prompt = system_prompt(agent)
+                name = backend.create(model_id, agent.name, prompt, self.ttl)
+            except Exception as e:
+                self.failures += 1
+                logger.error(f"Prompt cache for {agent.name} unavailable, sending it inline: {str(e)}")
+                if prefix is not None and prefix.expires_at > now:
+                    return prefix  # renewal failed, but it is still good for a while
+                self._prefixes.pop(key, None)
+                self._failed_until[key] = now + self.retry_after
+                return None
+            prefix = CachedPrefix(agent.name, name, count_tokens(prompt), now + self.ttl)
+            self._prefixes[key] = prefix
+            self._failed_until.pop(key, None)
+            self.created += 1
+            return prefix
+
+    def bind(self, api_key: str, model_id: str, agents) -> List[Optional[CachedPrefix]]:
+        """Point each agent at its cached prefix, or back at its inline prompt"""
+        prefixes = []
+        for agent in agents:
+            prefix = self.prefix_for(api_key, model_id, agent)
+            agent.model.cached_content = prefix.name if prefix is not None else None
+            agent.build_context = prefix is None
+            prefixes.append(prefix)
+        return prefixes
+
+    def clear(self):
+        """Delete every cached prefix; remote caches are billed while they live"""
+        with self._lock:
+            prefixes = list(self._prefixes.items())
+            self._prefixes.clear()
+        for (fingerprint, model_id, _), prefix in prefixes:
+            backend = self._backends.get((fingerprint, model_id))
+            try:
+                if backend is not None:
+                    backend.delete(prefix.name)
+            except Exception as e:
+                logger.error(f"Could not delete prompt cache {prefix.name}: {str(e)}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "prefixes": len(self._prefixes),
+                "created": self.created,
+                "renewed": self.renewed,
+                "failures": self.failures,
+                "tokens": sum(prefix.tokens for prefix in self._prefixes.values()),
+            }
+
+
+_shared: Optional[PrefixCache] = None
+_shared_lock = threading.Lock()
+
+
+def shared_prefix_cache(**options) -> PrefixCache:
+    """Process-wide prefix cache, so reruns and sessions share the cached prompts"""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = PrefixCache(**options)
+            atexit.register(_shared.clear)
+        else:
+            for name, value in options.items():
+                setattr(_shared, name, value)
+        return _shared
@@ -0,0 +1,305 @@
+"""Client-side rate limiting for model calls that share one API key.
+
+Every session and expert in the process draws from the same two token
+buckets, one for requests per minute and one for tokens per minute, so a
+burst of users queues here instead of turning into a storm of 429s. A
+call reserves its estimated tokens up front and settles the difference
+once the model reports what it actually used; a 429 that gets through
+anyway drains the buckets for a moment.
+
+Waiting calls are served by priority, then in arrival order: a
+single-expert question doesn't wait behind the four calls of an
+all-experts fan-out that arrived just before it. With ``state_path`` the
+buckets live in a SQLite file instead, shared by every process on the
+machine that uses the same file (priorities stay per process).
+"""
+from contextlib import contextmanager
+from typing import Iterator, Optional
+import heapq
+import itertools
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from .streaming import estimate_tokens
+
+# Lower is served first
+PRIORITY_SINGLE = 0
+PRIORITY_FANOUT = 1
+# Calls made before anyone asked for them (see prefetch.py)
+PRIORITY_SPECULATIVE = 2
+
+DEFAULT_BURST_SECONDS = 10.0
+# Reserved per call for the answer, until the model says what it used
+DEFAULT_EXPECTED_OUTPUT_TOKENS = 1000
+# How long calls pause after a 429 slips through
+DEFAULT_COOLDOWN_SECONDS = 5.0
+# Other processes can take from shared buckets; look again at least this often
+SHARED_POLL_SECONDS = 0.25
+
+_RATE_LIMITED = re.compile(r"\b429\b|resource.exhausted|rate.limit|quota", re.IGNORECASE)
+
+
+class RateLimitTimeout(TimeoutError):
+    """The call's deadline passed while it waited for quota"""
+
+
+def is_rate_limited(error: BaseException) -> bool:
+    return getattr(error, "status_code", None) == 429 or bool(_RATE_LIMITED.search(str(error)))
+
+
+class _Bucket:
+    def __init__(self, per_minute: float, burst_seconds: float):
+        self.rate = per_minute / 60.0
+        self.capacity = max(per_minute * burst_seconds / 60.0, 1.0)
+
+
+class LocalBuckets:
+    """Bucket levels in this process"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.levels = {name: bucket.capacity for name, bucket in buckets.items()}
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        for name, bucket in self.buckets.items():
+            self.levels[name] = min(bucket.capacity, self.levels[name] + (now - self.updated) * bucket.rate)
+        self.updated = now
+
+    def try_take(self, costs: dict) -> float:
+        """Take ``costs`` if they are all available; else seconds until they will be"""
+        self._refill()
+        return _take(self.buckets, self.levels, costs)
+
+    def adjust(self, deltas: dict):
+        self._refill()
+        for name, delta in deltas.items():
+            if name in self.levels:
+                self.levels[name] = min(self.buckets[name].capacity, self.levels[name] + delta)
+
+    def drain(self, seconds: float):
+        """Empty every bucket, and owe ``seconds`` of refill on top"""
+        self._refill()
+        for name, bucket in self.buckets.items():
+            self.levels[name] = min(self.levels[name], -bucket.rate * seconds)
+
+    def level(self, name: str) -> float:
+        self._refill()
+        return self.levels[name]
+
+
+class SharedBuckets:
+    """Bucket levels in a SQLite file, shared by every process using it"""
+
+    def __init__(self, buckets, path: str):
+        self.buckets = buckets
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, level REAL NOT NULL, updated REAL NOT NULL)")
+
+    @contextmanager
+    def _levels(self) -> Iterator[dict]:
+        # BEGIN IMMEDIATE takes the file's write lock, so read-refill-write is atomic across processes
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            rows = dict((name, (level, updated)) for name, level, updated in self._db.execute("SELECT * FROM buckets"))
+            levels = {}
+            for name, bucket in self.buckets.items():
+                level, updated = rows.get(name, (bucket.capacity, now))
+                levels[name] = min(bucket.capacity, level + max(now - updated, 0.0) * bucket.rate)
+            yield levels
+            self._db.executemany(
+                "INSERT OR REPLACE INTO buckets (name, level, updated) VALUES (?, ?, ?)",
+                [(name, level, now) for name, level in levels.items()],
+            )
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+
+    def try_take(self, costs: dict) -> float:
+        with self._levels() as levels:
+            return _take(self.buckets, levels, costs)
+
+    def adjust(self, deltas: dict):
+        with self._levels() as levels:
+            for name, delta in deltas.items():
+                if name in levels:
+                    levels[name] = min(self.buckets[name].capacity, levels[name] + delta)
+
+    def drain(self, seconds: float):
+        with self._levels() as levels:
+            for name, bucket in self.buckets.items():
+                levels[name] = min(levels[name], -bucket.rate * seconds)
+
+    def level(self, name: str) -> float:
+        with self._levels() as levels:
+            return levels[name]
+
+
+def _take(buckets, levels: dict, costs: dict) -> float:
+    # A cost over capacity could never be met; it takes a full bucket and goes into debt later
+    costs = {name: min(cost, buckets[name].capacity) for name, cost in costs.items() if name in buckets}
+    wait = max((costs[name] - levels[name]) / buckets[name].rate for name in costs) if costs else 0.0
+    if wait > 0:
+        return wait
+    for name, cost in costs.items():
+        levels[name] -= cost
+    return 0.0
+
+
+class Permit:
+    """One call's claim on the quota; ``used_tokens`` is what the model reported"""
+
+    def __init__(self, reserved_tokens: int, waited: float):
+        self.reserved_tokens = reserved_tokens
+        self.used_tokens: Optional[int] = None
+        self.waited = waited
+
+
+class RateLimiter:
+    """Requests- and tokens-per-minute buckets with a priority queue in front"""
+
+    def __init__(
+        self,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+        state_path: Optional[str] = None,
+        burst_seconds: float = DEFAULT_BURST_SECONDS,
+        expected_output_tokens: int = DEFAULT_EXPECTED_OUTPUT_TOKENS,
+        cooldown: float = DEFAULT_COOLDOWN_SECONDS,
+    ):
+        buckets = {}
+        if requests_per_minute:
+            buckets["requests"] = _Bucket(requests_per_minute, burst_seconds)
+        if tokens_per_minute:
+            buckets["tokens"] = _Bucket(tokens_per_minute, burst_seconds)
+        self.buckets = SharedBuckets(buckets, state_path) if state_path else LocalBuckets(buckets)
+        self.expected_output_tokens = expected_output_tokens
+        self.cooldown = cooldown
+        self._cond = threading.Condition()
+        self._queue = []
+        self._seq = itertools.count()
+        self.granted = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.throttled = 0
+
+    @property
+    def shared(self) -> bool:
+        return isinstance(self.buckets, SharedBuckets)
+
+    def acquire(self, tokens: int, priority: int = PRIORITY_SINGLE, deadline: Optional[float] = None) -> float:
+        """Block until a call costing ``tokens`` may go ahead; returns the seconds waited.
+
+        ``deadline`` is a ``time.perf_counter()`` time; waiting past it
+        raises ``RateLimitTimeout``.
+        """
+        started = time.perf_counter()
+        ticket = (priority, next(self._seq))
+        with self._cond:
+            heapq.heappush(self._queue, ticket)
+            try:
+                while True:
+                    wait = SHARED_POLL_SECONDS
+                    if self._queue[0] == ticket:
+                        wait = self.buckets.try_take({"requests": 1, "tokens": tokens})
+                        if wait <= 0:
+                            break
+                        if self.shared:
+                            wait = min(wait, SHARED_POLL_SECONDS)
+                    if deadline is not None:
+                        remaining = deadline - time.perf_counter()
+                        if remaining <= 0:
+                            raise RateLimitTimeout(f"Deadline passed after {time.perf_counter() - started:.1f}s waiting for the API quota")
+                        wait = min(wait, remaining)
+                    # Woken early when the head of the queue changes
+                    self._cond.wait(wait)
+            finally:
+                self._queue.remove(ticket)
+                heapq.heapify(self._queue)
+                self._cond.notify_all()
+            waited = time.perf_counter() - started
+            self.granted += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+        return waited
+
+    def reserve(self, message: str, priority: int = PRIORITY_SINGLE, deadline: Optional[float] = None) -> Permit:
+        """Wait for quota for one call on ``message``, reserving its estimated tokens"""
+        reserved = estimate_tokens(message) + self.expected_output_tokens
+        return Permit(reserved, self.acquire(reserved, priority, deadline))
+
+    def settle(self, permit: Permit, used_tokens: Optional[int] = None, error: Optional[BaseException] = None):
+        """Return what a call reserved but didn't use, or pause everyone after a 429"""
+        if error is not None and is_rate_limited(error):
+            self.throttle()
+        if used_tokens is None:
+            return
+        with self._cond:
+            self.buckets.adjust({"tokens": permit.reserved_tokens - used_tokens})
+            self._cond.notify_all()
+
+    @contextmanager
+    def permit(self, message: str, priority: int = PRIORITY_SINGLE, deadline: Optional[float] = None) -> Iterator[Permit]:
+        """``reserve()`` and ``settle()`` around a block that sets ``used_tokens``"""
+        permit = self.reserve(message, priority, deadline)
+        try:
+            yield permit
+        except Exception as e:
+            self.settle(permit, permit.used_tokens, e)
+            raise
+        self.settle(permit, permit.used_tokens)
+
+    def throttle(self, seconds: Optional[float] = None):
+        """The API said slow down: empty the buckets for ``seconds``"""
+        seconds = self.cooldown if seconds is None else seconds
+        with self._cond:
+            self.throttled += 1
+            self.buckets.drain(seconds)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "waiting": len(self._queue),
+                "granted": self.granted,
+                "avg_wait": self.total_wait / self.granted if self.granted else 0.0,
+                "max_wait": self.max_wait,
+                "throttled": self.throttled,
+            }
+
+    def estimated_wait(self, calls: int = 1) -> float:
+        """Rough seconds before ``calls`` more calls would start, given who is already waiting"""
+        bucket = self.buckets.buckets.get("requests")
+        if bucket is None:
+            return 0.0
+        with self._cond:
+            needed = len(self._queue) + calls - self.buckets.level("requests")
+        return max(needed / bucket.rate, 0.0)
+
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def shared_rate_limiter(
+    requests_per_minute: Optional[float] = None,
+    tokens_per_minute: Optional[float] = None,
+    state_path: Optional[str] = None,
+    **options,
+) -> RateLimiter:
+    """Process-wide limiter per set of limits, shared by every session"""
+    key = (requests_per_minute, tokens_per_minute, os.path.abspath(state_path) if state_path else None)
+    with _shared_lock:
+        limiter = _shared.get(key)
+        if limiter is None:
+            limiter = _shared[key] = RateLimiter(requests_per_minute, tokens_per_minute, state_path, **options)
+        return limiter
@@ -0,0 +1,300 @@
+"""Retries, deadlines and a circuit breaker around each expert's model call.
+
+A model call that fails with a transient upstream error (a timeout, a
+dropped connection, 429 or 5xx) is retried after a jittered exponential
+backoff, as long as the agent's overall deadline leaves room for it. Each
+attempt has its own deadline too: ``attempt_timeout`` bounds a call, or
+for a streamed call the wait for its first text. An attempt that runs
+past it is abandoned but may still be running on the agent, so it is not
+retried; a retry on the same agent would race it. A streamed call is only
+retried if none of its text was shown yet.
+
+Consecutive upstream failures open a circuit breaker per model; while it
+is open, calls fail at once with ``CircuitOpenError`` instead of queuing
+behind a degraded upstream. After ``reset_after`` one probe call is let
+through, and its outcome closes or reopens the circuit.
+
+Try it offline with the fake model, e.g. ``fake:flaky=2`` (every prompt
+fails twice, then answers) or ``fake:fail=1`` (the breaker opens).
+"""
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional
+import logging
+import random
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ATTEMPTS = 3
+DEFAULT_ATTEMPT_TIMEOUT = 60.0
+DEFAULT_BASE_DELAY = 0.5
+DEFAULT_MAX_DELAY = 8.0
+# Enough that one round of retries across a full fan-out doesn't open the circuit
+DEFAULT_FAILURE_THRESHOLD = 10
+DEFAULT_RESET_AFTER = 30.0
+
+_RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+# agno reports provider errors as messages, so transient ones are told apart by their text
+_RETRYABLE_MESSAGE = re.compile(
+    r"\b(408|429|500|502|503|504)\b|unavailable|resource.exhausted|overloaded|rate.limit|deadline|"
+    r"timed? ?out|temporar|connection|reset by peer",
+    re.IGNORECASE,
+)
+
+
+class CircuitOpenError(RuntimeError):
+    """The model is failing; calls fail fast until it recovers"""
+
+
+class AttemptTimeoutError(TimeoutError):
+    """One attempt ran past its deadline"""
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Whether ``error`` looks like a transient upstream failure"""
+    if isinstance(error, CircuitOpenError):
+        return False
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    status = getattr(error, "status_code", None) or getattr(error, "code", None)
+    if isinstance(status, int):
+        return status in _RETRYABLE_STATUS
+    return bool(_RETRYABLE_MESSAGE.search(str(error)))
+
+
+class CircuitBreaker:
+    """Opens after ``failure_threshold`` upstream failures in a row"""
+
+    def __init__(self, failure_threshold: int = DEFAULT_FAILURE_THRESHOLD, reset_after: float = DEFAULT_RESET_AFTER):
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self._lock = threading.Lock()
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.opened = 0
+        self.rejected = 0
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state(time.monotonic())
+
+    def _state(self, now: float) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "open" if now - self.opened_at < self.reset_after else "half_open"
+
+    def allow(self) -> bool:
+        """Whether a call may go ahead; half open, only one probe at a time"""
+        with self._lock:
+            state = self._state(time.monotonic())
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            self.rejected += 1
+            return False
+
+    def withdraw(self):
+        """A call let through by allow() that never reached the model; a probe may go again"""
+        with self._lock:
+            self._probing = False
+
+    def succeeded(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def failed(self):
+        with self._lock:
+            self.failures += 1
+            if self._probing or self.failures >= self.failure_threshold:
+                if self.opened_at is None or self._probing:
+                    self.opened += 1
+                self.opened_at = time.monotonic()
+                self._probing = False
+
+
+@dataclass
+class RetryPolicy:
+    """How often, how long and how far apart to try a call"""
+    attempts: int = DEFAULT_ATTEMPTS
+    attempt_timeout: Optional[float] = DEFAULT_ATTEMPT_TIMEOUT
+    base_delay: float = DEFAULT_BASE_DELAY
+    max_delay: float = DEFAULT_MAX_DELAY
+
+    def backoff(self, retry: int) -> float:
+        """Full jitter: anywhere up to the exponential step, so retries don't arrive together"""
+        return random.uniform(0.0, min(self.max_delay, self.base_delay * 2 ** retry))
+
+
+@dataclass
+class CallOutcome:
+    """What a resilient call returned, or the error it ended with"""
+    value: Any = None
+    error: Optional[BaseException] = None
+    attempts: int = 0
+    # An attempt ran past its deadline and was left running on the agent
+    abandoned: bool = False
+
+
+def run_attempt(attempt: Callable[[threading.Event], Any], timeout: Optional[float],
+                progress: Optional[threading.Event] = None, deadline: Optional[float] = None):
+    """Run one attempt on its own thread, abandoning it (and setting its event) at ``timeout``.
+
+    Raises ``AttemptTimeoutError`` then, so the caller's thread moves on
+    while the abandoned call runs to its end in the background.
+    """
+    cancelled = threading.Event()
+    if timeout is None:
+        return attempt(cancelled)
+    outcome = {}
+    done = threading.Event()
+
+    def target():
+        try:
+            outcome["value"] = attempt(cancelled)
+        except BaseException as e:
+            outcome["error"] = e
+        finally:
+            done.set()
+
+    threading.Thread(target=target, name="model-attempt", daemon=True).start()
+    finished = done.wait(timeout)
+    if not finished and progress is not None and progress.is_set():
+        # Text is arriving; only the overall deadline applies from here
+        finished = done.wait(None if deadline is None else max(deadline - time.perf_counter(), 0.0))
+    if not finished:
+        cancelled.set()
+        raise AttemptTimeoutError(f"the model gave no answer within {timeout:g}s")
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome["value"]
+
+
+class Resilience:
+    """Retry policy plus one circuit breaker per model, shared by every call"""
+
+    def __init__(
+        self,
+        policy: Optional[RetryPolicy] = None,
+        failure_threshold: int = DEFAULT_FAILURE_THRESHOLD,
+        reset_after: float = DEFAULT_RESET_AFTER,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.policy = policy or RetryPolicy()
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self.sleep = sleep
+        self._lock = threading.Lock()
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self.retries = 0
+
+    def breaker(self, key: str) -> CircuitBreaker:
+        with self._lock:
+            breaker = self._breakers.get(key)
+            if breaker is None:
+                breaker = self._breakers[key] = CircuitBreaker(self.failure_threshold, self.reset_after)
+            breaker.failure_threshold, breaker.reset_after = self.failure_threshold, self.reset_after
+            return breaker
+
+    def call(
+        self,
+        key: str,
+        attempt: Callable[[threading.Event], Any],
+        deadline: Optional[float] = None,
+        retry_if: Optional[Callable[[BaseException], bool]] = None,
+        progress: Optional[threading.Event] = None,
+        before_attempt: Optional[Callable[[], None]] = None,
+    ) -> CallOutcome:
+        """Run ``attempt`` against model ``key`` until it succeeds or may not be retried.
+
+        ``attempt`` gets an event that is set once it has been abandoned.
+        ``deadline`` is a ``time.perf_counter()`` time no attempt or backoff
+        may run past. ``retry_if`` can veto a retry (a stream that already
+        showed text), and ``progress``, once set by the attempt, lifts the
+        per-attempt timeout. ``before_attempt`` runs ahead of each attempt
+        the breaker lets through, outside its timeout (waiting for rate
+        limit quota); if it raises, the call ends. Never raises; the outcome carries the error, and
+        ``abandoned`` if an attempt that timed out may still be running. An abandoned attempt
+        ends the call, since a retry would run on the same agent alongside it.
+        """
+        breaker = self.breaker(key)
+        outcome = CallOutcome()
+        for retry in range(max(self.policy.attempts, 1)):
+            # Checked first, so a rejected call takes no rate limit quota
+            if not breaker.allow():
+                outcome.error = CircuitOpenError(
+                    f"{key} is failing; calls are paused for up to {self.reset_after:g}s"
+                )
+                return outcome
+            if before_attempt is not None:
+                try:
+                    before_attempt()
+                except Exception as e:
+                    breaker.withdraw()
+                    outcome.error = e
+                    return outcome
+            outcome.attempts += 1
+            timeout = self.policy.attempt_timeout
+            if deadline is not None:
+                remaining = max(deadline - time.perf_counter(), 0.0)
+                timeout = remaining if timeout is None else min(timeout, remaining)
+            try:
+                outcome.value, outcome.error = run_attempt(attempt, timeout, progress, deadline), None
+                breaker.succeeded()
+                return outcome
+            except AttemptTimeoutError as e:
+                outcome.error, outcome.abandoned = e, True
+            except Exception as e:
+                outcome.error = e
+            if not is_retryable(outcome.error):
+                # The model answered; it was the request that was bad
+                breaker.succeeded()
+                return outcome
+            breaker.failed()
+            if (outcome.abandoned or retry == self.policy.attempts - 1
+                    or (retry_if is not None and not retry_if(outcome.error))):
+                return outcome
+            delay = self.policy.backoff(retry)
+            if deadline is not None and time.perf_counter() + delay >= deadline:
+                return outcome
+            with self._lock:
+                self.retries += 1
+            logger.warning(f"{key} call failed ({str(outcome.error)}); retrying in {delay:.2f}s")
+            self.sleep(delay)
+        return outcome
+
+    def stats(self) -> dict:
+        with self._lock:
+            breakers = dict(self._breakers)
+            retries = self.retries
+        return {
+            "retries": retries,
+            "open_circuits": sum(1 for breaker in breakers.values() if breaker.state != "closed"),
+            "circuit_opened": sum(breaker.opened for breaker in breakers.values()),
+            "rejected": sum(breaker.rejected for breaker in breakers.values()),
+        }
+
+
+_shared: Optional[Resilience] = None
+_shared_lock = threading.Lock()
+
+
+def shared_resilience(policy: Optional[RetryPolicy] = None, **options) -> Resilience:
+    """Process-wide instance, so every session sees the same circuit breakers"""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = Resilience(policy, **options)
+        else:
+            if policy is not None:
+                _shared.policy = policy
+            for name, value in options.items():
+                setattr(_shared, name, value)
+        return _shared
@@ -0,0 +1,222 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Tuple
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_CACHE_PATH = os.path.join(".cache", "responses.sqlite3")
+DEFAULT_TTL_SECONDS = 7 * 24 * 3600
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_MEMORY_ENTRIES = 256
+
+
+def normalize_context(context: str) -> str:
+    """Canonical form of a prompt: trimmed lines, collapsed inner whitespace"""
+    lines = (" ".join(line.split()) for line in context.strip().splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+def cache_key(agent, context: str) -> str:
+    """Hash of everything that determines an agent's answer"""
+    model_id = getattr(getattr(agent, "model", None), "id", None)
+    payload = json.dumps(
+        [agent.name, agent.instructions, model_id, normalize_context(context)],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Two-tier answer cache: an in-memory LRU in front of a SQLite file.
+
+    Disk entries expire after ``ttl`` seconds. Once the stored answers grow
+    past ``max_bytes`` the least recently used ones are evicted. Safe to
+    share between threads.
+    """
+
+    def __init__(
+        self,
+        path: str = DEFAULT_CACHE_PATH,
+        ttl: float = DEFAULT_TTL_SECONDS,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        memory_entries: int = DEFAULT_MEMORY_ENTRIES,
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.memory_entries = memory_entries
+        self.hits = 0
+        self.misses = 0
+        self._memory: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                content TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._db.commit()
+
+    def get(self, key: str, count: bool = True) -> Optional[str]:
+        """The cached answer, if fresh; ``count=False`` leaves the hit/miss stats alone"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and now - entry[1] < self.ttl:
+                self._memory.move_to_end(key)
+                self.hits += count
+                return entry[0]
+            self._memory.pop(key, None)
+
+            row = self._db.execute(
+                "SELECT content, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] >= self.ttl:
+                if row is not None:
+                    self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self._db.commit()
+                self.misses += count
+                return None
+
+            self._db.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            self._remember(key, row[0], row[1])
+            self.hits += count
+            return row[0]
+
+    def set(self, key: str, content: str):
+        if not content:
+            return
+        now = time.time()
+        with self._lock:
+            self._remember(key, content, now)
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, content, size, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, content, len(content.encode("utf-8")), now, now),
+            )
+            self._evict(now)
+            self._db.commit()
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._db.execute("DELETE FROM responses")
+            self._db.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, size = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "memory_entries": len(self._memory),
+                "disk_entries": entries,
+                "disk_bytes": size,
+            }
+
+    def _remember(self, key: str, content: str, created_at: float):
+        self._memory[key] = (content, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict(self, now: float):
+        self._db.execute("DELETE FROM responses WHERE created_at <= ?", (now - self.ttl,))
+        # Drop least recently used rows beyond the byte budget
+        self._db.execute(
+            """
+            DELETE FROM responses WHERE key IN (
+                SELECT key FROM (
+                    SELECT key, SUM(size) OVER (ORDER BY last_access DESC, key) AS running
+                    FROM responses
+                ) WHERE running > ?
+            )
+            """,
+            (self.max_bytes,),
+        )
+
+
+@dataclass
+class CacheHit:
+    """An answer served without calling the model"""
+    content: str
+    similarity: float = 1.0
+    matched_question: Optional[str] = None
+
+    @property
+    def semantic(self) -> bool:
+        return self.matched_question is not None
+
+
+class AnswerCache:
+    """Per-request view over the exact and semantic caches.
+
+    Agent runners only see ``lookup(agent, context)`` and
+    ``store(agent, context, content)``; the semantic tier additionally needs
+    the raw question and the remaining context options (``scope``), which
+    are bound here once per request. Either tier may be ``None``. With
+    ``count=False`` lookups leave the caches' hit/miss stats alone.
+    """
+
+    def __init__(self, exact: Optional[ResponseCache] = None, semantic=None, question: str = "", scope=None,
+                 count: bool = True):
+        self.exact = exact
+        self.semantic = semantic
+        self.question = question
+        self.scope = scope
+        self.count = count
+
+    def __bool__(self) -> bool:
+        return self.exact is not None or self.semantic is not None
+
+    def lookup(self, agent, context: str) -> Optional[CacheHit]:
+        if self.exact is not None:
+            content = self.exact.get(cache_key(agent, context), self.count)
+            if content is not None:
+                return CacheHit(content)
+        if self.semantic is not None and self.question:
+            hit = self.semantic.lookup(agent, self.question, self.scope, self.count)
+            if hit is not None:
+                return CacheHit(hit.content, hit.similarity, hit.question)
+        return None
+
+    def store(self, agent, context: str, content: str):
+        if self.exact is not None:
+            self.exact.set(cache_key(agent, context), content)
+        if self.semantic is not None and self.question:
+            self.semantic.add(agent, self.question, content, self.scope)
+
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def shared_cache(path: str = DEFAULT_CACHE_PATH, **options) -> ResponseCache:
+    """Process-wide cache instance per file, so reruns keep the memory tier"""
+    path = os.path.abspath(path)
+    with _shared_lock:
+        cache = _shared.get(path)
+        if cache is None:
+            cache = _shared[path] = ResponseCache(path, **options)
+        else:
+            # Pick up changed limits without dropping what's cached
+            for name, value in options.items():
+                setattr(cache, name, value)
+        return cache
@@ -0,0 +1,263 @@
+"""Automatic expert selection for questions asked in auto-routing mode.
+
+A small multi-label classifier scores how relevant each of the four
+experts is to a question: hashed TF-IDF features plus per-expert keyword
+hits, fed to one logistic regression per expert. It trains in well under
+a second on the labelled examples below (plus any given in a JSONL file)
+and runs locally, so routing costs no model call. Experts scoring at
+least ``threshold`` are asked; when even the best score is under
+``min_confidence`` the question goes to every expert, as it would have
+without routing.
+
+Each decision is logged and recorded in ``metrics`` (and the trace), so
+the calls saved against always asking all four can be measured::
+
+    python -m senior_dev.router "How do I shard a Postgres database?"
+    python -m senior_dev.router --replay .cache/trace.jsonl
+"""
+from dataclasses import dataclass
+from typing import Iterable, List, Optional, Sequence, Tuple
+import argparse
+import functools
+import json
+import math
+import re
+import sys
+
+import numpy as np
+
+from .agents import AGENT_SPECS
+from .semantic_cache import HashedTfidfEmbedder
+
+DEFAULT_THRESHOLD = 0.5
+DEFAULT_MIN_CONFIDENCE = 0.45
+FEATURE_DIM = 1024
+
+# Words that point at each expert, in AGENT_SPECS order
+EXPERT_KEYWORDS = [
+    """code coding refactor refactoring bug bugs debug test tests testing unit review class classes function
+    functions module pattern patterns solid clean oop typescript javascript python java rust golang react
+    django fastapi spring framework library exception error leak profiling ci linting pytest fixture fixtures
+    mock mocks""",
+    """agent agents multi-agent llm llms prompt prompts prompting rag retrieval embedding embeddings vector
+    langchain autogen crewai semantic kernel tool tools function-calling orchestration orchestrate chatbot
+    assistant gpt gemini openai fine-tuning hallucination hallucinations tokens planner guardrails""",
+    """scale scaling scalability scalable distributed database databases sharding
+    shard replication replica cache caching redis cdn load balancer balancing microservices queue queues
+    kafka throughput latency availability consistency million millions users concurrent traffic storage""",
+    """open source open-source contribute contributing contribution contributions contributor github gitlab
+    maintainer maintainers community upstream repository repo license hugging pytorch tensorflow scikit-learn
+    mentor portfolio reputation newcomer newcomers""",
+]
+
+# (question, experts) pairs; experts index AGENT_SPECS
+TRAINING_EXAMPLES: List[Tuple[str, Sequence[int]]] = [
+    ("How should I refactor this 2000-line Python class into smaller modules?", [0]),
+    ("What is the best way to unit test code that calls an external payment API?", [0]),
+    ("Review my error handling approach in a FastAPI service", [0]),
+    ("Which design pattern fits a plugin system in Java?", [0]),
+    ("How do I find and fix a memory leak in a Node.js application?", [0]),
+    ("Explain SOLID principles with examples in TypeScript", [0]),
+    ("My React component re-renders too often, how do I debug it?", [0]),
+    ("How should I structure a Django project for a mid-sized team?", [0]),
+    ("What's a clean way to handle configuration across dev, staging and prod?", [0]),
+    ("How do I set up CI with linting, tests and code coverage for a Go repo?", [0]),
+    ("Should I use inheritance or composition for these domain objects?", [0]),
+    ("Write a robust retry decorator in Python with exponential backoff", [0]),
+    ("How do I design a multi-agent system for automated customer support?", [1]),
+    ("What prompt engineering techniques reduce hallucinations in a RAG chatbot?", [1]),
+    ("LangChain vs AutoGen vs CrewAI for orchestrating research agents?", [1]),
+    ("How should agents share memory and state in a long-running workflow?", [1]),
+    ("Design a tool-calling agent that books meetings from email", [1]),
+    ("How do I evaluate an LLM agent's answers automatically?", [1]),
+    ("What's a good architecture for a retrieval-augmented generation pipeline with embeddings?", [1]),
+    ("How do I keep an LLM's context window small when conversations get long?", [1]),
+    ("Should a planner agent delegate to specialist agents or call tools directly?", [1]),
+    ("How do I add guardrails so my Gemini assistant refuses unsafe requests?", [1]),
+    ("Fine-tuning versus prompting for a domain-specific assistant?", [1]),
+    ("Design a real-time chat application that scales to millions of concurrent users", [2]),
+    ("How should I shard a Postgres database that's outgrowing one machine?", [2]),
+    ("Design a URL shortener with high availability", [2]),
+    ("Where should caching go in a read-heavy API with a Redis cluster?", [2]),
+    ("Kafka or RabbitMQ for an event-driven order pipeline at 50k messages per second?", [2]),
+    ("How do I design a rate limiter for a distributed API gateway?", [2]),
+    ("What consistency model do I need for a global inventory system?", [2]),
+    ("Design the storage and feed service for a social network", [2]),
+    ("How do I reduce p99 latency across a chain of microservices?", [2]),
+    ("Plan capacity for a video streaming platform with a CDN", [2]),
+    ("How should I replicate data across regions for disaster recovery?", [2]),
+    ("I'm a machine learning engineer, which open source AI projects should I contribute to?", [3]),
+    ("How do I make my first pull request to Hugging Face transformers?", [3]),
+    ("How can I grow a community around my open-source library?", [3]),
+    ("What license should I choose for an open source AI model?", [3]),
+    ("How do maintainers triage issues and review contributions efficiently?", [3]),
+    ("How do I build a reputation in the PyTorch community?", [3]),
+    ("Which good first issues are best for newcomers to open source ML?", [3]),
+    ("How do I write documentation and tutorials that get my GitHub repo adopted?", [3]),
+    ("How do I run releases and versioning for an open-source Python package?", [3]),
+    ("Build a scalable multi-agent platform serving millions of users with low latency", [1, 2]),
+    ("How should I architect an LLM inference service that autoscales across regions?", [1, 2]),
+    ("Design and implement a clean, tested Python SDK for our agent framework", [0, 1]),
+    ("Refactor our monolith into microservices without breaking the codebase", [0, 2]),
+    ("I want to contribute an agent orchestration feature to LangChain", [1, 3]),
+    ("Design a scalable architecture for the open-source project I maintain", [2, 3]),
+    ("How do I write clean, well-tested code good enough to contribute upstream on GitHub?", [0, 3]),
+    ("End-to-end plan: code structure, agent design, infrastructure at scale and open-sourcing it", [0, 1, 2, 3]),
+]
+
+_WORD_RE = re.compile(r"[a-z0-9][a-z0-9+#-]*")
+
+
+@dataclass
+class RouteDecision:
+    """Which experts a question goes to, and why"""
+    experts: List[int]
+    scores: List[float]
+    fallback: bool = False
+
+    @property
+    def names(self) -> List[str]:
+        return [AGENT_SPECS[index][0] for index in self.experts]
+
+    @property
+    def saved(self) -> int:
+        """Expert calls saved against asking all of them"""
+        return len(AGENT_SPECS) - len(self.experts)
+
+    def to_dict(self) -> dict:
+        return {
+            "experts": self.names,
+            "scores": {name: round(score, 4) for (name, _), score in zip(AGENT_SPECS, self.scores)},
+            "fallback": self.fallback,
+            "calls": len(self.experts),
+            "saved": self.saved,
+        }
+
+
+class Router:
+    """Multi-label linear classifier over TF-IDF and keyword features"""
+
+    def __init__(self, threshold: float = DEFAULT_THRESHOLD, min_confidence: float = DEFAULT_MIN_CONFIDENCE):
+        self.threshold = threshold
+        self.min_confidence = min_confidence
+        self.embedder = HashedTfidfEmbedder(FEATURE_DIM)
+        self.keywords = [frozenset(words.split()) for words in EXPERT_KEYWORDS]
+        self.weights: Optional[np.ndarray] = None
+        self.bias: Optional[np.ndarray] = None
+
+    def _keyword_features(self, questions: List[str]) -> np.ndarray:
+        features = np.zeros((len(questions), len(self.keywords)), dtype=np.float32)
+        for row, question in enumerate(questions):
+            words = _WORD_RE.findall(question.lower())
+            terms = set(words) | {f"{a} {b}" for a, b in zip(words, words[1:])}
+            for column, keywords in enumerate(self.keywords):
+                features[row, column] = math.log1p(len(terms & keywords))
+        return features
+
+    def _features(self, questions: List[str]) -> np.ndarray:
+        return np.hstack([self.embedder.embed(questions), self._keyword_features(questions)])
+
+    def train(self, examples: Iterable[Tuple[str, Sequence[int]]], epochs: int = 400,
+              learning_rate: float = 0.5, l2: float = 1e-3) -> "Router":
+        """Fit one logistic regression per expert by batch gradient descent"""
+        examples = list(examples)
+        questions = [question for question, _ in examples]
+        for question in questions:
+            self.embedder.observe(question)
+        x = self._features(questions)
+        y = np.zeros((len(examples), len(AGENT_SPECS)), dtype=np.float32)
+        for row, (_, experts) in enumerate(examples):
+            y[row, list(experts)] = 1.0
+        self.weights = np.zeros((x.shape[1], y.shape[1]), dtype=np.float32)
+        self.bias = np.zeros(y.shape[1], dtype=np.float32)
+        for _ in range(epochs):
+            error = self._sigmoid(x @ self.weights + self.bias) - y
+            self.weights -= learning_rate * (x.T @ error / len(x) + l2 * self.weights)
+            self.bias -= learning_rate * error.mean(axis=0)
+        return self
+
+    @staticmethod
+    def _sigmoid(z: np.ndarray) -> np.ndarray:
+        return 1.0 / (1.0 + np.exp(-z))
+
+    def scores(self, question: str) -> List[float]:
+        """Each expert's relevance to ``question``, from 0 to 1"""
+        if self.weights is None:
+            raise RuntimeError("Router is not trained")
+        return self._sigmoid(self._features([question]) @ self.weights + self.bias)[0].tolist()
+
+    def route(self, question: str) -> RouteDecision:
+        """The experts to ask; all of them when the classifier isn't sure"""
+        scores = self.scores(question)
+        if max(scores) < self.min_confidence:
+            return RouteDecision(list(range(len(AGENT_SPECS))), scores, fallback=True)
+        chosen = [index for index, score in enumerate(scores) if score >= self.threshold]
+        return RouteDecision(chosen or [int(np.argmax(scores))], scores)
+
+
+def load_examples(path: str) -> List[Tuple[str, List[int]]]:
+    """Labelled examples from JSONL lines of {"question": ..., "experts": [names]}"""
+    names = [name for name, _ in AGENT_SPECS]
+    examples = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                examples.append((record["question"], [names.index(name) for name in record["experts"]]))
+    return examples
+
+
+@functools.lru_cache(maxsize=8)
+def shared_router(examples_path: Optional[str] = None, threshold: float = DEFAULT_THRESHOLD,
+                  min_confidence: float = DEFAULT_MIN_CONFIDENCE) -> Router:
+    """A router trained once per process and configuration"""
+    examples = list(TRAINING_EXAMPLES)
+    if examples_path:
+        examples += load_examples(examples_path)
+    return Router(threshold, min_confidence).train(examples)
+
+
+def replay(path: str) -> dict:
+    """Sum the routing decisions in a trace file against the always-all baseline"""
+    decisions = fallbacks = calls = 0
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line) if line.strip() else {}
+            if record.get("type") != "route":
+                continue
+            decisions += 1
+            fallbacks += bool(record["fallback"])
+            calls += record["calls"]
+    baseline = decisions * len(AGENT_SPECS)
+    return {
+        "decisions": decisions,
+        "fallbacks": fallbacks,
+        "calls": calls,
+        "baseline_calls": baseline,
+        "saved": baseline - calls,
+        "saved_ratio": round((baseline - calls) / baseline, 4) if baseline else 0.0,
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Score questions against the experts, or replay logged routing decisions.")
+    parser.add_argument("questions", nargs="*", help="questions to route")
+    parser.add_argument("--replay", help="trace file to summarize calls saved against asking every expert")
+    parser.add_argument("--examples", help="extra labelled examples (JSONL) to train on")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument("--min-confidence", type=float, default=DEFAULT_MIN_CONFIDENCE)
+    args = parser.parse_args(argv)
+
+    if args.replay:
+        print(json.dumps(replay(args.replay), indent=2))
+    router = shared_router(args.examples, args.threshold, args.min_confidence)
+    for question in args.questions:
+        print(json.dumps({"question": question, **router.route(question).to_dict()}, ensure_ascii=False))
+    if not args.replay and not args.questions:
+        parser.print_usage(sys.stderr)
+        return 2
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
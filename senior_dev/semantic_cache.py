@@ -0,0 +1,278 @@
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+import hashlib
+import json
+import math
+import re
+import threading
+import zlib
+
+import numpy as np
+
+from .startup import module_available
+
+# Optional local embedding model, imported when one is built (it brings in torch);
+# falls back to the hashed TF-IDF embedder
+SENTENCE_TRANSFORMERS_AVAILABLE = module_available("sentence_transformers")
+
+DEFAULT_THRESHOLD = 0.9
+DEFAULT_DIM = 2048
+DEFAULT_ANN_THRESHOLD = 2000
+DEFAULT_MAX_ENTRIES = 5000
+
+_TOKEN_RE = re.compile(r"[a-z0-9][a-z0-9+#._-]*")
+_STOPWORDS = frozenset("""
+a about an and are as at be but by can could do does for from how i if in is it
+its me my of on or our should so that the their this to us we what whats when
+where which who why will with would you your
+""".split())
+
+
+class HashedTfidfEmbedder:
+    """Bag of words and bigrams hashed into a fixed-size TF-IDF vector.
+
+    Document frequencies are learned from the questions added to the cache,
+    so the weights drift as it grows (``stateful``); stores re-embed their
+    rows when the corpus has grown enough for that to matter.
+    """
+
+    stateful = True
+
+    def __init__(self, dim: int = DEFAULT_DIM):
+        self.dim = dim
+        self.doc_count = 0
+        self.doc_freq = np.zeros(dim, dtype=np.float32)
+        self._lock = threading.Lock()
+
+    def _features(self, text: str) -> Dict[int, float]:
+        tokens = [t for t in _TOKEN_RE.findall(text.lower().replace("'", "")) if t not in _STOPWORDS]
+        # Bigrams count half so word order helps without dominating paraphrases
+        terms = [(t, 1.0) for t in tokens] + [(f"{a} {b}", 0.5) for a, b in zip(tokens, tokens[1:])]
+        counts: Dict[int, float] = {}
+        for term, weight in terms:
+            index = zlib.crc32(term.encode("utf-8")) % self.dim
+            counts[index] = counts.get(index, 0.0) + weight
+        return counts
+
+    def observe(self, text: str):
+        """Count a new document towards the IDF weights"""
+        with self._lock:
+            self.doc_count += 1
+            for index in self._features(text):
+                self.doc_freq[index] += 1.0
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        with self._lock:
+            idf = np.log((1.0 + self.doc_count) / (1.0 + self.doc_freq)) + 1.0
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for index, count in self._features(text).items():
+                vectors[row, index] = (1.0 + math.log1p(count)) * idf[index]
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+
+class LocalModelEmbedder:
+    """Sentence-transformers model running on the local CPU"""
+
+    stateful = False
+
+    def __init__(self, model_name: str = "all-MiniLM-L6-v2"):
+        if not SENTENCE_TRANSFORMERS_AVAILABLE:
+            raise ImportError("sentence-transformers is not installed. Install with: pip install sentence-transformers")
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_name, device="cpu")
+
+    def observe(self, text: str):
+        pass
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = self.model.encode(texts, normalize_embeddings=True, convert_to_numpy=True)
+        return vectors.astype(np.float32)
+
+
+class _LshIndex:
+    """Random-hyperplane LSH over unit vectors, for stores too big to scan"""
+
+    def __init__(self, dim: int, n_bits: int = 12, n_tables: int = 6, seed: int = 0):
+        rng = np.random.default_rng(seed)
+        self.planes = rng.standard_normal((n_tables, dim, n_bits)).astype(np.float32)
+        self.weights = 1 << np.arange(n_bits, dtype=np.int64)
+        self.tables: List[Dict[int, List[int]]] = [{} for _ in range(n_tables)]
+
+    def _codes(self, vectors: np.ndarray) -> np.ndarray:
+        # (n_tables, n_rows) integer bucket codes
+        bits = np.einsum("nd,tdb->tnb", vectors, self.planes) > 0
+        return bits.astype(np.int64) @ self.weights
+
+    def add(self, vectors: np.ndarray, start: int):
+        for table, codes in zip(self.tables, self._codes(vectors)):
+            for offset, code in enumerate(codes.tolist()):
+                table.setdefault(code, []).append(start + offset)
+
+    def candidates(self, vector: np.ndarray) -> np.ndarray:
+        rows = set()
+        for table, codes in zip(self.tables, self._codes(vector[None, :])):
+            rows.update(table.get(int(codes[0]), ()))
+        return np.fromiter(rows, dtype=np.int64, count=len(rows))
+
+
+@dataclass
+class _Store:
+    """Questions and answers for one agent and one set of context options"""
+    questions: List[str] = field(default_factory=list)
+    answers: List[str] = field(default_factory=list)
+    vectors: Optional[np.ndarray] = None
+    embedded_at: int = 0
+    dirty: bool = False
+    index: Optional[_LshIndex] = None
+
+
+@dataclass
+class SemanticHit:
+    content: str
+    similarity: float
+    question: str
+
+
+def _store_key(agent, scope) -> str:
+    model_id = getattr(getattr(agent, "model", None), "id", None)
+    payload = json.dumps([agent.name, agent.instructions, model_id, scope], ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class SemanticCache:
+    """Near-duplicate question cache keyed by local embeddings.
+
+    Answers are partitioned by agent and ``scope`` (the non-question
+    context options), and matched on cosine similarity of the question
+    text. Stores are scanned with a single matrix product; once one grows
+    past ``ann_threshold`` rows an LSH index narrows the candidates first.
+    ``thresholds`` overrides the minimum similarity per agent name.
+    """
+
+    def __init__(
+        self,
+        embedder=None,
+        threshold: float = DEFAULT_THRESHOLD,
+        thresholds: Optional[Dict[str, float]] = None,
+        ann_threshold: int = DEFAULT_ANN_THRESHOLD,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+    ):
+        self.embedder = embedder or HashedTfidfEmbedder()
+        self.threshold = threshold
+        self.thresholds = dict(thresholds or {})
+        self.ann_threshold = ann_threshold
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._stores: Dict[str, _Store] = {}
+        self._lock = threading.Lock()
+
+    def threshold_for(self, agent_name: str) -> float:
+        return self.thresholds.get(agent_name, self.threshold)
+
+    def lookup(self, agent, question: str, scope=None, count: bool = True) -> Optional[SemanticHit]:
+        """Best earlier answer for a similar question, if above the threshold;
+        ``count=False`` leaves the hit/miss stats alone"""
+        query = self.embedder.embed([question])[0]
+        with self._lock:
+            store = self._stores.get(_store_key(agent, scope))
+            if store is None or not store.questions:
+                self.misses += count
+                return None
+            self._refresh(store)
+
+            rows = None
+            if store.index is not None:
+                rows = store.index.candidates(query)
+            if rows is None:
+                scores = store.vectors @ query
+                best = int(np.argmax(scores))
+            elif len(rows):
+                scores = store.vectors[rows] @ query
+                best = int(rows[int(np.argmax(scores))])
+            else:
+                self.misses += count
+                return None
+
+            similarity = float(store.vectors[best] @ query)
+            if similarity < self.threshold_for(agent.name):
+                self.misses += count
+                return None
+            self.hits += count
+            return SemanticHit(store.answers[best], similarity, store.questions[best])
+
+    def add(self, agent, question: str, content: str, scope=None):
+        if not content or not question.strip():
+            return
+        self.embedder.observe(question)
+        vector = self.embedder.embed([question])
+        with self._lock:
+            store = self._stores.setdefault(_store_key(agent, scope), _Store())
+            store.questions.append(question)
+            store.answers.append(content)
+            if store.vectors is None:
+                store.vectors = vector
+                store.embedded_at = self._corpus_size()
+            elif not store.dirty:
+                store.vectors = np.vstack([store.vectors, vector])
+                if store.index is not None:
+                    store.index.add(vector, len(store.questions) - 1)
+
+            if len(store.questions) > self.max_entries:
+                # Drop the oldest quarter rather than shifting on every add
+                drop = self.max_entries // 4
+                del store.questions[:drop]
+                del store.answers[:drop]
+                store.dirty = True  # re-embed and renumber the index on next lookup
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": sum(len(store.questions) for store in self._stores.values()),
+            }
+
+    def _corpus_size(self) -> int:
+        return getattr(self.embedder, "doc_count", 0)
+
+    def _refresh(self, store: _Store):
+        """Re-embed a store once IDF weights have drifted, and (re)build its index"""
+        corpus = self._corpus_size()
+        if store.dirty or (self.embedder.stateful and corpus >= 1.25 * store.embedded_at):
+            store.vectors = self.embedder.embed(store.questions)
+            store.embedded_at = corpus
+            store.dirty = False
+            store.index = None
+        if store.index is None and len(store.questions) > self.ann_threshold:
+            store.index = _LshIndex(store.vectors.shape[1])
+            store.index.add(store.vectors, 0)
+
+
+def make_embedder(name: str = "tfidf"):
+    """Embedder by config name: "tfidf" or "local" (sentence-transformers)"""
+    if name == "local":
+        return LocalModelEmbedder()
+    if name == "tfidf":
+        return HashedTfidfEmbedder()
+    raise ValueError(f"Unknown embedder: {name}")
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_semantic_cache(embedder: str = "tfidf", **options) -> SemanticCache:
+    """Process-wide semantic cache; later calls only update its thresholds"""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = SemanticCache(make_embedder(embedder), **options)
+        else:
+            for name in ("threshold", "thresholds", "ann_threshold", "max_entries"):
+                if name in options:
+                    setattr(_shared, name, options[name])
+            _shared.thresholds = dict(_shared.thresholds)
+        return _shared
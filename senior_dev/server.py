@@ -0,0 +1,358 @@
+"""ASGI service exposing the expert agents over HTTP.
+
+Endpoints::
+
+    GET  /health
+    GET  /metrics                    Prometheus metrics
+    GET  /experts                    the experts and the question types
+    POST /experts/{expert}           one expert, e.g. /experts/system-designer
+    POST /analyze                    any question type, all experts by default
+
+POST bodies are JSON with ``question`` and optionally ``tech_stack``,
+``complexity_level``, ``project_scale`` (and ``question_type`` for
+/analyze). Add ``?stream=true`` to receive server-sent events: ``chunk``
+events with streamed text, one ``section`` event per finished expert and
+a final ``done`` event.
+
+Identical requests that are in flight at the same time share one run.
+Runs wait in a bounded queue in front of a fixed pool of workers; when
+the queue is full new requests get ``503`` with ``Retry-After``.
+
+Usage::
+
+    GEMINI_API_KEY=... python -m senior_dev.server --port 8000
+"""
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Dict, List, Optional
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+
+from .agents import AGENT_SPECS
+from .config import add_engine_arguments, config_from_args
+from .core import (
+    QUESTION_TYPES,
+    ROUTES,
+    AgentInitializationError,
+    AnalysisRequest,
+    EngineConfig,
+    SectionResult,
+    aiter_analysis,
+)
+from .fanout import DEFAULT_MAX_CONCURRENCY, StreamChunk
+from .metrics import PROMETHEUS_CONTENT_TYPE, metrics
+from .response_cache import normalize_context
+
+# Optional server stack
+try:
+    from starlette.applications import Starlette
+    from starlette.requests import Request
+    from starlette.responses import JSONResponse, Response, StreamingResponse
+    from starlette.routing import Route
+    SERVER_AVAILABLE = True
+except ImportError:
+    SERVER_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 8
+DEFAULT_QUEUE_SIZE = 64
+
+# URL names for the single-expert question types
+EXPERTS = {
+    "senior-developer": QUESTION_TYPES[0],
+    "ai-agent-architect": QUESTION_TYPES[1],
+    "system-designer": QUESTION_TYPES[2],
+    "opensource-contributor": QUESTION_TYPES[3],
+}
+ALL_EXPERTS = QUESTION_TYPES[4]
+
+
+class _Flight:
+    """One run of a request, shared by every caller asking the same thing.
+
+    Events are kept for the whole run so subscribers that join late replay
+    what they missed before following along live.
+    """
+
+    def __init__(self, key: str, request: AnalysisRequest):
+        self.key = key
+        self.request = request
+        self.events: List[object] = []
+        self.error: Optional[BaseException] = None
+        self.done = False
+        self.subscribers = 0
+        self.queued_at = time.perf_counter()
+        self._changed = asyncio.Condition()
+
+    async def publish(self, event):
+        async with self._changed:
+            self.events.append(event)
+            self._changed.notify_all()
+
+    async def finish(self, error: Optional[BaseException] = None):
+        async with self._changed:
+            self.error = error
+            self.done = True
+            self._changed.notify_all()
+
+    async def follow(self) -> AsyncIterator[object]:
+        position = 0
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: self.done or len(self.events) > position)
+                pending = self.events[position:]
+                finished = self.done
+            position += len(pending)
+            for event in pending:
+                yield event
+            if finished and position == len(self.events):
+                if self.error is not None:
+                    raise self.error
+                return
+
+    async def sections(self) -> List[SectionResult]:
+        return [event async for event in self.follow() if isinstance(event, SectionResult)]
+
+
+class QueueFullError(RuntimeError):
+    """Raised when the run queue is at capacity"""
+
+
+class AnalysisService:
+    """Coalesces identical requests and runs them from a bounded queue"""
+
+    def __init__(
+        self,
+        config: EngineConfig,
+        workers: int = DEFAULT_WORKERS,
+        queue_size: int = DEFAULT_QUEUE_SIZE,
+        analysis: Callable = aiter_analysis,
+    ):
+        self.config = config
+        self.workers = workers
+        self.analysis = analysis
+        self.queue: "asyncio.Queue[_Flight]" = asyncio.Queue(maxsize=queue_size)
+        self.inflight: Dict[str, _Flight] = {}
+        self.coalesced = 0
+        self.rejected = 0
+        self._tasks: List[asyncio.Task] = []
+
+    @staticmethod
+    def key(request: AnalysisRequest) -> str:
+        return hashlib.sha256(normalize_context(request.context).encode("utf-8")).hexdigest()
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def submit(self, request: AnalysisRequest) -> _Flight:
+        """Join the in-flight run for this request, or queue a new one"""
+        key = self.key(request)
+        flight = self.inflight.get(key)
+        if flight is not None:
+            self.coalesced += 1
+        else:
+            flight = _Flight(key, request)
+            try:
+                self.queue.put_nowait(flight)
+            except asyncio.QueueFull:
+                self.rejected += 1
+                raise QueueFullError("Too many analyses queued, retry shortly")
+            self.inflight[key] = flight
+        flight.subscribers += 1
+        return flight
+
+    async def _worker(self):
+        while True:
+            flight = await self.queue.get()
+            metrics.observe_queue_wait(time.perf_counter() - flight.queued_at, "server")
+            try:
+                async for event in self.analysis(flight.request, self.config, stream=True):
+                    await flight.publish(event)
+                await flight.finish()
+            except Exception as e:
+                logger.error(f"Analysis failed: {str(e)}")
+                await flight.finish(e)
+            finally:
+                self.inflight.pop(flight.key, None)
+                self.queue.task_done()
+
+    def stats(self) -> dict:
+        return {
+            "queued": self.queue.qsize(),
+            "queue_size": self.queue.maxsize,
+            "inflight": len(self.inflight),
+            "workers": self.workers,
+            "coalesced": self.coalesced,
+            "rejected": self.rejected,
+        }
+
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _request_error(error: BaseException) -> "JSONResponse":
+    """A request that couldn't be parsed or queued"""
+    if isinstance(error, QueueFullError):
+        return JSONResponse({"error": str(error)}, status_code=503, headers={"Retry-After": "5"})
+    return JSONResponse({"error": str(error)}, status_code=400)
+
+
+def _analysis_error(error: BaseException) -> "JSONResponse":
+    """An accepted request whose analysis failed; the worker logged the details"""
+    if isinstance(error, AgentInitializationError):
+        return JSONResponse({"error": f"Agents failed to initialize: {error}"}, status_code=502)
+    return JSONResponse({"error": "Analysis failed"}, status_code=500)
+
+
+def create_app(
+    config: EngineConfig,
+    workers: int = DEFAULT_WORKERS,
+    queue_size: int = DEFAULT_QUEUE_SIZE,
+    analysis: Callable = aiter_analysis,
+) -> "Starlette":
+    """Build the ASGI app. ``analysis`` can be swapped for a stub in tests."""
+    if not SERVER_AVAILABLE:
+        raise ImportError("starlette is not installed. Install with: pip install starlette uvicorn")
+
+    @asynccontextmanager
+    async def lifespan(app):
+        service = AnalysisService(config, workers, queue_size, analysis)
+        service.start()
+        app.state.service = service
+        try:
+            yield
+        finally:
+            await service.stop()
+
+    async def parse(request: "Request", question_type: str) -> AnalysisRequest:
+        try:
+            body = await request.json()
+        except ValueError:
+            raise ValueError("Body must be JSON")
+        if not isinstance(body, dict):
+            raise ValueError("Body must be a JSON object")
+        if not isinstance(body.get("question"), str) or not body["question"].strip():
+            raise ValueError("A non-empty 'question' is required")
+        for name in ("question_type", "complexity_level", "project_scale"):
+            if name in body and not isinstance(body[name], str):
+                raise ValueError(f"'{name}' must be a string")
+        tech_stack = body.get("tech_stack")
+        if tech_stack is not None and (not isinstance(tech_stack, list)
+                                       or not all(isinstance(item, str) for item in tech_stack)):
+            raise ValueError("'tech_stack' must be a list of strings")
+        return AnalysisRequest(
+            question=body["question"],
+            question_type=body.get("question_type", question_type),
+            tech_stack=tech_stack,
+            complexity_level=body.get("complexity_level", AnalysisRequest.complexity_level),
+            project_scale=body.get("project_scale", AnalysisRequest.project_scale),
+        )
+
+    async def respond(request: "Request", question_type: str):
+        service: AnalysisService = request.app.state.service
+        try:
+            analysis_request = await parse(request, question_type)
+            flight = service.submit(analysis_request)
+        except (ValueError, QueueFullError) as e:
+            return _request_error(e)
+
+        if request.query_params.get("stream", "").lower() in ("1", "true", "yes"):
+            return StreamingResponse(stream(flight), media_type="text/event-stream",
+                                     headers={"Cache-Control": "no-cache"})
+        try:
+            sections = sorted(await flight.sections(), key=lambda section: section.index)
+        except Exception as e:
+            return _analysis_error(e)
+        return JSONResponse({
+            "question_type": analysis_request.question_type,
+            "sections": [section.to_dict() for section in sections],
+        })
+
+    async def stream(flight: _Flight):
+        try:
+            async for event in flight.follow():
+                if isinstance(event, StreamChunk):
+                    yield _sse("chunk", {"index": event.index, "text": event.text})
+                else:
+                    yield _sse("section", {"index": event.index, **event.to_dict()})
+            yield _sse("done", {"question_type": flight.request.question_type})
+        except Exception as e:
+            yield _sse("error", {"error": str(e) if isinstance(e, AgentInitializationError) else "Analysis failed"})
+
+    async def health(request: "Request"):
+        return JSONResponse({"status": "ok", **request.app.state.service.stats()})
+
+    async def prometheus(request: "Request"):
+        return Response(metrics.render(), headers={"Content-Type": PROMETHEUS_CONTENT_TYPE})
+
+    async def experts(request: "Request"):
+        return JSONResponse({
+            "experts": [
+                {"id": slug, "name": AGENT_SPECS[ROUTES[question_type][0].agent_index][0],
+                 "question_type": question_type}
+                for slug, question_type in EXPERTS.items()
+            ],
+            "question_types": QUESTION_TYPES,
+        })
+
+    async def expert(request: "Request"):
+        question_type = EXPERTS.get(request.path_params["expert"])
+        if question_type is None:
+            return JSONResponse({"error": "Unknown expert"}, status_code=404)
+        return await respond(request, question_type)
+
+    async def analyze(request: "Request"):
+        return await respond(request, ALL_EXPERTS)
+
+    return Starlette(
+        routes=[
+            Route("/health", health),
+            Route("/metrics", prometheus),
+            Route("/experts", experts),
+            Route("/experts/{expert}", expert, methods=["POST"]),
+            Route("/analyze", analyze, methods=["POST"]),
+        ],
+        lifespan=lifespan,
+    )
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Serve the expert agents over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="analyses run at once")
+    parser.add_argument("--queue-size", type=int, default=DEFAULT_QUEUE_SIZE, help="analyses allowed to wait")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_MAX_CONCURRENCY, help="experts per analysis in parallel")
+    add_engine_arguments(parser)
+    args = parser.parse_args(argv)
+
+    api_key = os.environ.get("GEMINI_API_KEY")
+    if not api_key:
+        print("GEMINI_API_KEY is not set", file=sys.stderr)
+        return 2
+    try:
+        import uvicorn
+    except ImportError:
+        print("uvicorn is not installed. Install with: pip install uvicorn", file=sys.stderr)
+        return 2
+
+    metrics.set_trace_path(args.trace)
+    config = config_from_args(args, api_key, max_concurrency=args.concurrency)
+    uvicorn.run(create_app(config, args.workers, args.queue_size), host=args.host, port=args.port)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
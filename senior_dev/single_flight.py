@@ -0,0 +1,136 @@
+"""Share one model call between identical expert calls in flight at once.
+
+When a popular question is asked by several sessions at the same moment,
+each would call the model with the same prompt. ``SingleFlight`` keys
+every expert call on the agent and its normalized prompt (the response
+cache's key): the first caller leads and makes the call, and callers that
+arrive while it runs follow it instead. Followers get the leader's answer,
+or its error, and a streaming follower gets the text streamed so far and
+then the rest live. Once the call finishes the flight is gone; later
+callers find the answer in the response cache, if there is one.
+
+Followers make no model call, take no rate-limit quota and use no tokens;
+``stats()`` and ``senior_dev_coalesced_calls_total`` count them.
+"""
+from typing import Dict, Iterator, List, Optional, Tuple
+import threading
+import time
+
+from .response_cache import cache_key
+from .streaming import Usage
+
+
+class Flight:
+    """One model call, followed by every caller asking the same thing"""
+
+    def __init__(self, key: str):
+        self.key = key
+        self.chunks: List[str] = []
+        self.usage: Optional[Usage] = None
+        self.error: Optional[BaseException] = None
+        self.done = False
+        self.followers = 0
+        self._changed = threading.Condition()
+
+    def publish(self, text: str):
+        """A piece of streamed text from the leader"""
+        with self._changed:
+            self.chunks.append(text)
+            self._changed.notify_all()
+
+    def finish(self, content: Optional[str] = None, usage: Optional[Usage] = None,
+               error: Optional[BaseException] = None):
+        with self._changed:
+            # A leader that didn't stream hands over its whole answer at once
+            if content and not self.chunks:
+                self.chunks.append(content)
+            self.usage = usage
+            self.error = error
+            self.done = True
+            self._changed.notify_all()
+
+    def follow(self, deadline: Optional[float] = None) -> Iterator[str]:
+        """The leader's text, what was already streamed first; raises its error at the end.
+
+        ``deadline`` is a ``time.perf_counter()`` time to stop waiting at.
+        """
+        position = 0
+        while True:
+            with self._changed:
+                while not self.done and len(self.chunks) == position:
+                    remaining = None if deadline is None else deadline - time.perf_counter()
+                    if remaining is not None and remaining <= 0:
+                        raise TimeoutError("The shared model call did not finish in time")
+                    self._changed.wait(remaining)
+                pending = self.chunks[position:]
+                finished = self.done
+            position += len(pending)
+            yield from pending
+            if finished and position == len(self.chunks):
+                if self.error is not None:
+                    raise self.error
+                return
+
+    def wait(self, deadline: Optional[float] = None) -> str:
+        """The leader's whole answer"""
+        return "".join(self.follow(deadline))
+
+
+class SingleFlight:
+    """Identical expert calls in flight at the same time, by agent and prompt"""
+
+    def __init__(self):
+        self._flights: Dict[str, Flight] = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+
+    def join(self, agent, message: str) -> Tuple[Flight, bool]:
+        """The flight for this call, and whether the caller leads it.
+
+        A leader must ``land()`` its flight, whatever happens to the call.
+        """
+        key = cache_key(agent, message)
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.followers += 1
+                self.coalesced += 1
+                return flight, False
+            flight = self._flights[key] = Flight(key)
+            self.leaders += 1
+            return flight, True
+
+    def abandon(self, flight: Flight) -> bool:
+        """Take a flight nobody follows out of reach, so its leader may stop; False if someone follows it"""
+        with self._lock:
+            if flight.followers:
+                return False
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+            return True
+
+    def land(self, flight: Flight, content: Optional[str] = None, usage: Optional[Usage] = None,
+             error: Optional[BaseException] = None):
+        """Finish a flight this caller leads and let its followers go"""
+        with self._lock:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+        flight.finish(content, usage, error)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"inflight": len(self._flights), "leaders": self.leaders, "coalesced": self.coalesced}
+
+
+_shared: Optional[SingleFlight] = None
+_shared_lock = threading.Lock()
+
+
+def shared_single_flight() -> SingleFlight:
+    """Process-wide instance, so calls from every session meet"""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = SingleFlight()
+        return _shared
@@ -0,0 +1,193 @@
+"""Cold start: how long a fresh process takes to paint its first page.
+
+New replicas pay for every import before they can serve anyone, so the
+heavy stacks load on first use instead: agno and the Gemini SDK when the
+first agents are built, the Google Docs clients when a user connects
+Google. ``module_available()`` answers "is it installed?" for the apps'
+optional-feature flags without importing anything.
+
+``ScriptTimer`` times each run of an app script. The first run in the
+process is recorded as ``senior_dev_startup_seconds{phase}`` (its imports,
+and the whole first page); later runs as ``senior_dev_rerun_seconds``,
+with ``scope="page"`` for the whole script and the fragment's name for a
+fragment, which reruns on its own when its widgets change.
+
+Profile a cold start from the command line::
+
+    python -m senior_dev.startup appV2.py
+    python -m senior_dev.startup app.py --top 30 --json startup.json
+
+Each run starts a fresh interpreter under ``-X importtime``, renders the
+app's first page with Streamlit's ``AppTest`` (no browser or server), and
+reports launch to first paint, the app's own phases, import time by
+package and the slowest imports.
+"""
+from collections import defaultdict
+from typing import Dict, List, Optional
+import argparse
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from .metrics import metrics
+
+_first_run_lock = threading.Lock()
+_first_run_claimed = False
+_first_run: Dict[str, float] = {}
+
+
+def module_available(*names: str) -> bool:
+    """Whether every module in ``names`` is installed, without importing it"""
+    for name in names:
+        try:
+            if importlib.util.find_spec(name) is None:
+                return False
+        except (ImportError, ValueError):
+            return False
+    return True
+
+
+def first_run() -> Dict[str, float]:
+    """Phase timings of this process's first script run, once it has finished"""
+    with _first_run_lock:
+        return dict(_first_run)
+
+
+class ScriptTimer:
+    """Times one run of an app script from its top, or of one of its fragments"""
+
+    def __init__(self, started: Optional[float] = None, scope: str = "page"):
+        global _first_run_claimed
+        # ``started`` is a ``time.perf_counter()`` time, taken before the script's imports
+        self.started = time.perf_counter() if started is None else started
+        self.scope = scope
+        self.phases: Dict[str, float] = {}
+        self.first = False
+        if scope == "page":
+            with _first_run_lock:
+                self.first, _first_run_claimed = not _first_run_claimed, True
+
+    def mark(self, phase: str) -> float:
+        """Seconds from the top of the script to ``phase``"""
+        self.phases[phase] = elapsed = time.perf_counter() - self.started
+        return elapsed
+
+    def finish(self):
+        """Call at the end of the script"""
+        self.mark("first_paint" if self.first else "rerun")
+        if not self.first:
+            metrics.observe("senior_dev_rerun_seconds", self.phases["rerun"], (self.scope,))
+            return
+        for phase, seconds in self.phases.items():
+            metrics.observe("senior_dev_startup_seconds", seconds, (phase,))
+        with _first_run_lock:
+            _first_run.update(self.phases)
+
+
+# Runs in the profiled interpreter: render the first page, then report the timings
+_PROBE = """
+import json, sys, time
+from streamlit.testing.v1 import AppTest
+app = AppTest.from_file(sys.argv[1], default_timeout=300)
+for key, value in json.loads(sys.argv[2]).items():
+    app.secrets[key] = value
+app.run()
+from senior_dev.startup import first_run
+print(json.dumps({"painted_at": time.time(), "phases": first_run(),
+                  "exceptions": [str(e.value) for e in app.exception]}))
+"""
+
+
+def parse_importtime(output: str) -> List[dict]:
+    """The modules in ``-X importtime`` output, with self and cumulative seconds"""
+    modules = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|", 2)
+        modules.append({"module": name.strip(), "self": int(own) / 1e6, "cumulative": int(cumulative) / 1e6})
+    return modules
+
+
+def by_package(modules: List[dict]) -> Dict[str, float]:
+    """Import seconds per top-level package, slowest first"""
+    totals = defaultdict(float)
+    for module in modules:
+        totals[module["module"].split(".")[0]] += module["self"]
+    return dict(sorted(totals.items(), key=lambda item: item[1], reverse=True))
+
+
+def profile(app_path: str, secrets: Optional[dict] = None) -> dict:
+    """Cold-start one app in a fresh interpreter and measure it"""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [os.getcwd(), os.environ.get("PYTHONPATH")])))
+    launched = time.time()
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _PROBE, os.path.abspath(app_path), json.dumps(secrets or {})],
+        capture_output=True, text=True, env=env,
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"{app_path} failed to start:\n{completed.stderr[-2000:]}")
+    report = json.loads(completed.stdout.strip().splitlines()[-1])
+    modules = parse_importtime(completed.stderr)
+    return {
+        "app": app_path,
+        "first_paint": report["painted_at"] - launched,
+        "phases": report["phases"],
+        "exceptions": report["exceptions"],
+        "import_seconds": sum(module["self"] for module in modules),
+        "packages": by_package(modules),
+        "modules": sorted(modules, key=lambda module: module["cumulative"], reverse=True),
+    }
+
+
+def format_report(result: dict, top: int = 15) -> str:
+    phases = ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in result["phases"].items())
+    lines = [
+        f"{result['app']}: first paint {result['first_paint']:.2f}s after launch "
+        f"({result['import_seconds']:.2f}s importing {len(result['modules'])} modules)",
+        f"  script: {phases or 'not recorded'}",
+        "",
+        f"{'package':<32} {'import (s)':>10}",
+    ]
+    lines += [f"{package:<32} {seconds:>10.3f}" for package, seconds in list(result["packages"].items())[:top]]
+    lines += ["", f"{'slowest imports (cumulative)':<60} {'(s)':>8}"]
+    lines += [f"{module['module']:<60} {module['cumulative']:>8.3f}" for module in result["modules"][:top]]
+    for error in result["exceptions"]:
+        lines.append(f"exception on first run: {error}")
+    return "\n".join(lines)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Profile an app's cold start and imports.")
+    parser.add_argument("app", help="the Streamlit script, e.g. appV2.py")
+    parser.add_argument("--secret", action="append", default=[], metavar="KEY=VALUE",
+                        help="secret for the run (JSON values allowed); a placeholder GEMINI_API_KEY is set")
+    parser.add_argument("--top", type=int, default=15, help="packages and modules to list")
+    parser.add_argument("--json", dest="json_path", help="write the full report to this file")
+    args = parser.parse_args(argv)
+
+    secrets = {"GEMINI_API_KEY": "startup-profile"}
+    for item in args.secret:
+        key, _, value = item.partition("=")
+        try:
+            secrets[key] = json.loads(value)
+        except ValueError:
+            secrets[key] = value
+    try:
+        result = profile(args.app, secrets)
+    except RuntimeError as e:
+        print(str(e), file=sys.stderr)
+        return 1
+    print(format_report(result, args.top))
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,126 @@
+from typing import Iterable, Iterator, NamedTuple, Optional, Tuple
+import time
+
+# Minimum seconds between markdown re-renders while a response streams in
+DEFAULT_RENDER_INTERVAL = 0.15
+
+
+class AgentRunError(RuntimeError):
+    """An agent reported a failed run instead of raising"""
+
+
+class Usage(NamedTuple):
+    """Tokens one agent call used; ``estimated`` if the model didn't report them.
+
+    ``cached_tokens`` is the part of the prompt served from a cached prefix
+    instead of being sent with the call.
+    """
+    input_tokens: int
+    output_tokens: int
+    estimated: bool = False
+    cached_tokens: int = 0
+
+
+def estimate_tokens(text: Optional[str]) -> int:
+    """Rough token count, about four characters per token"""
+    return (len(text) + 3) // 4 if text else 0
+
+
+def usage_of(output) -> Optional[Usage]:
+    """Token usage reported on an agno run output or event, if any"""
+    metrics = getattr(output, "metrics", None)
+    input_tokens = getattr(metrics, "input_tokens", None) or 0
+    output_tokens = getattr(metrics, "output_tokens", None) or 0
+    if not input_tokens and not output_tokens:
+        return None
+    return Usage(input_tokens, output_tokens, cached_tokens=getattr(metrics, "cache_read_tokens", None) or 0)
+
+
+def run_agent(agent, message: str) -> Tuple[str, Optional[Usage]]:
+    """Run an agent and return its answer and usage, raising if the run failed"""
+    response = agent.run(message)
+    # agno reports model errors on the response rather than raising
+    if getattr(response, "status", None) == "ERROR":
+        raise AgentRunError(response.content or f"{agent.name} failed")
+    return response.content, usage_of(response)
+
+
+class ContentStream:
+    """Runs an agent in streaming mode and iterates its text chunks.
+
+    ``first_token_at`` is set when the first text arrives and ``usage``
+    once the run ends, if the model reported it.
+    """
+
+    def __init__(self, agent, message: str):
+        self.agent = agent
+        self.message = message
+        self.first_token_at: Optional[float] = None
+        self.usage: Optional[Usage] = None
+
+    def __iter__(self) -> Iterator[str]:
+        for chunk in self.agent.run(self.message, stream=True):
+            if getattr(chunk, "event", None) == "RunError":
+                raise AgentRunError(getattr(chunk, "content", None) or f"{self.agent.name} failed")
+            self.usage = usage_of(chunk) or self.usage
+            # Streaming runs also emit non-text events (run started, tool calls)
+            content = getattr(chunk, "content", None)
+            if isinstance(content, str) and content:
+                if self.first_token_at is None:
+                    self.first_token_at = time.perf_counter()
+                yield content
+
+
+def iter_content(agent, message: str) -> Iterator[str]:
+    """Run an agent in streaming mode and yield its text chunks"""
+    yield from ContentStream(agent, message)
+
+
+class MarkdownStream:
+    """Accumulates streamed text and re-renders it into a placeholder.
+
+    Re-rendering markdown is proportional to the text so far, so doing it on
+    every token is quadratic; updates are throttled to at most one per
+    ``interval`` seconds and ``finish()`` always renders the final text.
+    """
+
+    def __init__(self, placeholder, interval: float = DEFAULT_RENDER_INTERVAL, cursor: str = " ▌"):
+        self.placeholder = placeholder
+        self.interval = interval
+        self.cursor = cursor
+        self.parts = []
+        self.started_at = time.perf_counter()
+        self.first_token_at: Optional[float] = None
+        self._last_render = 0.0
+
+    @property
+    def text(self) -> str:
+        return "".join(self.parts)
+
+    @property
+    def time_to_first_token(self) -> Optional[float]:
+        if self.first_token_at is None:
+            return None
+        return self.first_token_at - self.started_at
+
+    def write(self, chunk: str):
+        now = time.perf_counter()
+        if self.first_token_at is None:
+            self.first_token_at = now
+        self.parts.append(chunk)
+        if now - self._last_render >= self.interval:
+            self.placeholder.markdown(self.text + self.cursor)
+            self._last_render = now
+
+    def finish(self) -> str:
+        text = self.text
+        self.placeholder.markdown(text)
+        return text
+
+
+def render_stream(chunks: Iterable[str], placeholder, interval: float = DEFAULT_RENDER_INTERVAL) -> str:
+    """Write streamed chunks into a placeholder and return the full text"""
+    stream = MarkdownStream(placeholder, interval)
+    for chunk in chunks:
+        stream.write(chunk)
+    return stream.finish()
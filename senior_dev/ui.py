@@ -0,0 +1,488 @@
+"""Streamlit pieces shared by ``app.py`` and ``appV2.py``.
+
+Both apps wire the engine the same way: ``AssistantUI`` reads the
+secrets each script run into the engine config and the process-wide
+worker pool, job runner and conversation store, and renders what the
+apps have in common (analyses as they stream in, followed background
+jobs, the performance sidebar). The apps keep their own page layout and
+analysis form, and appV2 its Google Docs export, hooked in through
+``render_analysis(on_section=...)`` and ``watch_job(on_finish=...)``.
+"""
+from contextlib import closing
+from typing import Callable, Optional
+import logging
+
+import streamlit as st
+
+from .agents import AGENT_SPECS, registry
+from .budget import Summarizer
+from .config import config_from_secrets
+from .conversation import DEFAULT_HISTORY_TOKENS, DEFAULT_RECENT_TURNS, Conversation, shared_conversation_store
+from .core import AUTO_ROUTE, AgentInitializationError, AnalysisRequest, iter_analysis
+from .fanout import StreamChunk
+from .jobs import DEFAULT_JOBS_PATH, DEFAULT_RUNNER_THREADS, POLL_SECONDS, shared_job_runner, shared_job_store
+from .metrics import metrics, serve_metrics
+from .prefetch import DEFAULT_SETTLE_SECONDS, Prefetcher
+from .resilience import CircuitOpenError
+from .router import DEFAULT_MIN_CONFIDENCE, DEFAULT_THRESHOLD as DEFAULT_ROUTING_THRESHOLD, shared_router
+from .startup import first_run
+from .streaming import MarkdownStream
+from .workers import shared_worker_pool
+
+logger = logging.getLogger(__name__)
+
+
+# Describe where a cached answer came from
+def cache_caption(hit) -> str:
+    if hit.semantic:
+        return (f"🧠 Served from the semantic cache: {hit.similarity:.0%} similar to an earlier question "
+                f"\"{hit.matched_question[:80]}\"")
+    return "⚡ Served from the response cache"
+
+# Report how a long question was cut down to fit the experts' prompts
+def compaction_caption(compactions) -> str:
+    sizes = sorted({compaction.compacted_tokens for compaction in compactions})
+    size = f"{sizes[0]:,}" if len(sizes) == 1 else f"{sizes[0]:,}–{sizes[-1]:,}"
+    steps = max((compaction.steps for compaction in compactions), key=len)
+    return (f"✂️ Your input was compacted from {compactions[0].original_tokens:,} to {size} tokens "
+            f"to fit the prompt budget ({'; '.join(steps)})")
+
+# Explain why an expert's section is missing or cut short
+def failure_notice(result) -> str:
+    if result.timed_out:
+        return f"⏱️ {result.error}"
+    if isinstance(result.error, CircuitOpenError):
+        return "🔌 The model is failing right now, so this expert was skipped. Please try again in a moment."
+    retried = f" after {result.attempts} attempts" if result.attempts > 1 else ""
+    cut = " part way through its answer" if result.partial else ""
+    return f"⚠️ This expert failed{cut}{retried}. The other sections are unaffected."
+
+
+def prefetch_summary(speculation) -> str:
+    steps = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in speculation.steps.items())
+    called = f"; {speculation.expert} was asked ahead" if speculation.expert else ""
+    total = len(speculation.routed.sections) if speculation.routed else 0
+    return (f"**Prefetch:** {speculation.head_start:.1f}s head start ({steps or 'nothing done yet'}), "
+            f"{speculation.cached} of {total} answers already cached{called}")
+
+
+def routing_caption(request: AnalysisRequest) -> str:
+    names = request.agent_names
+    saved = len(AGENT_SPECS) - len(names)
+    if not saved:
+        return "🧭 Auto-routing: asking all experts"
+    return f"🧭 Auto-routed to {' and '.join(names)}, saving {saved} of {len(AGENT_SPECS)} expert calls"
+
+# Format prompt-cache latency for the metrics panel
+def cached_vs_inline(entry: dict, name: str) -> str:
+    """Mean seconds with and without the cached prompt, from metrics.prefix_savings()"""
+    return "/".join(f"{entry[key]:.2f}" if key in entry else "-" for key in (f"{name}_cached", f"{name}_inline"))
+
+
+# Captions under an analysis, as (kind, text) so they can be shown again later
+def analysis_notes(results, timings: dict) -> list:
+    notes = []
+    failed = [result for result in results if result.error]
+    if failed and len(failed) == len(results):
+        notes.append(("error", "⚠️ None of the experts could answer. Please try again."))
+    elif failed:
+        notes.append(("caption", f"⚠️ {len(results) - len(failed)} of {len(results)} experts answered; ask again to retry the rest"))
+
+    cache_hits = [result.cache_hit for result in results if result.cached]
+    if len(results) == 1 and cache_hits:
+        notes.append(("caption", cache_caption(cache_hits[0])))
+    elif cache_hits:
+        notes.append(("caption", f"⚡ {len(cache_hits)} of {len(results)} sections served from cache"))
+        semantic_hits = [hit for hit in cache_hits if hit.semantic]
+        if semantic_hits:
+            notes.append(("caption", cache_caption(min(semantic_hits, key=lambda hit: hit.similarity))))
+
+    rate_wait = max((result.rate_wait for result in results), default=0.0)
+    if rate_wait >= 1:
+        notes.append(("caption", f"🚦 Waited {rate_wait:.1f}s for the shared API quota"))
+
+    compactions = timings.get("compaction") or []
+    if any(compaction.compacted for compaction in compactions):
+        notes.append(("caption", compaction_caption(compactions)))
+    return notes
+
+
+def show_notes(notes: list):
+    for kind, text in notes:
+        if kind == "error":
+            st.error(text)
+        else:
+            st.caption(text)
+
+
+def show_analysis(analysis: dict):
+    """The last analysis, from session state, without asking the experts again"""
+    sections = analysis["sections"]
+    for i, (heading, content, notice) in enumerate(sections):
+        st.subheader(heading)
+        if content:
+            st.markdown(content)
+        if notice:
+            st.warning(notice)
+        if i < len(sections) - 1:
+            st.markdown("---")
+    show_notes(analysis["notes"])
+
+
+def keep_analysis(request: AnalysisRequest, results, notes: list):
+    """Keep an analysis in session state, so later reruns show it again instead of losing it"""
+    st.session_state.last_analysis = {
+        "sections": [(result.heading, result.content, failure_notice(result) if result.error else None)
+                     for result in results],
+        "notes": ([("caption", routing_caption(request))] if request.question_type == AUTO_ROUTE else []) + notes,
+    }
+
+
+def log_failures(results):
+    for result in results:
+        if result.error:
+            logger.error(f"{result.agent_name} failed after {result.attempts} attempt(s): {str(result.error)}")
+
+
+poll_fragment = st.fragment(run_every=POLL_SECONDS) if hasattr(st, "fragment") else (lambda func: func)
+
+
+class AssistantUI:
+    """The engine and session helpers the apps configure from their secrets, built every script run"""
+
+    def __init__(self):
+        secrets = self.secrets = st.secrets
+        self.config = config_from_secrets(secrets)
+        self.api_key = self.config.api_key
+        self.model_id = self.config.model_id
+
+        # Instrumentation: JSONL trace, Prometheus endpoint and the in-app panel
+        metrics.set_trace_path(secrets.get("METRICS_TRACE_PATH"))
+        if secrets.get("METRICS_PORT"):
+            serve_metrics(int(secrets.get("METRICS_PORT")))
+        self.show_metrics_panel = bool(secrets.get("METRICS_PANEL", False))
+
+        # Conversation memory: experts remember this session's earlier turns, optionally across restarts
+        self.conversation_enabled = bool(secrets.get("CONVERSATION_ENABLED", True))
+        self.conversation_store = None
+        if self.conversation_enabled and secrets.get("CONVERSATION_STORE_PATH"):
+            self.conversation_store = shared_conversation_store(secrets.get("CONVERSATION_STORE_PATH"))
+
+        # Worker mode: analyses run in a pool of local processes, off the script thread (off unless set)
+        worker_processes = int(secrets.get("WORKER_PROCESSES", 0))
+        self.worker_pool = None
+        if worker_processes > 0:
+            self.worker_pool = shared_worker_pool(secrets.to_dict(), worker_processes)
+
+        # Job queue: the analyze button queues a background job the page follows, so a reload reattaches to it (opt-in)
+        self.job_runner = None
+        if secrets.get("JOB_QUEUE_ENABLED", False):
+            self.job_runner = shared_job_runner(
+                shared_job_store(secrets.get("JOB_QUEUE_PATH", DEFAULT_JOBS_PATH)),
+                self.config,
+                self.worker_pool,
+                int(secrets.get("JOB_RUNNER_THREADS", DEFAULT_RUNNER_THREADS)),
+            )
+
+        # Smart routing: a local classifier picks the experts for auto-routed questions
+        self.routing_options = (
+            secrets.get("SMART_ROUTING_EXAMPLES_PATH"),
+            float(secrets.get("SMART_ROUTING_THRESHOLD", DEFAULT_ROUTING_THRESHOLD)),
+            float(secrets.get("SMART_ROUTING_MIN_CONFIDENCE", DEFAULT_MIN_CONFIDENCE)),
+        )
+
+        # Speculative prefetch: prepare for the question while the form is still being filled in (opt-in)
+        self.prefetch_enabled = bool(secrets.get("SPECULATIVE_PREFETCH", False))
+
+    # Tell the user when they are queued behind other users for the API quota
+    def quota_caption(self, calls: int) -> str:
+        rate_limiter = self.config.rate_limiter
+        if rate_limiter is None:
+            return ""
+        waiting = rate_limiter.stats()["waiting"]
+        wait = rate_limiter.estimated_wait(calls)
+        if not waiting and wait < 1:
+            return ""
+        ahead = f"{waiting} model call{'s' if waiting != 1 else ''} ahead of you" if waiting else "it is nearly used up"
+        return f"🚦 The API quota is shared with other users and {ahead}; all experts should be running within about {wait:.0f}s"
+
+    # This session's conversation, restored from the store (by URL) on first use
+    def current_conversation(self) -> Conversation:
+        conversation = st.session_state.get("conversation")
+        if conversation is None:
+            conversation_id = st.query_params.get("conversation")
+            data = self.conversation_store.load(conversation_id) if self.conversation_store and conversation_id else None
+            conversation = Conversation.from_dict(data) if data else Conversation()
+            st.session_state.conversation = conversation
+        # Limits come from the secrets, not from what was stored
+        conversation.max_tokens = int(self.secrets.get("CONVERSATION_MAX_TOKENS", DEFAULT_HISTORY_TOKENS))
+        conversation.recent_turns = int(self.secrets.get("CONVERSATION_RECENT_TURNS", DEFAULT_RECENT_TURNS))
+        conversation.summarizer = (Summarizer(self.api_key, self.model_id)
+                                   if self.secrets.get("CONVERSATION_SUMMARIZE", False) else None)
+        if self.conversation_store:
+            st.query_params["conversation"] = conversation.id
+        return conversation
+
+    def new_conversation(self):
+        """Forget this session's conversation, in the store too"""
+        if self.conversation_store:
+            self.conversation_store.delete(self.current_conversation().id)
+        st.session_state.conversation = Conversation()
+
+    def remember_turn(self, request: AnalysisRequest, responses: dict):
+        """Add the experts' answers to the conversation and persist it"""
+        conversation = self.current_conversation()
+        conversation.record(request.question, {
+            name: responses.get(section.heading)
+            for name, section in zip(request.agent_names, request.sections)
+        })
+        if self.conversation_store:
+            self.conversation_store.save(conversation)
+
+    def expert_router(self):
+        return shared_router(*self.routing_options)
+
+    def session_prefetcher(self) -> Prefetcher:
+        """This session's prefetcher, following the secrets"""
+        prefetcher = st.session_state.get("prefetcher")
+        if prefetcher is None:
+            prefetcher = st.session_state.prefetcher = Prefetcher(self.config)
+        prefetcher.config = self.config
+        # Called off the script thread, so it reads no secrets
+        prefetcher.router = self.expert_router
+        prefetcher.settle = float(self.secrets.get("SPECULATIVE_SETTLE_SECONDS", DEFAULT_SETTLE_SECONDS))
+        prefetcher.call_expert = bool(self.secrets.get("SPECULATIVE_EXPERT_CALL", False))
+        return prefetcher
+
+    def render_metrics_panel(self):
+        """Sidebar breakdown of this session's last request, plus process totals"""
+        with st.sidebar.expander("📈 Request Metrics"):
+            trace = st.session_state.get("last_timings", {}).get("trace")
+            if trace:
+                st.markdown(f"**Last request:** {trace['elapsed']:.2f}s total, "
+                            f"{trace['agent_setup'] * 1000:.0f} ms agent setup")
+                st.table([
+                    {
+                        "Expert": section["agent"],
+                        "Queue (s)": section["queue_wait"],
+                        "TTFT (s)": section["ttft"] if section["ttft"] is not None else "-",
+                        "Model (s)": section["elapsed"],
+                        # ~ marks estimated counts
+                        "Tokens in/out": f"{section['input_tokens']}/{section['output_tokens']}"
+                                         + ("~" if section["tokens_estimated"] else ""),
+                        "Cache": "hit" if section["cached"] else "miss",
+                    }
+                    for section in trace["sections"]
+                ])
+            speculation = st.session_state.get("last_prefetch")
+            if speculation:
+                st.markdown(prefetch_summary(speculation))
+            # appV2's Google Docs export
+            job = st.session_state.get("docs_export")
+            if job is not None and job.elapsed is not None:
+                st.markdown(f"**Last Docs export:** {job.elapsed:.2f}s, {job.batches_done} batches")
+            totals = metrics.totals()
+            st.markdown(f"**Process totals:** {totals['requests']} requests, "
+                        f"{totals['prompt_tokens']:,} prompt / {totals['completion_tokens']:,} completion tokens, "
+                        f"{totals['cache_hits']} of {totals['cache_lookups']} cache lookups hit")
+            startup = first_run()
+            if startup:
+                st.markdown(f"**Cold start:** first page in {startup['first_paint']:.2f}s, "
+                            f"{startup['imports']:.2f}s of it imports")
+            savings = metrics.prefix_savings()
+            if self.config.prefix_cache and savings:
+                st.markdown(f"**Prompt cache:** {totals['cached_prompt_tokens']:,} prompt tokens not resent")
+                st.table([
+                    {
+                        "Expert": agent,
+                        "Tokens saved": entry["cached_prompt_tokens"],
+                        "Model cached/inline (s)": cached_vs_inline(entry, "model"),
+                        "TTFT cached/inline (s)": cached_vs_inline(entry, "ttft"),
+                    }
+                    for agent, entry in savings.items()
+                ])
+
+    # Run the experts on this script thread, or in the worker pool
+    def run_experts(self, request: AnalysisRequest, stream: bool, timings: dict):
+        if self.worker_pool:
+            return self.worker_pool.iter_analysis(request, stream=stream, timings=timings)
+        return iter_analysis(request, self.config, stream=stream, timings=timings)
+
+    # Render each expert's section as its result arrives, streaming text in if enabled
+    def render_analysis(self, request: AnalysisRequest, stream: bool,
+                        on_section: Optional[Callable] = None) -> dict:
+        """Run and render a request; ``on_section`` gets each answer as it completes"""
+        # iter_analysis fills this in, even if the run fails part way
+        timings = st.session_state.last_timings = {}
+        sections = request.sections
+        results = []
+        if stream:
+            # Every section streams into its own placeholder at once
+            status = sections[0].status if len(sections) == 1 else "🧠 All experts analyzing in parallel..."
+            with st.spinner(status):
+                streams = []
+                for i, section in enumerate(sections):
+                    st.subheader(section.heading)
+                    streams.append(MarkdownStream(st.empty()))
+                    if i < len(sections) - 1:
+                        st.markdown("---")
+                with closing(self.run_experts(request, True, timings)) as events:
+                    for event in events:
+                        stream = streams[event.index]
+                        if isinstance(event, StreamChunk):
+                            stream.write(event.text)
+                            continue
+                        results.append(event)
+                        if event.error:
+                            # Keep whatever streamed before the failure, with a note under it
+                            with stream.placeholder.container():
+                                if event.partial:
+                                    st.markdown(event.content)
+                                st.warning(failure_notice(event))
+                        else:
+                            stream.finish()
+                            if on_section:
+                                on_section(event)
+        else:
+            with closing(self.run_experts(request, False, timings)) as events:
+                # Sections render in fixed order, each as soon as its expert returns
+                for i, section in enumerate(sections):
+                    with st.spinner(section.status):
+                        result = next(events)
+                    results.append(result)
+                    st.subheader(section.heading)
+                    if result.error:
+                        st.warning(failure_notice(result))
+                    else:
+                        st.markdown(result.content)
+                        if on_section:
+                            on_section(result)
+                    if i < len(sections) - 1:
+                        st.markdown("---")
+                # Run to the end, so a worker's timings arrive too
+                results.extend(events)
+
+        log_failures(results)
+        notes = analysis_notes(results, timings)
+        show_notes(notes)
+
+        results.sort(key=lambda result: result.index)
+        keep_analysis(request, results, notes)
+        return {result.heading: result.content for result in results if result.error is None}
+
+    # Background jobs: the page follows a queued analysis instead of running it
+    def watched_job(self):
+        """The job this session is following; in a new session, the one in the URL"""
+        if "job_id" not in st.session_state:
+            st.session_state.job_id = st.query_params.get("job") if self.job_runner else None
+        return st.session_state.job_id
+
+    def start_job(self, request: AnalysisRequest, stream: bool):
+        st.session_state.job_id = self.job_runner.submit(request, stream)
+        # A reload, or the link, reattaches to it
+        st.query_params["job"] = st.session_state.job_id
+
+    def show_job(self, job):
+        """A job in progress: finished sections, text streamed so far, and the experts still working"""
+        if job.status == "queued":
+            st.info("⏳ Waiting for a free worker..." if not job.sections else "⏳ Resuming the experts that hadn't finished...")
+        sections = job.request.sections
+        for i, section in enumerate(sections):
+            st.subheader(section.heading)
+            result = job.sections.get(i)
+            if result is not None:
+                if result.content:
+                    st.markdown(result.content)
+                if result.error:
+                    st.warning(failure_notice(result))
+            elif i in job.partial:
+                st.markdown(job.partial[i] + " ▌")
+            else:
+                st.caption(f"⏳ {section.status}")
+            if i < len(sections) - 1:
+                st.markdown("---")
+
+    def finish_job(self, job):
+        """Keep a finished job for the page like an inline analysis; returns its responses if this
+        page is the first to see it (and so records the turn), else None"""
+        results = job.results
+        notes = analysis_notes(results, job.timings) if results else []
+        if job.error_type == AgentInitializationError.__name__:
+            notes += [("error", f"Error initializing agents: {job.error}"),
+                      ("error", "⚠️ Agents failed to initialize. Please check your API key.")]
+        elif job.error:
+            notes.append(("error", "⚠️ An error occurred during analysis. Please try again."))
+        st.session_state.last_timings = job.timings
+        keep_analysis(job.request, results, notes)
+        st.session_state.job_id = None
+        if not self.job_runner.store.deliver(job.id):
+            return None
+        if job.error:
+            logger.error(f"Processing error: {job.error}")
+        log_failures(results)
+        responses = {result.heading: result.content for result in results if result.error is None}
+        if self.conversation_enabled and not job.error:
+            self.remember_turn(job.request, responses)
+        return responses
+
+    @poll_fragment
+    def watch_job(self, job_id: str, on_finish: Optional[Callable] = None):
+        """Re-read the job every poll until it finishes, then show it like any other analysis;
+        ``on_finish`` gets the job and ``finish_job()``'s responses"""
+        job = self.job_runner.store.get(job_id)
+        if job is None:
+            st.session_state.job_id = None
+            st.warning("That analysis has expired. Please ask again.")
+            return
+        if job.finished:
+            responses = self.finish_job(job)
+            if on_finish:
+                on_finish(job, responses)
+            st.rerun()
+        self.show_job(job)
+
+    # Sidebar: Performance stats, drawn by the form after its handler so each run is counted
+    def render_performance(self):
+        config = self.config
+        registry_stats = registry.stats()
+        st.sidebar.markdown("---")
+        st.sidebar.markdown("## ⚡ Performance")
+        stat_col1, stat_col2 = st.sidebar.columns(2)
+        stat_col1.metric("Agents Built", registry_stats["built"])
+        stat_col2.metric("Agents Reused", registry_stats["reused"])
+        if config.response_cache:
+            cache_stats = config.response_cache.stats()
+            stat_col1.metric("Cache Hits", cache_stats["hits"])
+            stat_col2.metric("Cache Misses", cache_stats["misses"])
+        if config.semantic_cache:
+            semantic_stats = config.semantic_cache.stats()
+            stat_col1.metric("Semantic Hits", semantic_stats["hits"])
+            stat_col2.metric("Semantic Entries", semantic_stats["entries"])
+        if metrics.totals()["routed_calls"]:
+            stat_col1.metric("Routed Calls", metrics.totals()["routed_calls"])
+            stat_col2.metric("Calls Saved", metrics.totals()["routed_calls_saved"])
+        if metrics.totals()["coalesced_calls"]:
+            # Expert calls that waited for an identical one from another session instead of asking the model
+            stat_col1.metric("Calls Shared", metrics.totals()["coalesced_calls"])
+        resilience = config.resilience
+        if resilience and (metrics.totals()["retries"] or resilience.stats()["circuit_opened"]):
+            stat_col1.metric("Retries", metrics.totals()["retries"])
+            stat_col2.metric("Open Circuits", resilience.stats()["open_circuits"])
+        if self.job_runner:
+            job_stats = self.job_runner.store.stats()
+            stat_col1.metric("Analyses Queued", job_stats["queued"])
+            stat_col2.metric("Analyses Running", job_stats["running"])
+        if self.worker_pool:
+            pool_stats = self.worker_pool.stats()
+            stat_col1.metric("Workers Alive", f"{pool_stats['alive']}/{pool_stats['processes']}")
+            stat_col2.metric("Jobs Running", pool_stats["running"])
+        if config.rate_limiter:
+            quota_stats = config.rate_limiter.stats()
+            stat_col1.metric("Quota Queue", quota_stats["waiting"])
+            stat_col2.metric("Avg Quota Wait", f"{quota_stats['avg_wait']:.1f}s")
+        if config.prefix_cache:
+            prefix_stats = config.prefix_cache.stats()
+            stat_col1.metric("Cached Prompts", prefix_stats["prefixes"])
+            stat_col2.metric("Prompt Tokens Saved", f"{metrics.totals()['cached_prompt_tokens']:,}")
+        if self.show_metrics_panel:
+            self.render_metrics_panel()
@@ -0,0 +1,292 @@
+"""Run analyses in a pool of local worker processes.
+
+Streamlit runs every session's script in one process, so the experts'
+blocking model calls and the CPU work around them (prompt building,
+compaction, markdown) compete with the UI for one interpreter. In worker
+mode the UI only submits jobs: ``WorkerPool`` starts N processes that
+each build their own engine (agents, caches, limiter) from the app's
+secrets, take jobs from one shared queue, and send every ``StreamChunk``
+and ``SectionResult`` back to the session that asked.
+
+What must be shared between workers goes through files: the response
+cache is a SQLite file already, and the rate limiter keeps its buckets in
+a SQLite file (``RATE_LIMIT_STATE_PATH``, defaulted here if unset). The
+semantic cache stays per worker. Each worker's metrics are folded into
+the UI process's after every job, so the dashboard sees the whole pool.
+
+A worker that dies fails the jobs it was running and is replaced; the
+sections those jobs hadn't finished come back as errors, as they do if
+the pool stops delivering results at all. A job whose session stopped
+listening still runs to completion, and its answers still land in the
+cache.
+"""
+from dataclasses import dataclass, field
+from typing import Iterator, Mapping, Optional, Union
+import atexit
+import itertools
+import logging
+import multiprocessing
+import os
+import pickle
+import queue
+import sys
+import threading
+import time
+import types
+
+from .config import DEFAULT_RATE_STATE_PATH, config_from_secrets
+from .core import AgentInitializationError, AnalysisRequest, SectionResult, iter_analysis
+from .fanout import StreamChunk
+from .metrics import metrics
+from .resilience import CircuitOpenError
+
+logger = logging.getLogger(__name__)
+
+# How often the pool checks for dead workers
+HEALTH_CHECK_SECONDS = 1.0
+
+_main_lock = threading.Lock()
+
+
+@dataclass
+class _Started:
+    pid: int
+
+
+@dataclass
+class _Done:
+    timings: dict = field(default_factory=dict)
+    error: Optional[BaseException] = None
+    metrics: Optional[dict] = None
+    # The job's worker went away; its unfinished sections fail with ``error``
+    lost: bool = False
+
+
+def _portable(error: Optional[BaseException]) -> Optional[BaseException]:
+    """``error`` if it survives pickling, else the closest plain exception"""
+    if error is None:
+        return None
+    try:
+        pickle.loads(pickle.dumps(error))
+        return error
+    except Exception:
+        for kind in (AgentInitializationError, CircuitOpenError, TimeoutError):
+            if isinstance(error, kind):
+                return kind(str(error))
+        return RuntimeError(str(error))
+
+
+def _worker_main(secrets: dict, jobs, results):
+    """A worker process: build the engine once, then run jobs until told to stop"""
+    logging.basicConfig(level=logging.ERROR)
+    metrics.set_trace_path(secrets.get("METRICS_TRACE_PATH"))
+    config = None
+    source = f"worker-{os.getpid()}"
+    while True:
+        job = jobs.get()
+        if job is None:
+            return
+        job_id, request, stream = job
+        results.put((job_id, _Started(os.getpid())))
+        timings = {}
+        done = _Done(timings)
+        try:
+            if config is None:
+                config = config_from_secrets(secrets)
+            for event in iter_analysis(request, config, stream=stream, timings=timings):
+                if isinstance(event, SectionResult):
+                    event.error = _portable(event.error)
+                results.put((job_id, event))
+        except Exception as e:
+            done.error = _portable(e)
+        done.metrics = {"source": source, **metrics.snapshot()}
+        results.put((job_id, done))
+
+
+def _failed_sections(request: AnalysisRequest, finished: set, error: BaseException) -> Iterator[SectionResult]:
+    """An error result for every section of ``request`` not in ``finished``"""
+    for index, (section, name) in enumerate(zip(request.sections, request.agent_names)):
+        if index not in finished:
+            yield SectionResult(index=index, agent_name=name, heading=section.heading, error=error)
+
+
+class WorkerPool:
+    """N worker processes running analyses for every session in this process"""
+
+    def __init__(self, secrets: Mapping, processes: int = 0):
+        self.settings = dict(secrets)
+        self.secrets = dict(secrets)
+        # Workers must share one rate limit, so its buckets need a file
+        if (self.secrets.get("RATE_LIMIT_RPM") or self.secrets.get("RATE_LIMIT_TPM")) \
+                and not self.secrets.get("RATE_LIMIT_STATE_PATH"):
+            self.secrets["RATE_LIMIT_STATE_PATH"] = DEFAULT_RATE_STATE_PATH
+        self.size = processes or os.cpu_count() or 1
+        # Spawned, not forked: the UI process is full of threads
+        self._context = multiprocessing.get_context("spawn")
+        self._jobs = self._context.Queue()
+        self._results = self._context.Queue()
+        self._lock = threading.Lock()
+        self._listeners = {}
+        self._running = {}
+        self._ids = itertools.count()
+        self._closed = False
+        self.completed = 0
+        self.restarted = 0
+        self._processes = [self._start() for _ in range(self.size)]
+        self._dispatcher = threading.Thread(target=self._dispatch, name="worker-results", daemon=True)
+        self._dispatcher.start()
+
+    def _start(self):
+        process = self._context.Process(
+            target=_worker_main, args=(self.secrets, self._jobs, self._results),
+            name="senior-dev-worker", daemon=True,
+        )
+        # A spawned child re-runs the parent's __main__, which here is the UI
+        # script; hand it an empty one so the worker only imports this module
+        with _main_lock:
+            main = sys.modules["__main__"]
+            sys.modules["__main__"] = types.ModuleType("__main__")
+            try:
+                process.start()
+            finally:
+                sys.modules["__main__"] = main
+        return process
+
+    def _dispatch(self):
+        # Route each worker event to the session waiting for that job
+        checked = time.monotonic()
+        while not self._closed:
+            if time.monotonic() - checked >= HEALTH_CHECK_SECONDS:
+                self._replace_dead()
+                checked = time.monotonic()
+            try:
+                job_id, event = self._results.get(timeout=HEALTH_CHECK_SECONDS)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError):
+                return
+            with self._lock:
+                listener = self._listeners.get(job_id)
+                if isinstance(event, _Started):
+                    self._running[job_id] = event.pid
+                    continue
+                if isinstance(event, _Done):
+                    self._listeners.pop(job_id, None)
+                    self._running.pop(job_id, None)
+                    self.completed += 1
+                    if event.metrics is not None:
+                        metrics.absorb(event.metrics.pop("source"), event.metrics)
+            if listener is not None:
+                listener.put(event)
+
+    def _replace_dead(self):
+        with self._lock:
+            for i, process in enumerate(self._processes):
+                if process.is_alive() or self._closed:
+                    continue
+                logger.error(f"Worker {process.pid} exited with code {process.exitcode}; starting another")
+                for job_id, pid in list(self._running.items()):
+                    if pid == process.pid:
+                        del self._running[job_id]
+                        listener = self._listeners.pop(job_id, None)
+                        if listener is not None:
+                            listener.put(_Done(error=RuntimeError("The worker running this analysis stopped"),
+                                               lost=True))
+                self._processes[i] = self._start()
+                self.restarted += 1
+
+    def iter_analysis(
+        self,
+        request: AnalysisRequest,
+        stream: bool = False,
+        timings: Optional[dict] = None,
+    ) -> Iterator[Union[StreamChunk, SectionResult]]:
+        """core.iter_analysis(), run by a worker; events arrive as the worker yields them"""
+        if self._closed:
+            raise RuntimeError("The worker pool is closed")
+        job_id = next(self._ids)
+        events = queue.Queue()
+        with self._lock:
+            self._listeners[job_id] = events
+            restarted = self.restarted
+        self._jobs.put((job_id, request, stream))
+        finished = set()
+        suspect = False
+        try:
+            while True:
+                try:
+                    event = events.get(timeout=HEALTH_CHECK_SECONDS)
+                except queue.Empty:
+                    problem = self._lost(job_id, restarted)
+                    # Twice in a row: a _Started may still have been on its way
+                    if problem is not None and suspect:
+                        event = _Done(error=RuntimeError(problem), lost=True)
+                    else:
+                        suspect = problem is not None
+                        continue
+                if isinstance(event, _Done):
+                    if timings is not None:
+                        timings.update(event.timings)
+                    if event.lost:
+                        yield from _failed_sections(request, finished, event.error)
+                        return
+                    if event.error is not None:
+                        raise event.error
+                    return
+                if isinstance(event, SectionResult):
+                    finished.add(event.index)
+                yield event
+        finally:
+            # Stop listening; the worker finishes the job on its own
+            with self._lock:
+                self._listeners.pop(job_id, None)
+
+    def _lost(self, job_id: int, restarted: int) -> Optional[str]:
+        """Why a job's events will never arrive, if it looks like they won't"""
+        if not self._dispatcher.is_alive():
+            return "The worker pool stopped delivering results"
+        with self._lock:
+            started = job_id in self._running
+            died = self.restarted > restarted
+        # A worker that died after taking the job, but before saying so, took it along
+        if not started and died and self._jobs.empty():
+            return "The worker that took this analysis stopped"
+        return None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "processes": self.size,
+                "alive": sum(1 for process in self._processes if process.is_alive()),
+                "running": len(self._running),
+                "waiting": len(self._listeners) - len(self._running),
+                "completed": self.completed,
+                "restarted": self.restarted,
+            }
+
+    def close(self):
+        self._closed = True
+        for _ in self._processes:
+            self._jobs.put(None)
+        for process in self._processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+
+
+_shared: Optional[WorkerPool] = None
+_shared_lock = threading.Lock()
+
+
+def shared_worker_pool(secrets: Mapping, processes: int = 0) -> WorkerPool:
+    """Process-wide pool; rebuilt if the secrets or size change"""
+    global _shared
+    secrets = dict(secrets)
+    with _shared_lock:
+        if _shared is not None and (_shared.size != (processes or os.cpu_count() or 1) or _shared.settings != secrets):
+            _shared.close()
+            _shared = None
+        if _shared is None:
+            _shared = WorkerPool(secrets, processes)
+            atexit.register(_shared.close)
+        return _shared
@@ -0,0 +1,35 @@
+import json
+
+from senior_dev import QUESTION_TYPES, EngineConfig
+from senior_dev.batch import completed_ids, run_batch
+
+CONFIG = EngineConfig(api_key="offline", model_id="fake:latency=fixed,median=0.01,tps=5000,tokens=20")
+
+
+def test_completed_ids_skips_lines_it_did_not_write(tmp_path):
+    output = tmp_path / "answers.jsonl"
+    output.write_text("\n".join([
+        '{"id": "done", "sections": [{"error": null}]}',
+        '{"id": "failed", "sections": [{"error": "boom"}]}',
+        "[]",
+        "{}",
+        '{"id": "odd", "sections": "none"}',
+        '{"id": "cut", "sec',
+    ]) + "\n", encoding="utf-8")
+    assert completed_ids(str(output)) == {"done"}
+
+
+def test_resume_after_a_truncated_line(tmp_path):
+    questions = tmp_path / "questions.jsonl"
+    questions.write_text("\n".join(
+        json.dumps({"id": name, "question": f"How do I {name}?", "question_type": QUESTION_TYPES[0]})
+        for name in ("shard", "cache")
+    ) + "\n", encoding="utf-8")
+    output = tmp_path / "answers.jsonl"
+    # An interrupted run left half a line
+    output.write_text('{"id": "shard", "sec', encoding="utf-8")
+
+    assert run_batch(str(questions), str(output), CONFIG, concurrency=2)["completed"] == 2
+    # Both answers survive the truncated line, so a rerun has nothing left to do
+    assert completed_ids(str(output)) == {"shard", "cache"}
+    assert run_batch(str(questions), str(output), CONFIG)["skipped"] == 2
@@ -0,0 +1,19 @@
+from senior_dev.budget import count_tokens, truncate_middle
+
+
+def test_truncate_middle_keeps_lines_that_fit():
+    lines = ["first line", "second line"]
+    assert truncate_middle(lines, 500) == (lines, 0)
+
+
+def test_truncate_middle_cuts_inside_a_single_line():
+    line = " ".join(f"word{i}" for i in range(20000))
+    lines, cut = truncate_middle([line], 500)
+    assert cut == 1
+    assert len(lines) == 1
+    # Both ends survive, joined by the marker
+    assert lines[0].startswith("word0 word1 ")
+    assert lines[0].endswith("word19998 word19999")
+    assert "characters omitted to fit the token budget" in lines[0]
+    # Over the budget only by the marker
+    assert count_tokens(lines[0]) <= 500 + 32
@@ -0,0 +1,46 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from senior_dev import QUESTION_TYPES, AnalysisRequest, EngineConfig, SectionResult, aiter_analysis, iter_analysis
+
+ALL_EXPERTS = QUESTION_TYPES[4]
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_hung_call_gives_up_its_worker_at_the_timeout(stream):
+    # One worker, no retries: each hung expert must free it for the next at its own timeout
+    config = EngineConfig(api_key="offline", model_id="fake:hang=1,hang_seconds=30", max_concurrency=1, timeout=0.3)
+    request = AnalysisRequest(f"Why does the {'streamed' if stream else 'plain'} call hang?", ALL_EXPERTS)
+    started = time.perf_counter()
+    results = [event for event in iter_analysis(request, config, stream=stream) if isinstance(event, SectionResult)]
+    assert len(results) == 4
+    assert all(result.timed_out for result in results)
+    assert time.perf_counter() - started < 4 * 0.3 + 2
+
+
+
+def fanout_threads() -> set:
+    return {thread for thread in threading.enumerate() if thread.name.startswith("fanout")}
+
+
+def test_closing_the_async_stream_stops_the_experts():
+    # ~10s of streaming per expert: closing the stream must stop the call, not just stop reading it
+    config = EngineConfig(api_key="offline", model_id="fake:latency=fixed,median=0.01,tps=20,tokens=200,seed=1",
+                          max_concurrency=1, timeout=30)
+    request = AnalysisRequest("Why does the closed stream keep going?", ALL_EXPERTS)
+    before = fanout_threads()
+
+    async def first_chunk():
+        events = aiter_analysis(request, config, stream=True)
+        await events.__anext__()
+        await events.aclose()
+
+    started = time.perf_counter()
+    asyncio.run(first_chunk())
+    while fanout_threads() - before and time.perf_counter() - started < 8:
+        time.sleep(0.05)
+    assert not fanout_threads() - before
+    assert time.perf_counter() - started < 3
@@ -0,0 +1,32 @@
+from senior_dev import QUESTION_TYPES, AnalysisRequest, EngineConfig
+from senior_dev.metrics import metrics
+from senior_dev.prefetch import Prefetcher
+from senior_dev.response_cache import ResponseCache
+from senior_dev.single_flight import SingleFlight
+
+
+def prefetch_calls() -> dict:
+    return metrics.snapshot()["counters"].get("senior_dev_prefetch_calls_total", {})
+
+
+def test_speculation_stays_out_of_the_request_metrics(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite3"))
+    config = EngineConfig(
+        api_key="offline",
+        model_id="fake:latency=fixed,median=0.01,tps=5000,tokens=20,seed=1",
+        response_cache=cache,
+        single_flight=SingleFlight(),
+    )
+    request = AnalysisRequest(question="How should I shard a job queue?", question_type=QUESTION_TYPES[0])
+    totals, answered = metrics.totals(), prefetch_calls().get(("answered",), 0)
+
+    prefetcher = Prefetcher(config, settle=0.0, call_expert=True)
+    prefetcher.update(request)
+    speculation = prefetcher.current
+    assert speculation.done.wait(10)
+
+    assert speculation.expert is not None
+    assert prefetch_calls().get(("answered",), 0) == answered + 1
+    assert metrics.totals()["requests"] == totals["requests"]
+    assert metrics.totals()["cache_lookups"] == totals["cache_lookups"]
+    assert cache.stats()["hits"] == cache.stats()["misses"] == 0
@@ -0,0 +1,86 @@
+import itertools
+
+from senior_dev import QUESTION_TYPES, EngineConfig, analyze
+from senior_dev.fake_model import FakeModelError
+from senior_dev.resilience import CircuitOpenError, Resilience, RetryPolicy, is_retryable
+
+# Fake model calls are counted per model id, so each test gets its own
+_seeds = itertools.count(1)
+
+
+def fake_config(options: str, resilience: Resilience) -> EngineConfig:
+    model_id = f"fake:latency=fixed,median=0.01,tps=5000,tokens=20,seed={next(_seeds)},{options}"
+    return EngineConfig(api_key="offline", model_id=model_id, resilience=resilience)
+
+
+def ask(config: EngineConfig):
+    result = analyze("How should I shard a job queue?", QUESTION_TYPES[0], config=config)
+    return result.sections[0]
+
+
+def test_flaky_model_is_retried():
+    resilience = Resilience(RetryPolicy(attempts=3, base_delay=0.0))
+    section = ask(fake_config("flaky=2", resilience))
+    assert section.error is None
+    assert section.content
+    assert section.attempts == 3
+    assert resilience.stats()["retries"] == 2
+
+
+def test_retries_give_up_after_the_last_attempt():
+    resilience = Resilience(RetryPolicy(attempts=2, base_delay=0.0))
+    section = ask(fake_config("flaky=5", resilience))
+    assert section.error is not None
+    assert section.attempts == 2
+
+
+def test_circuit_opens_after_repeated_failures():
+    resilience = Resilience(RetryPolicy(attempts=1), failure_threshold=2, reset_after=60.0)
+    config = fake_config("fail=1", resilience)
+    for _ in range(2):
+        section = ask(config)
+        assert section.error is not None and not isinstance(section.error, CircuitOpenError)
+    section = ask(config)
+    assert isinstance(section.error, CircuitOpenError)
+    assert resilience.stats()["open_circuits"] == 1
+
+
+def test_open_circuit_takes_no_quota():
+    resilience = Resilience(RetryPolicy(attempts=1), failure_threshold=1, reset_after=60.0)
+    resilience.breaker("model").failed()
+    waited = []
+    outcome = resilience.call("model", lambda cancelled: "answer", before_attempt=lambda: waited.append(1))
+    assert isinstance(outcome.error, CircuitOpenError)
+    assert waited == []
+
+
+def test_probe_that_never_ran_lets_the_next_one_through():
+    resilience = Resilience(RetryPolicy(attempts=1), failure_threshold=1, reset_after=0.0)
+    resilience.breaker("model").failed()
+
+    def no_quota():
+        raise TimeoutError("no quota")
+
+    assert isinstance(resilience.call("model", lambda cancelled: "answer", before_attempt=no_quota).error, TimeoutError)
+    outcome = resilience.call("model", lambda cancelled: "answer")
+    assert outcome.error is None
+    assert outcome.value == "answer"
+
+
+def test_injected_failures_are_retryable_as_a_provider_503():
+    assert is_retryable(FakeModelError("Injected model failure (503 UNAVAILABLE)"))
+    assert not is_retryable(RuntimeError("Injected model failure"))
+
+
+def test_abandoned_attempt_is_not_retried():
+    resilience = Resilience(RetryPolicy(attempts=3, attempt_timeout=0.1, base_delay=0.0))
+    calls = []
+
+    def hang(cancelled):
+        calls.append(1)
+        cancelled.wait(5)
+
+    outcome = resilience.call("model", hang)
+    assert outcome.abandoned
+    assert outcome.attempts == 1 and len(calls) == 1
+    assert resilience.stats()["retries"] == 0
@@ -0,0 +1,102 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("starlette")
+from starlette.testclient import TestClient
+
+from senior_dev.core import AgentInitializationError, EngineConfig, SectionResult
+from senior_dev.server import create_app
+
+
+def stub_analysis(release: threading.Event = None):
+    """An ``analysis`` for create_app that answers every section, once ``release`` is set"""
+    async def analysis(request, config, stream=False, timings=None, **options):
+        while release is not None and not release.is_set():
+            await asyncio.sleep(0.01)
+        for index, (section, name) in enumerate(zip(request.sections, request.agent_names)):
+            yield SectionResult(index=index, agent_name=name, heading=section.heading, content="ok")
+    return analysis
+
+
+@pytest.mark.parametrize("body", [
+    b"not json",
+    b"[]",
+    b"{}",
+    b'{"question": "   "}',
+    b'{"question": 42}',
+    b'{"question": "Why?", "tech_stack": "Python"}',
+    b'{"question": "Why?", "tech_stack": ["Python", 3]}',
+    b'{"question": "Why?", "complexity_level": 2}',
+])
+def test_bad_bodies_get_400(body):
+    with TestClient(create_app(EngineConfig(api_key="offline"), analysis=stub_analysis())) as client:
+        response = client.post("/analyze", content=body, headers={"Content-Type": "application/json"})
+    assert response.status_code == 400
+    assert "error" in response.json()
+
+
+def test_good_body_gets_sections():
+    with TestClient(create_app(EngineConfig(api_key="offline"), analysis=stub_analysis())) as client:
+        response = client.post("/experts/system-designer", json={"question": "How do I shard?", "tech_stack": ["Go"]})
+    assert response.status_code == 200
+    assert [section["content"] for section in response.json()["sections"]] == ["ok"]
+
+
+def wait_for(client: TestClient, **stats):
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        health = client.get("/health").json()
+        if all(health[name] == value for name, value in stats.items()):
+            return
+        time.sleep(0.01)
+    raise AssertionError(f"server never reached {stats}")
+
+
+def test_full_queue_gets_503():
+    release = threading.Event()
+    app = create_app(EngineConfig(api_key="offline"), workers=1, queue_size=1, analysis=stub_analysis(release))
+    with TestClient(app) as client:
+        responses = []
+
+        def ask(question):
+            responses.append(client.post("/analyze", json={"question": question}))
+
+        # One run on the only worker, one waiting in the queue
+        running = threading.Thread(target=ask, args=("first",))
+        running.start()
+        wait_for(client, inflight=1, queued=0)
+        waiting = threading.Thread(target=ask, args=("second",))
+        waiting.start()
+        wait_for(client, inflight=2, queued=1)
+
+        rejected = client.post("/analyze", json={"question": "third"})
+        release.set()
+        running.join()
+        waiting.join()
+
+    assert rejected.status_code == 503
+    assert rejected.headers["Retry-After"]
+    assert [response.status_code for response in responses] == [200, 200]
+
+
+def failing_analysis(error: BaseException):
+    """An ``analysis`` for create_app that fails with ``error``"""
+    async def analysis(request, config, stream=False, timings=None, **options):
+        raise error
+        yield
+    return analysis
+
+
+@pytest.mark.parametrize("error, status", [
+    (ValueError("secret model detail"), 500),
+    (RuntimeError("secret model detail"), 500),
+    (AgentInitializationError("bad key"), 502),
+])
+def test_analysis_failures_are_not_the_clients_fault(error, status):
+    with TestClient(create_app(EngineConfig(api_key="offline"), analysis=failing_analysis(error))) as client:
+        response = client.post("/analyze", json={"question": "Why?"})
+    assert response.status_code == status
+    assert "secret model detail" not in response.text